@@ -1,30 +1,55 @@
 # -*- coding: utf-8 -*-
 # 导入所需的库
 import os
+import sys
 import json
 import time
 import yaml
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import threading
 import asyncio
 import shutil
 import base64
+import copy
+import hmac
+import hashlib
+import secrets
+import bisect
+import ipaddress
+from array import array
+import sqlite3
+import atexit
+import collections
+import heapq
+import itertools
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs, unquote
-from datetime import datetime, timedelta
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor, Future
+from urllib.parse import parse_qs, unquote, urlsplit
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
-from typing import Dict, Any
 import uuid
+import unicodedata
 from functools import reduce
 import operator
 import traceback
 import xml.etree.ElementTree as ET
 
 # 全局变量和缓存
-POSTER_CACHE = {}  # 用于缓存海报URL，键为TMDB ID，值为包含URL和时间戳的字典
+POSTER_CACHE = None  # 海报URL缓存（PersistentKVStore），键为TMDB ID，值为包含URL和时间戳的字典
 CACHE_DIR = '/config/cache'  # 缓存目录
-POSTER_CACHE_PATH = os.path.join(CACHE_DIR, 'poster_cache.json')  # 海报缓存文件路径
+POSTER_CACHE_PATH = os.path.join(CACHE_DIR, 'poster_cache.json')  # 旧版海报缓存文件路径（仅用于迁移）
+POSTER_CACHE_DB_PATH = os.path.join(CACHE_DIR, 'poster_cache.db')  # 海报缓存数据库路径
+TMDB_CACHE_DB_PATH = os.path.join(CACHE_DIR, 'tmdb_cache.db')  # TMDB 响应缓存数据库路径
+IP_GEO_CACHE_DB_PATH = os.path.join(CACHE_DIR, 'ip_geo_cache.db')  # IP 地理位置缓存数据库路径
+DEFAULT_IP_DB_PATH = os.path.join(CACHE_DIR, 'ip_ranges.txt')  # 本地 IP 段数据库默认路径
+TELEGRAM_FILE_ID_DB_PATH = os.path.join(CACHE_DIR, 'telegram_file_ids.db')  # 已上传海报的 Telegram file_id 缓存路径
+POSTER_STORE_DIR = os.path.join(CACHE_DIR, 'posters')  # 本地海报图片缓存目录
+WEBHOOK_QUEUE_DIR = os.path.join(CACHE_DIR, 'webhook_queue')  # Webhook 事件持久化队列目录
+PENDING_DELETIONS_PATH = os.path.join(CACHE_DIR, 'pending_deletions.json')  # 旧版待删除消息文件路径（仅用于迁移）
+PENDING_DELETIONS_DB_PATH = os.path.join(CACHE_DIR, 'pending_deletions.db')  # 待删除消息持久化数据库路径
 CONFIG_PATH = '/config/config.yaml'  # 配置文件路径
 CONFIG = {}  # 全局配置字典
 DEFAULT_SETTINGS = {}  # 默认设置字典
@@ -32,14 +57,6 @@ TOGGLE_INDEX_TO_KEY = {}  # 设置菜单索引到键的映射
 TOGGLE_KEY_TO_INFO = {}  # 设置菜单键到信息的映射
 LANG_MAP = {}  # 语言代码到语言名称的映射
 LANG_MAP_PATH = os.path.join(CACHE_DIR, 'languages.json')  # 语言文件路径
-ADMIN_CACHE = {}  # 管理员权限缓存
-GROUP_MEMBER_CACHE = {}  # 群组成员权限缓存
-SEARCH_RESULTS_CACHE = {}  # 搜索结果缓存
-DELETION_TASK_CACHE: Dict[str, Any] = {}  # 删除任务缓存
-recent_playback_notifications = {}  # 最近播放通知的去重缓存
-user_context = {}  # 用户会话上下文（例如，等待用户回复）
-user_search_state = {}  # 用户搜索状态缓存
-UPDATE_PATH_CACHE = {}  # 用于在回调中传递更新路径的缓存
 EMBY_USERS_CACHE = {}   # 用于缓存Emby用户列
 
 # 设置菜单结构定义
@@ -158,13 +175,15 @@ SETTINGS_MENU_STRUCTURE = {
     'delete_user_login': {'label': '用户登录成功/失败', 'parent': 'delete_advanced_notifications', 'config_path': 'settings.auto_delete_settings.advanced.user_login', 'default': True}, 
     'delete_user_management': {'label': '用户创建/删除/更新', 'parent': 'delete_advanced_notifications', 'config_path': 'settings.auto_delete_settings.advanced.user_management', 'default': True},
     'delete_server_events': {'label': '服务器事件', 'parent': 'delete_advanced_notifications', 'config_path': 'settings.auto_delete_settings.advanced.server_events', 'default': True},
-    'system_settings': {'label': '系统设置', 'parent': 'root', 'children': ['ip_api_selection']},
-    'ip_api_selection': {'label': 'IP地理位置API设置', 'parent': 'system_settings', 'children': ['api_baidu', 'api_ip138', 'api_pconline', 'api_vore', 'api_ipapi']},
+    'system_settings': {'label': '系统设置', 'parent': 'root', 'children': ['ip_api_selection', 'runtime_stats']},
+    'runtime_stats': {'label': '运行状态与缓存统计', 'parent': 'system_settings', 'children': []},
+    'ip_api_selection': {'label': 'IP地理位置API设置', 'parent': 'system_settings', 'children': ['api_baidu', 'api_ip138', 'api_pconline', 'api_vore', 'api_ipapi', 'api_local']},
     'api_baidu': {'label': '百度 API', 'parent': 'ip_api_selection', 'config_value': 'baidu'},
     'api_ip138': {'label': 'IP138 API (需配置Token)', 'parent': 'ip_api_selection', 'config_value': 'ip138'},
     'api_pconline': {'label': '太平洋电脑 API', 'parent': 'ip_api_selection', 'config_value': 'pconline'},
     'api_vore': {'label': 'Vore API', 'parent': 'ip_api_selection', 'config_value': 'vore'},
-    'api_ipapi': {'label': 'IP-API.com', 'parent': 'ip_api_selection', 'config_value': 'ipapi'}
+    'api_ipapi': {'label': 'IP-API.com', 'parent': 'ip_api_selection', 'config_value': 'ipapi'},
+    'api_local': {'label': '本地IP数据库 (需配置数据文件)', 'parent': 'ip_api_selection', 'config_value': 'local'}
 }
 
 def build_toggle_maps():
@@ -274,32 +293,334 @@ def load_language_map():
         print(f"❌ 加载语言配置文件失败: {e}，将使用内置的精简版语言列表。")
         LANG_MAP = fallback_map
 
+class PersistentKVStore:
+    """
+    基于 SQLite（WAL 模式）的持久化键值存储：
+    - put() 先写入内存中的待写入表，由后台线程每隔 flush_interval 秒批量写入数据库（写后回写），
+      待写入条目超过 max_pending 时提前唤醒后台线程，不阻塞调用方
+    - get() 优先读取待写入表，其次查询数据库；支持按条目设置过期时间
+    - 后台线程定期清理过期条目并整理数据库文件
+    """
+
+    def __init__(self, path, flush_interval=2, compact_interval=86400, max_pending=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.compact_interval = compact_interval
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._thread = None
+        self._last_compact = time.monotonic()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+
+    def start(self):
+        """启动后台写入线程，并在进程退出时写入剩余数据。"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f'kvstore-{os.path.basename(self.path)}', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def get(self, key, default=None):
+        """读取一个未过期的值，不存在时返回 default。"""
+        key = str(key)
+        now = time.time()
+        with self._cond:
+            if key in self._pending:
+                value, expires_at = self._pending[key]
+                return default if value is None or (expires_at and expires_at <= now) else value
+        with self._db_lock:
+            row = self._conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if not row or (row[1] and row[1] <= now):
+            return default
+        return json.loads(row[0])
+
+    def put(self, key, value, ttl=None):
+        """写入一个值（ttl 为秒数，None 表示不过期），实际落盘由后台线程完成。"""
+        with self._cond:
+            self._pending[str(key)] = (value, time.time() + ttl if ttl else None)
+            self._notify_if_full_locked()
+
+    def delete(self, key):
+        """删除一个键。"""
+        with self._cond:
+            self._pending[str(key)] = (None, None)
+            self._notify_if_full_locked()
+
+    def _notify_if_full_locked(self):
+        if len(self._pending) >= self.max_pending:
+            self._cond.notify()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def items(self):
+        """返回所有未过期的 (key, value)。"""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute('SELECT key, value FROM kv WHERE expires_at IS NULL OR expires_at > ?', (time.time(),)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def __len__(self):
+        self.flush()
+        with self._db_lock:
+            return self._conn.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+
+    def flush(self):
+        """将待写入的数据在一个事务内批量写入数据库。"""
+        with self._cond:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        upserts = [(k, json.dumps(v, ensure_ascii=False), exp) for k, (v, exp) in batch.items() if v is not None]
+        deletes = [(k,) for k, (v, _) in batch.items() if v is None]
+        try:
+            with self._db_lock:
+                self._conn.execute('BEGIN')
+                if upserts:
+                    self._conn.executemany('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)', upserts)
+                if deletes:
+                    self._conn.executemany('DELETE FROM kv WHERE key = ?', deletes)
+                self._conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            print(f"❌ 写入缓存数据库 {self.path} 失败: {e}")
+            with self._db_lock:
+                if self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+            with self._cond:
+                for k, v in batch.items():
+                    self._pending.setdefault(k, v)
+            return 0
+        return len(batch)
+
+    def compact(self):
+        """删除过期条目并整理数据库文件。"""
+        self.flush()
+        with self._db_lock:
+            removed = self._conn.execute('DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)).rowcount
+            self._conn.execute('VACUUM')
+        print(f"🧹 缓存数据库 {os.path.basename(self.path)} 整理完成，清理过期条目 {removed} 条。")
+        return removed
+
+    def import_items(self, items, ttl=None):
+        """批量导入 (key, value) 数据（用于从旧格式迁移）。"""
+        for key, value in items:
+            self.put(key, value, ttl)
+        return self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_compact >= self.compact_interval:
+                    self._last_compact = time.monotonic()
+                    self.compact()
+            except Exception as e:
+                print(f"❌ 缓存数据库 {self.path} 后台写入异常: {e}")
+
+CACHE_REGISTRY = []  # 所有 BoundedTTLCache 实例，由后台清理任务统一清理过期条目
+
+class BoundedTTLCache:
+    """
+    线程安全的有界内存缓存（LRU + TTL）：
+    - 超过 maxsize 时淘汰最久未使用的条目
+    - 条目过期后在 stale_ttl 时间内仍可通过 get_entry() 以“过期”状态读取（用于过期后先返回旧值再后台刷新）
+    - 统计命中/过期命中/未命中/淘汰次数，可通过 on_evict 回调感知条目被移除
+    - 过期时间同时记录在小顶堆中，sweep() 只弹出已到期的堆顶，开销与过期条目数成正比
+    - add() 仅在键不存在（或已过期）时写入，可用于原子的防抖判断
+    """
+
+    def __init__(self, name, maxsize=1000, ttl=None, stale_ttl=0, on_evict=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.on_evict = on_evict
+        self._data = collections.OrderedDict()
+        self._expiry_heap = []  # [(清理时间, 序号, key)]，条目被覆盖或移除后的旧记录在弹出时跳过
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        CACHE_REGISTRY.append(self)
+
+    def _notify_evicted(self, evicted, reason):
+        if not self.on_evict:
+            return
+        for key, value in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"⚠️ 缓存 {self.name} 淘汰回调异常: {e}")
+
+    def _set_locked(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if expires_at is not None:
+            heapq.heappush(self._expiry_heap, (expires_at + self.stale_ttl, next(self._counter), key))
+            if len(self._expiry_heap) > 2 * self.maxsize + 64:
+                self._expiry_heap = [(exp + self.stale_ttl, next(self._counter), k) for k, (_, exp) in self._data.items() if exp is not None]
+                heapq.heapify(self._expiry_heap)
+        evicted = []
+        while len(self._data) > self.maxsize:
+            k, v = self._data.popitem(last=False)
+            evicted.append((k, v[0]))
+            self._stats['evictions'] += 1
+        return evicted
+
+    def set(self, key, value, ttl=None):
+        """写入一个条目；ttl 为 None 时使用缓存默认 TTL。"""
+        with self._lock:
+            evicted = self._set_locked(key, value, ttl)
+        self._notify_evicted(evicted, 'evicted')
+
+    def add(self, key, value, ttl=None):
+        """仅当 key 不存在（或已过期）时写入，返回是否写入成功。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or time.monotonic() < entry[1]):
+                return False
+            evicted = self._set_locked(key, value, ttl)
+        self._notify_evicted(evicted, 'evicted')
+        return True
+
+    def get_entry(self, key):
+        """返回 (value, is_stale)；不存在或已超过过期宽限期时返回 None。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and now >= expires_at:
+                if now < expires_at + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self._stats['stale_hits'] += 1
+                    return value, True
+                del self._data[key]
+                self._stats['misses'] += 1
+                self._stats['expirations'] += 1
+                expired = [(key, value)]
+            else:
+                self._data.move_to_end(key)
+                self._stats['hits'] += 1
+                return value, False
+        self._notify_evicted(expired, 'expired')
+        return None
+
+    def get(self, key, default=None):
+        """返回未过期的值，否则返回 default。"""
+        entry = self.get_entry(key)
+        return entry[0] if entry and not entry[1] else default
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def discard_where(self, predicate):
+        """移除所有键满足 predicate(key) 的条目，返回移除数量。"""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def __getitem__(self, key):
+        entry = self.get_entry(key)
+        if not entry or entry[1]:
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[1] is None or time.monotonic() < entry[1])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def sweep(self):
+        """清理已超过过期宽限期的条目，返回清理数量。"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(heap)
+                entry = self._data.get(key)
+                if entry is not None and entry[1] is not None and entry[1] + self.stale_ttl == deadline:
+                    del self._data[key]
+                    expired.append((key, entry[0]))
+            self._stats['expirations'] += len(expired)
+        self._notify_evicted(expired, 'expired')
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._data), maxsize=self.maxsize)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / lookups, 3) if lookups else 0
+        return stats
+
+def sweep_registered_caches(interval=60):
+    """清理所有已注册缓存中的过期条目，并安排下一次清理。"""
+    for cache in list(CACHE_REGISTRY):
+        try:
+            removed = cache.sweep()
+            if removed:
+                print(f"🧹 缓存 {cache.name} 清理过期条目 {removed} 条。")
+        except Exception as e:
+            print(f"⚠️ 清理缓存 {cache.name} 时异常: {e}")
+    TASK_SCHEDULER.schedule(interval, sweep_registered_caches, interval)
+
+ADMIN_CACHE = BoundedTTLCache('管理员权限缓存', maxsize=1000, ttl=300, stale_ttl=86400)  # 管理员权限缓存（5 分钟内视为有效，查询失败时可回退使用一天内的旧数据）
+GROUP_MEMBER_CACHE = BoundedTTLCache('群组成员缓存', maxsize=10000, ttl=60)  # 群组成员权限缓存
+recent_playback_notifications = BoundedTTLCache('播放通知防抖', maxsize=10000, ttl=10)  # 最近播放通知的去重缓存，有效期为播放防抖时间
+
 def load_poster_cache():
-    """加载海报缓存文件。"""
+    """打开海报缓存数据库；若存在旧版 poster_cache.json，则导入后将其重命名。"""
     global POSTER_CACHE
-    print(f"🖼️ 尝试加载海报缓存：{POSTER_CACHE_PATH}")
-    if not os.path.exists(POSTER_CACHE_PATH):
-        POSTER_CACHE = {}
-        print("⚠️ 海报缓存文件不存在，使用空缓存。")
-        return
+    print(f"🖼️ 尝试加载海报缓存：{POSTER_CACHE_DB_PATH}")
     try:
-        with open(POSTER_CACHE_PATH, 'r', encoding='utf-8') as f:
-            POSTER_CACHE = json.load(f)
-        print("✅ 海报缓存加载成功。")
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        print(f"❌ 加载海报缓存失败: {e}，将使用空缓存。")
-        POSTER_CACHE = {}
+        POSTER_CACHE = PersistentKVStore(POSTER_CACHE_DB_PATH)
+    except (sqlite3.Error, OSError) as e:
+        print(f"❌ 打开海报缓存数据库失败: {e}，将使用内存数据库。")
+        POSTER_CACHE = PersistentKVStore(':memory:')
+        return
+    if os.path.exists(POSTER_CACHE_PATH):
+        try:
+            with open(POSTER_CACHE_PATH, 'r', encoding='utf-8') as f:
+                legacy_cache = json.load(f)
+            imported = POSTER_CACHE.import_items(legacy_cache.items())
+            os.replace(POSTER_CACHE_PATH, POSTER_CACHE_PATH + '.migrated')
+            print(f"✅ 已将 {imported} 条旧版海报缓存迁移到数据库。")
+        except (json.JSONDecodeError, OSError, AttributeError) as e:
+            print(f"❌ 迁移旧版海报缓存失败: {e}")
+    print("✅ 海报缓存加载成功。")
 
 def save_poster_cache():
-    """保存海报缓存到文件。"""
-    print(f"💾 尝试保存海报缓存：{POSTER_CACHE_PATH}")
-    try:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(POSTER_CACHE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(POSTER_CACHE, f, indent=4)
-        print("✅ 海报缓存保存成功。")
-    except Exception as e:
-        print(f"❌ 保存海报缓存失败: {e}")
+    """立即将海报缓存中尚未落盘的数据写入数据库。"""
+    POSTER_CACHE.flush()
 
 # 初始化：构建默认设置、菜单映射，加载配置、语言和缓存
 DEFAULT_SETTINGS = _build_default_settings()
@@ -313,6 +634,9 @@ TELEGRAM_TOKEN = CONFIG.get('telegram', {}).get('token')
 ADMIN_USER_ID = CONFIG.get('telegram', {}).get('admin_user_id')
 GROUP_ID = CONFIG.get('telegram', {}).get('group_id')
 CHANNEL_ID = CONFIG.get('telegram', {}).get('channel_id')
+TELEGRAM_WEBHOOK_URL = CONFIG.get('telegram', {}).get('webhook_url')
+TELEGRAM_WEBHOOK_SECRET = CONFIG.get('telegram', {}).get('webhook_secret') or secrets.token_urlsafe(32)  # 未配置时每次启动随机生成并注册
+TELEGRAM_WEBHOOK_PATH = CONFIG.get('telegram', {}).get('webhook_path') or (urlsplit(TELEGRAM_WEBHOOK_URL).path if TELEGRAM_WEBHOOK_URL else None) or '/telegram/webhook'
 
 TMDB_API_TOKEN = CONFIG.get('tmdb', {}).get('api_token')
 HTTP_PROXY = CONFIG.get('proxy', {}).get('http_proxy')
@@ -322,6 +646,44 @@ PLAYBACK_DEBOUNCE_SECONDS = get_setting('settings.debounce_seconds') or 10
 MEDIA_BASE_PATH = get_setting('settings.media_base_path')
 MEDIA_CLOUD_PATH = get_setting('settings.media_cloud_path')
 POSTER_CACHE_TTL_DAYS = get_setting('settings.poster_cache_ttl_days') or 30
+POSTER_CACHE_STALE_DAYS = get_setting('settings.poster_cache_stale_days') or 7
+POSTER_CACHE_MAX_ENTRIES = get_setting('settings.poster_cache_max_entries') or 5000
+POSTER_STORE_ENABLED = bool(get_setting('settings.poster_store_enabled'))
+POSTER_STORE_MAX_MB = get_setting('settings.poster_store_max_mb') or 200
+CACHE_SWEEP_INTERVAL = get_setting('settings.cache_sweep_interval') or 60
+TMDB_CACHE_MAX_ENTRIES = get_setting('settings.tmdb_cache_max_entries') or 2000
+EMBY_ITEM_CACHE_TTL = get_setting('settings.emby_item_cache_ttl') or 120
+EMBY_ITEM_CACHE_MAX_ENTRIES = get_setting('settings.emby_item_cache_max_entries') or 2000
+SERIES_SNAPSHOT_TTL = get_setting('settings.series_snapshot_ttl') or 60
+LIBRARY_INDEX_ENABLED = get_setting('settings.library_index_enabled') is not False
+LIBRARY_INDEX_SYNC_INTERVAL = get_setting('settings.library_index_sync_interval') or 600
+TMDB_SEASON_WORKERS = get_setting('settings.tmdb_season_workers') or 4
+IP_GEO_CACHE_MAX_ENTRIES = get_setting('settings.ip_geo_cache_max_entries') or 2000
+IP_GEO_CACHE_TTL_HOURS = get_setting('settings.ip_geo_cache_ttl_hours') or 168
+IP_GEO_NEGATIVE_TTL = get_setting('settings.ip_geo_negative_ttl') or 600
+IP_API_FALLBACK_ORDER = get_setting('settings.ip_api_fallback_order') or ['local', 'baidu', 'pconline', 'vore', 'ipapi', 'ip138']
+IP_DB_PATH = get_setting('settings.ip_db_path') or DEFAULT_IP_DB_PATH
+IP_DB_URL = get_setting('settings.ip_db_url')
+IP_API_MAX_FAILURES = get_setting('settings.ip_api_max_failures') or 3
+IP_API_COOLDOWN = get_setting('settings.ip_api_cooldown') or 300
+WEBHOOK_MAX_WORKERS = get_setting('settings.webhook_max_workers') or 8
+WEBHOOK_MAX_PENDING = get_setting('settings.webhook_max_pending') or 64
+STREAM_CHECK_INTERVALS = get_setting('settings.stream_check_intervals') or [5, 10, 20, 30, 60]
+STREAM_CHECK_DEADLINE = get_setting('settings.stream_check_deadline') or 300
+LIBRARY_NEW_COALESCE_SECONDS = get_setting('settings.library_new_coalesce_seconds')
+if LIBRARY_NEW_COALESCE_SECONDS is None:
+    LIBRARY_NEW_COALESCE_SECONDS = 30
+SCHEDULER_MAX_WORKERS = get_setting('settings.scheduler_max_workers') or 4
+HTTP_POOL_MAXSIZE = get_setting('settings.http_pool_maxsize') or 16
+HTTP_KEEP_ALIVE = get_setting('settings.http_keep_alive') is not False
+UPSTREAM_CONCURRENCY = get_setting('settings.upstream_concurrency') or {}
+INTERACTION_CACHE_SETTINGS = get_setting('settings.interaction_cache') or {}
+TELEGRAM_SENDER_WORKERS = get_setting('settings.telegram_sender_workers') or 4
+TELEGRAM_GLOBAL_RATE = get_setting('settings.telegram_global_rate') or 30
+TELEGRAM_GROUP_RATE_PER_MINUTE = get_setting('settings.telegram_group_rate_per_minute') or 20
+TELEGRAM_PRIVATE_RATE = get_setting('settings.telegram_private_rate') or 1
+TELEGRAM_UPDATE_WORKERS = get_setting('settings.telegram_update_workers') or 4
+METRICS_TOKEN = get_setting('settings.metrics_token')
 
 EMBY_SERVER_URL = CONFIG.get('emby', {}).get('server_url')
 EMBY_API_KEY = CONFIG.get('emby', {}).get('api_key')
@@ -341,12 +703,158 @@ if not EMBY_TEMPLATE_USER_ID:
     print("⚠️ 警告: 'template_user_id' 未在 config.yaml 中配置，用户创建功能将不可用。")
 print("🚀 初始化完成。")
 
-def make_request_with_retry(method, url, max_retries=3, retry_delay=1, **kwargs):
+METRICS_PROVIDERS = {}
+
+def register_metrics_provider(name, provider):
+    """注册一个运行状态统计来源，provider 为无参函数，返回可 JSON 序列化的字典。"""
+    METRICS_PROVIDERS[name] = provider
+
+def collect_runtime_stats():
+    """汇总所有已注册的运行状态统计。"""
+    stats = {}
+    for name, provider in list(METRICS_PROVIDERS.items()):
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {'error': str(e)}
+    return stats
+
+def estimate_memory_usage(obj, _seen=None):
+    """粗略估算对象（含嵌套容器）占用的内存字节数。"""
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_memory_usage(k, _seen) + estimate_memory_usage(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_memory_usage(i, _seen) for i in obj)
+    return size
+
+INTERACTION_CACHES = {}
+
+def create_interaction_cache(namespace, label, maxsize, ttl, on_evict=None):
+    """
+    创建一个交互状态缓存（搜索结果、删除任务、等待回复等）：
+    条目数上限与有效期可通过 settings.interaction_cache.<namespace>.max_entries / ttl 覆盖。
+    """
+    overrides = INTERACTION_CACHE_SETTINGS.get(namespace) or {}
+    cache = BoundedTTLCache(label, maxsize=overrides.get('max_entries') or maxsize, ttl=overrides.get('ttl') or ttl, on_evict=on_evict)
+    INTERACTION_CACHES[namespace] = cache
+    return cache
+
+def get_interaction_cache_stats():
+    """各交互状态缓存的条目数、上限、有效期与估算内存占用。"""
+    stats = {}
+    for namespace, cache in INTERACTION_CACHES.items():
+        with cache._lock:
+            memory_bytes = estimate_memory_usage(cache._data)
+        stats[namespace] = {'size': len(cache), 'maxsize': cache.maxsize, 'ttl': cache.ttl, 'memory_bytes': memory_bytes}
+    return stats
+
+def _notify_context_expired(chat_id, ctx, reason):
+    """等待用户回复的会话过期或被淘汰时，提示用户重新发起操作。"""
+    text = escape_markdown("⌛ 操作已超时，请重新发起。")
+    if isinstance(ctx, dict) and ctx.get('message_id'):
+        safe_edit_or_send_message(chat_id, ctx['message_id'], text, delete_after=60)
+    else:
+        send_deletable_telegram_notification(text, chat_id=chat_id, delay_seconds=60)
+
+def _notify_search_state_expired(chat_id, user_id, reason):
+    """等待输入搜索关键词的状态过期或被淘汰时，提示用户重新搜索。"""
+    send_deletable_telegram_notification(escape_markdown("⌛ 搜索已超时，请重新发送 /search。"), chat_id=chat_id, delay_seconds=60)
+
+SEARCH_RESULTS_CACHE = create_interaction_cache('search_results', '搜索结果', maxsize=200, ttl=3600)  # 搜索结果缓存
+DELETION_TASK_CACHE = create_interaction_cache('deletion_tasks', '删除任务', maxsize=100, ttl=1800)  # 删除任务缓存
+UPDATE_PATH_CACHE = create_interaction_cache('update_paths', '更新路径', maxsize=100, ttl=1800)  # 用于在回调中传递更新路径的缓存
+user_context = create_interaction_cache('user_context', '用户会话上下文', maxsize=500, ttl=600, on_evict=_notify_context_expired)  # 用户会话上下文（例如，等待用户回复）
+user_search_state = create_interaction_cache('user_search_state', '搜索输入状态', maxsize=500, ttl=300, on_evict=_notify_search_state_expired)  # 用户搜索状态缓存
+register_metrics_provider('interaction_state', get_interaction_cache_stats)
+
+class HTTPSessionPool:
+    """
+    按 (协议, 主机, 代理) 复用的 requests.Session 集合：
+    - 每个上游主机使用独立的连接池，连接保持长连接并在请求间复用
+    - 代理在创建 Session 时绑定，避免每次请求重新建立经代理的 TLS 连接
+    """
+
+    def __init__(self, pool_maxsize=16, keep_alive=True):
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, proxies=None):
+        """获取（必要时创建）目标 URL 所属主机的 Session。"""
+        parts = urlsplit(url)
+        proxy = (proxies or {}).get(parts.scheme)
+        key = (parts.scheme, parts.netloc, proxy)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if proxies:
+                    session.proxies.update(proxies)
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._sessions[key] = session
+            return session
+
+    def stats(self):
+        """返回每个主机的连接池统计：已建立连接数、请求数及连接复用次数。"""
+        hosts = {}
+        with self._lock:
+            items = list(self._sessions.items())
+        for (scheme, netloc, proxy), session in items:
+            managers = []
+            for adapter in set(session.adapters.values()):
+                managers.append(adapter.poolmanager)
+                managers.extend(adapter.proxy_manager.values())
+            opened = requests_made = 0
+            for manager in managers:
+                for pool_key in list(manager.pools.keys()):
+                    pool = manager.pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    opened += getattr(pool, 'num_connections', 0)
+                    requests_made += getattr(pool, 'num_requests', 0)
+            name = f"{scheme}://{netloc}" + (" (proxy)" if proxy else "")
+            if TELEGRAM_TOKEN:
+                name = name.replace(TELEGRAM_TOKEN, "[REDACTED_TOKEN]")
+            hosts[name] = {
+                'connections_opened': opened,
+                'requests': requests_made,
+                'connections_reused': max(0, requests_made - opened),
+            }
+        return hosts
+
+HTTP_SESSIONS = HTTPSessionPool(pool_maxsize=HTTP_POOL_MAXSIZE, keep_alive=HTTP_KEEP_ALIVE)
+register_metrics_provider('http_pool', HTTP_SESSIONS.stats)
+
+UPSTREAM_LIMITS = {}
+UPSTREAM_LIMITS_LOCK = threading.Lock()
+
+def get_upstream_limit(api_name):
+    """获取某个上游（Emby/TMDB/Telegram等）的并发请求信号量，上限由 settings.upstream_concurrency 配置，默认 8。"""
+    key = api_name.lower().replace(' ', '_')
+    with UPSTREAM_LIMITS_LOCK:
+        limit = UPSTREAM_LIMITS.get(key)
+        if limit is None:
+            limit = threading.BoundedSemaphore(int(UPSTREAM_CONCURRENCY.get(key) or 8))
+            UPSTREAM_LIMITS[key] = limit
+        return limit
+
+def make_request_with_retry(method, url, max_retries=3, retry_delay=1, accept_status=(), **kwargs):
     """
     带重试机制的HTTP请求函数（改进版）：
     - 仅对 edit/delete/answerCallbackQuery 放行“无事可做”类错误
     - 不再吞掉 Telegram 的 button_data_invalid 错误
     - 对 Telegram 调用前本地校验 callback_data 长度（<= 64 字节）
+    - accept_status 中的非 2xx 状态码（如 404）会直接返回响应对象，交由调用方处理
     """
     import json as _json
 
@@ -395,6 +903,8 @@ def make_request_with_retry(method, url, max_retries=3, retry_delay=1, **kwargs)
         api_name = "Emby"
 
     timeout = kwargs.pop('timeout', timeout)
+    session = HTTP_SESSIONS.get(url, kwargs.get('proxies'))
+    upstream_limit = get_upstream_limit(api_name)
 
     attempts = 0
     while attempts < max_retries:
@@ -408,11 +918,15 @@ def make_request_with_retry(method, url, max_retries=3, retry_delay=1, **kwargs)
                 display_url = display_url.replace(TELEGRAM_TOKEN, "[REDACTED_TOKEN]")
 
             print(f"🌐 正在进行 {api_name} API 请求 (第 {attempts + 1} 次), URL: {display_url}, 超时: {timeout}s")
-            response = requests.request(method, url, timeout=timeout, **kwargs)
+            with upstream_limit:
+                response = session.request(method, url, timeout=timeout, **kwargs)
 
             if 200 <= response.status_code < 300:
                 print(f"✅ {api_name} API 请求成功，状态码: {response.status_code}")
                 return response
+            if response.status_code in accept_status:
+                print(f"ℹ️ {api_name} API 返回状态码 {response.status_code}，交由调用方处理。")
+                return response
 
             try:
                 response.encoding = 'utf-8'
@@ -721,7 +1235,7 @@ def get_emby_access_token():
     payload = {'Username': EMBY_USERNAME, 'Pw': EMBY_PASSWORD}
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = HTTP_SESSIONS.get(url).post(url, headers=headers, json=payload, timeout=10)
         if response.status_code == 200:
             token = response.json().get('AccessToken')
             print("✅ 成功获取 Access Token。")
@@ -825,6 +1339,8 @@ def delete_emby_item(item_id, item_name):
     response = make_request_with_retry('DELETE', url, headers=headers, timeout=15)
     
     if response and response.status_code == 204:
+        invalidate_emby_item(item_id)
+        EMBY_LIBRARY_INDEX.remove(item_id)
         success_msg = f'✅ Emby 媒体库中的节目 “{item_name}” 已成功删除。'
         print(success_msg)
         return success_msg
@@ -958,18 +1474,116 @@ def update_media_files(item_path):
     details = "\n".join(update_log)
     return f"✅ `/{relative_path}` 已更新完成！\n\n变更详情：\n{details}"
 
+TMDB_MEMORY_CACHE = BoundedTTLCache('TMDB缓存', maxsize=TMDB_CACHE_MAX_ENTRIES)
+TMDB_CACHE_STORE = PersistentKVStore(TMDB_CACHE_DB_PATH)
+TMDB_CACHE_STATS = {'memory_hits': 0, 'disk_hits': 0, 'negative_hits': 0, 'api_calls': 0}
+TMDB_CACHE_STATS_LOCK = threading.Lock()
+TMDB_NEGATIVE_TTL = 86400
+
+def _count_tmdb_cache(stat):
+    with TMDB_CACHE_STATS_LOCK:
+        TMDB_CACHE_STATS[stat] += 1
+
+def get_tmdb_cache_stats():
+    """TMDB 缓存统计：内存/磁盘命中、404 负缓存命中、实际 API 调用次数及节省的调用次数。"""
+    with TMDB_CACHE_STATS_LOCK:
+        stats = dict(TMDB_CACHE_STATS)
+    stats['saved_calls'] = stats['memory_hits'] + stats['disk_hits']
+    return stats
+
+register_metrics_provider('tmdb_cache', get_tmdb_cache_stats)
+
+def _is_tmdb_season_complete(episodes):
+    """季的最后一集标记为 finale 且所有剧集均已播出时视为完结季。"""
+    if not episodes or episodes[-1].get('episode_type') != 'finale':
+        return False
+    today = datetime.now().strftime('%Y-%m-%d')
+    return all(ep.get('air_date') and ep.get('air_date') <= today for ep in episodes)
+
+def _tmdb_cache_ttl(path, data):
+    """
+    按接口和内容确定缓存时长（秒）：
+    - 已完结/已取消的剧集 30 天，连载中剧集 1 天，电影 7 天
+    - 季详情：已完结季（全部剧集已播出超过 30 天，或已播出且最后一集标记为 finale）缓存 30 天；否则 6 小时
+    - 搜索结果 1 天
+    """
+    parts = path.strip('/').split('/')
+    if parts[0] == 'search':
+        return 86400
+    if parts[0] == 'movie':
+        return 7 * 86400
+    if parts[0] == 'tv' and len(parts) == 2:
+        return 30 * 86400 if data.get('status') in ('Ended', 'Canceled') else 86400
+    if parts[0] == 'tv' and len(parts) >= 4 and parts[2] == 'season':
+        air_dates = [ep.get('air_date') for ep in data.get('episodes') or []]
+        if air_dates and all(air_dates):
+            try:
+                last_air = datetime.strptime(max(air_dates), '%Y-%m-%d')
+                if datetime.now() - last_air > timedelta(days=30):
+                    return 30 * 86400
+            except ValueError:
+                pass
+        if _is_tmdb_season_complete(data.get('episodes') or []):
+            return 30 * 86400
+        return 6 * 3600
+    return 86400
+
+def tmdb_get(path, params=None, fresh=False, cache_only=False, **request_kwargs):
+    """
+    带缓存的 TMDB GET 请求，返回解析后的 JSON（404 或请求失败时返回 None）。
+    缓存键为接口路径 + 参数（不含 api_key），先查内存缓存再查磁盘缓存；404 结果会被短期缓存。
+    fresh=True 时跳过缓存读取，直接请求并更新缓存；cache_only=True 时只读缓存，未命中返回 None。
+    """
+    if not TMDB_API_TOKEN:
+        return None
+    params = dict(params or {})
+    cache_key = path.strip('/') + '?' + '&'.join(f"{k}={params[k]}" for k in sorted(params))
+
+    if not fresh:
+        cached = TMDB_MEMORY_CACHE.get(cache_key)
+        if cached is not None:
+            _count_tmdb_cache('memory_hits')
+        else:
+            cached = TMDB_CACHE_STORE.get(cache_key)
+            if cached is not None:
+                _count_tmdb_cache('disk_hits')
+                remaining = cached['cached_at'] + cached['ttl'] - time.time()
+                TMDB_MEMORY_CACHE.set(cache_key, cached, ttl=max(1, remaining))
+        if cached is not None:
+            if cached['data'] is None:
+                _count_tmdb_cache('negative_hits')
+            print(f"✅ TMDB 缓存命中: {cache_key}")
+            return cached['data']
+        if cache_only:
+            return None
+
+    _count_tmdb_cache('api_calls')
+    url = f"https://api.themoviedb.org/3/{path.strip('/')}"
+    params['api_key'] = TMDB_API_TOKEN
+    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+    request_kwargs.setdefault('timeout', 10)
+    request_kwargs.setdefault('proxies', proxies)
+    response = make_request_with_retry('GET', url, params=params, accept_status=(404,), **request_kwargs)
+    if response is None:
+        return None
+    if response.status_code == 404:
+        data, ttl = None, TMDB_NEGATIVE_TTL
+    else:
+        data = response.json()
+        ttl = _tmdb_cache_ttl(path, data)
+    cached = {'data': data, 'cached_at': time.time(), 'ttl': ttl}
+    TMDB_MEMORY_CACHE.set(cache_key, cached, ttl=ttl)
+    TMDB_CACHE_STORE.put(cache_key, cached, ttl=ttl)
+    return data
+
 def get_tmdb_details_by_id(tmdb_id):
     """通过TMDB ID获取媒体详情，自动尝试电影和剧集。"""
     print(f"🔍 正在通过 TMDB ID: {tmdb_id} 查询详情")
     if not TMDB_API_TOKEN: return None
-    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
     
     for media_type in ['tv', 'movie']:
-        url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}"
-        params = {'api_key': TMDB_API_TOKEN, 'language': 'zh-CN'}
-        response = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies)
-        if response:
-            details = response.json()
+        details = tmdb_get(f"{media_type}/{tmdb_id}", {'language': 'zh-CN'})
+        if details:
             title = details.get('title') or details.get('name')
             if title:
                 print(f"✅ 在 TMDB 找到匹配项: {title} (类型: {media_type})")
@@ -1109,26 +1723,234 @@ def _get_geo_ipapi(ip):
         print(f"❌ 解析 IP-API.com 响应时发生错误。IP: {ip}, 错误: {e}")
     return "未知位置"
 
+class LocalIPDatabase:
+    """
+    本地 IPv4 地址段数据库：
+    - 数据文件每行一个地址段，格式为 起始IP|结束IP|地区字段...（IP 可为点分格式或整数，兼容 ip2region 源数据格式）
+    - 加载后按起始地址排序存入紧凑数组，查询使用二分查找，无需网络请求
+    """
+
+    def __init__(self):
+        self._starts = array('I')
+        self._ends = array('I')
+        self._locations = []
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def __len__(self):
+        return len(self._starts)
+
+    @staticmethod
+    def _parse_ip(value):
+        value = value.strip()
+        return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+
+    def load(self, path):
+        """从数据文件加载地址段，返回加载的条目数；文件格式错误的行会被跳过。"""
+        ranges = []
+        skipped = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split('|')
+                if len(fields) < 3:
+                    skipped += 1
+                    continue
+                try:
+                    start, end = self._parse_ip(fields[0]), self._parse_ip(fields[1])
+                except ValueError:
+                    skipped += 1
+                    continue
+                parts = [p.strip() for p in fields[2:]]
+                regions, isp = (parts[:-1], parts[-1]) if len(parts) > 1 else (parts, '')
+                location = ''.join(dict.fromkeys(p for p in regions if p and p != '0'))
+                if isp and isp != '0':
+                    location = f"{location} {isp}".strip()
+                ranges.append((start, end, location))
+        ranges.sort()
+        starts = array('I', (r[0] for r in ranges))
+        ends = array('I', (r[1] for r in ranges))
+        locations = [r[2] for r in ranges]
+        with self._lock:
+            self._starts, self._ends, self._locations = starts, ends, locations
+            self.loaded_at = datetime.now()
+        if skipped:
+            print(f"⚠️ 本地IP数据库中有 {skipped} 行格式无效，已跳过。")
+        return len(ranges)
+
+    def lookup(self, ip):
+        """查询 IPv4 地址所在地区，未找到时返回 None。"""
+        try:
+            value = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        with self._lock:
+            starts, ends, locations = self._starts, self._ends, self._locations
+        index = bisect.bisect_right(starts, value) - 1
+        if index >= 0 and value <= ends[index]:
+            return locations[index] or None
+        return None
+
+LOCAL_IP_DB = LocalIPDatabase()
+
+def reload_local_ip_database(download=False):
+    """
+    重新加载本地IP数据库；download=True 且配置了 ip_db_url 时先下载最新数据文件。
+    返回 (是否成功, 说明文字)。
+    """
+    if download and IP_DB_URL:
+        print(f"⬇️ 正在下载本地IP数据库: {IP_DB_URL}")
+        response = make_request_with_retry('GET', IP_DB_URL, timeout=120)
+        if not response:
+            return False, "下载IP数据库失败。"
+        try:
+            os.makedirs(os.path.dirname(IP_DB_PATH), exist_ok=True)
+            tmp_path = IP_DB_PATH + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, IP_DB_PATH)
+        except OSError as e:
+            return False, f"保存IP数据库失败: {e}"
+    if not os.path.exists(IP_DB_PATH):
+        return False, f"IP数据库文件不存在: {IP_DB_PATH}"
+    started = time.monotonic()
+    try:
+        count = LOCAL_IP_DB.load(IP_DB_PATH)
+    except (OSError, UnicodeDecodeError) as e:
+        return False, f"加载IP数据库失败: {e}"
+    message = f"本地IP数据库已加载 {count} 个地址段，耗时 {time.monotonic() - started:.2f} 秒。"
+    print(f"✅ {message}")
+    return True, message
+
+def _get_geo_local(ip):
+    """使用本地IP数据库获取地理位置。"""
+    if not LOCAL_IP_DB.loaded:
+        return "未知位置 (本地数据库未加载)"
+    location = LOCAL_IP_DB.lookup(ip)
+    if location:
+        print(f"✅ 成功从本地数据库获取到 IP ({ip}) 的地理位置: {location}")
+        return location
+    return "未知位置"
+
+IP_GEO_PROVIDERS = {
+    'baidu': _get_geo_baidu,
+    'ip138': _get_geo_ip138,
+    'pconline': _get_geo_pconline,
+    'vore': _get_geo_vore,
+    'ipapi': _get_geo_ipapi,
+    'local': _get_geo_local,
+}
+IP_GEO_MEMORY_CACHE = BoundedTTLCache('IP地理位置缓存', maxsize=IP_GEO_CACHE_MAX_ENTRIES, ttl=IP_GEO_CACHE_TTL_HOURS * 3600)
+IP_GEO_CACHE_STORE = PersistentKVStore(IP_GEO_CACHE_DB_PATH)
+
+class GeoProviderHealth:
+    """
+    记录各IP地理位置接口的健康状况：
+    - 连续失败达到 max_failures 次后，在 cooldown 秒内跳过该接口
+    - 统计调用次数、失败次数和平均/最近一次耗时
+    """
+
+    def __init__(self, max_failures=3, cooldown=300):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        return self._state.setdefault(name, {'calls': 0, 'failures': 0, 'consecutive_failures': 0, 'total_latency': 0.0, 'last_latency': 0.0, 'skip_until': 0.0})
+
+    def is_available(self, name):
+        with self._lock:
+            return time.monotonic() >= self._get(name)['skip_until']
+
+    def record(self, name, success, latency):
+        with self._lock:
+            state = self._get(name)
+            state['calls'] += 1
+            state['total_latency'] += latency
+            state['last_latency'] = latency
+            if success:
+                state['consecutive_failures'] = 0
+                return
+            state['failures'] += 1
+            state['consecutive_failures'] += 1
+            if state['consecutive_failures'] >= self.max_failures:
+                state['skip_until'] = time.monotonic() + self.cooldown
+                state['consecutive_failures'] = 0
+                print(f"⚠️ IP地理位置接口 {name} 连续失败 {self.max_failures} 次，{self.cooldown} 秒内将被跳过。")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    'calls': st['calls'],
+                    'failures': st['failures'],
+                    'avg_latency_ms': round(st['total_latency'] / st['calls'] * 1000) if st['calls'] else 0,
+                    'last_latency_ms': round(st['last_latency'] * 1000),
+                    'skipped_for_seconds': max(0, round(st['skip_until'] - now)),
+                }
+                for name, st in self._state.items()
+            }
+
+IP_GEO_HEALTH = GeoProviderHealth(max_failures=IP_API_MAX_FAILURES, cooldown=IP_API_COOLDOWN)
+register_metrics_provider('ip_geolocation', IP_GEO_HEALTH.stats)
+
 def get_ip_geolocation(ip):
-    """通过IP地址获取地理位置信息（根据配置选择API）。"""
+    """
+    通过IP地址获取地理位置信息：
+    - 先查缓存（内存 + 磁盘），查询失败的结果也会被短期缓存
+    - 优先使用配置的接口，失败时按 ip_api_fallback_order 依次尝试其他接口，跳过暂时不可用的接口
+    """
     if not ip or ip.startswith('192.168.') or ip.startswith('10.') or ip.startswith('172.'):
         return "局域网"
 
+    cached = IP_GEO_MEMORY_CACHE.get(ip)
+    if cached is None:
+        cached = IP_GEO_CACHE_STORE.get(ip)
+        if cached is not None:
+            IP_GEO_MEMORY_CACHE.set(ip, cached, ttl=max(1, cached['expires_at'] - time.time()))
+    if cached is not None:
+        print(f"✅ 从缓存获取到 IP ({ip}) 的地理位置: {cached['location']}")
+        return cached['location']
+
     provider = get_setting('settings.ip_api_provider') or 'baidu'
-    print(f"🌍 正在使用 {provider.upper()} API 查询 IP: {ip}")
-    
-    location = "未知位置"
-    if provider == 'ip138':
-        location = _get_geo_ip138(ip)
-    elif provider == 'pconline':
-        location = _get_geo_pconline(ip)
-    elif provider == 'vore':
-        location = _get_geo_vore(ip)
-    elif provider == 'ipapi':
-        location = _get_geo_ipapi(ip)
-    else:
-        location = _get_geo_baidu(ip)
+    providers = [provider] + [p for p in IP_API_FALLBACK_ORDER if p != provider]
+    if not CONFIG.get('settings', {}).get('ip_api_token_ip138') and provider != 'ip138':
+        providers = [p for p in providers if p != 'ip138']
+    if not LOCAL_IP_DB.loaded and provider != 'local':
+        providers = [p for p in providers if p != 'local']
 
+    location = "未知位置"
+    for name in providers:
+        geo_func = IP_GEO_PROVIDERS.get(name)
+        if not geo_func or not IP_GEO_HEALTH.is_available(name):
+            continue
+        print(f"🌍 正在使用 {name.upper()} API 查询 IP: {ip}")
+        started = time.monotonic()
+        try:
+            result = geo_func(ip)
+        except Exception as e:
+            print(f"❌ {name.upper()} API 查询异常: {e}")
+            result = None
+        success = bool(result) and not result.startswith("未知位置")
+        IP_GEO_HEALTH.record(name, success, time.monotonic() - started)
+        if success:
+            location = result
+            break
+        if result:
+            location = result
+
+    ttl = IP_GEO_CACHE_TTL_HOURS * 3600 if not location.startswith("未知位置") else IP_GEO_NEGATIVE_TTL
+    cached = {'location': location, 'expires_at': time.time() + ttl}
+    IP_GEO_MEMORY_CACHE.set(ip, cached, ttl=ttl)
+    IP_GEO_CACHE_STORE.put(ip, cached, ttl=ttl)
     return location
 
 def get_emby_user_by_name(username):
@@ -1309,23 +2131,21 @@ def search_tmdb_multi(title, year=None):
     """
     print(f"🔍 正在 TMDB 综合搜索: {title} ({year or '任意年份'})")
     if not TMDB_API_TOKEN: return []
-    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
     
     all_results = []
     
     for media_type in ['movie', 'tv']:
-        params = {'api_key': TMDB_API_TOKEN, 'query': title, 'language': 'zh-CN'}
+        params = {'query': title, 'language': 'zh-CN'}
         if year:
             if media_type == 'tv':
                 params['first_air_date_year'] = year
             else:
                 params['year'] = year
         
-        url = f"https://api.themoviedb.org/3/search/{media_type}"
-        response = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies)
+        data = tmdb_get(f"search/{media_type}", params)
         
-        if response:
-            results = response.json().get('results', [])
+        if data:
+            results = data.get('results', [])
             for item in results:
                 item_title = item.get('title') or item.get('name')
                 release_date = item.get('release_date') or item.get('first_air_date')
@@ -1348,14 +2168,12 @@ def search_tmdb_by_title(title, year=None, media_type='tv'):
     """通过标题和年份在TMDB上搜索媒体。"""
     print(f"🔍 正在 TMDB 搜索: {title} ({year})")
     if not TMDB_API_TOKEN: return None
-    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    params = {'api_key': TMDB_API_TOKEN, 'query': title, 'language': 'zh-CN'}
+    params = {'query': title, 'language': 'zh-CN'}
     if year:
         params['first_air_date_year' if media_type == 'tv' else 'year'] = year
-    url = f"https://api.themoviedb.org/3/search/{media_type}"
-    response = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies)
-    if response:
-        results = response.json().get('results', [])
+    data = tmdb_get(f"search/{media_type}", params)
+    if data:
+        results = data.get('results', [])
         if not results:
             print(f"❌ TMDB 未找到匹配结果。")
             return None
@@ -1371,6 +2189,112 @@ def search_tmdb_by_title(title, year=None, media_type='tv'):
     print(f"❌ TMDB 搜索失败")
     return None
 
+POSTER_MEMORY_CACHE = BoundedTTLCache('海报缓存', maxsize=POSTER_CACHE_MAX_ENTRIES, stale_ttl=POSTER_CACHE_STALE_DAYS * 86400)
+POSTER_REFRESHING = set()
+POSTER_REFRESHING_LOCK = threading.Lock()
+
+def fetch_tmdb_poster_url(api_type, tmdb_id, fresh=False):
+    """从 TMDB 获取海报链接，并写入内存缓存与持久化缓存。"""
+    data = tmdb_get(f"{api_type}/{tmdb_id}", {'language': 'zh-CN'}, fresh=fresh)
+    if not data:
+        return None
+    poster_path = data.get('poster_path')
+    if not poster_path:
+        return None
+    poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
+    cached_item = {'url': poster_url, 'timestamp': datetime.now().isoformat()}
+    POSTER_MEMORY_CACHE.set(tmdb_id, cached_item, ttl=POSTER_CACHE_TTL_DAYS * 86400)
+    POSTER_CACHE.put(tmdb_id, cached_item, ttl=(POSTER_CACHE_TTL_DAYS + POSTER_CACHE_STALE_DAYS) * 86400)
+    print(f"✅ 成功从 TMDB 获取并缓存海报。")
+    return poster_url
+
+def refresh_poster_in_background(api_type, tmdb_id):
+    """在后台刷新已过期的海报链接（同一 TMDB ID 同时只刷新一次）。"""
+    with POSTER_REFRESHING_LOCK:
+        if tmdb_id in POSTER_REFRESHING:
+            return
+        POSTER_REFRESHING.add(tmdb_id)
+
+    def _refresh():
+        try:
+            fetch_tmdb_poster_url(api_type, tmdb_id, fresh=True)
+        finally:
+            with POSTER_REFRESHING_LOCK:
+                POSTER_REFRESHING.discard(tmdb_id)
+
+    print(f"🔄 海报缓存 {tmdb_id} 已过期，先返回旧链接并在后台刷新。")
+    TASK_SCHEDULER.schedule(0, _refresh)
+
+def get_cached_poster_url(api_type, tmdb_id):
+    """
+    从缓存获取海报链接：先查内存缓存，未命中再查持久化缓存并回填。
+    已过期但仍在宽限期内的链接会直接返回，同时在后台刷新。
+    """
+    entry = POSTER_MEMORY_CACHE.get_entry(tmdb_id)
+    if entry is None:
+        stored = POSTER_CACHE.get(tmdb_id)
+        if not stored:
+            return None
+        try:
+            age = (datetime.now() - datetime.fromisoformat(stored['timestamp'])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return None
+        remaining = POSTER_CACHE_TTL_DAYS * 86400 - age
+        if remaining <= -POSTER_CACHE_STALE_DAYS * 86400:
+            return None
+        POSTER_MEMORY_CACHE.set(tmdb_id, stored, ttl=remaining)
+        entry = (stored, remaining <= 0)
+
+    cached_item, is_stale = entry
+    if is_stale:
+        refresh_poster_in_background(api_type, tmdb_id)
+    else:
+        print(f"✅ 从缓存获取到 TMDB ID {tmdb_id} 的海报链接。")
+    return cached_item.get('url')
+
+EMBY_ITEM_CACHE = BoundedTTLCache('Emby项目缓存', maxsize=EMBY_ITEM_CACHE_MAX_ENTRIES, ttl=EMBY_ITEM_CACHE_TTL)
+
+def get_emby_item(item_id, fields=None, user_id=None, fresh=False):
+    """
+    获取单个 Emby 项目（/Users/{user}/Items/{id}），失败返回 None。
+    结果按 (用户, 项目ID, 字段集合) 短时缓存；请求了 MediaSources 但媒体源尚未分析完成（没有可用的媒体流）时不缓存。
+    """
+    if not item_id or not EMBY_SERVER_URL:
+        return None
+    request_user_id = user_id or EMBY_USER_ID
+    field_list = sorted(set(f.strip() for f in (fields or '').split(',') if f.strip()))
+    cache_key = (request_user_id or '', str(item_id), ','.join(field_list))
+    if not fresh:
+        cached = EMBY_ITEM_CACHE.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+    url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{item_id}" if request_user_id else f"{EMBY_SERVER_URL}/Items/{item_id}"
+    params = {'api_key': EMBY_API_KEY}
+    if field_list:
+        params['Fields'] = ','.join(field_list)
+    response = make_request_with_retry('GET', url, params=params, timeout=10)
+    if not response:
+        return None
+    try:
+        item = response.json()
+    except ValueError:
+        return None
+    if 'MediaSources' not in field_list or _parse_media_streams(item.get('MediaSources')):
+        EMBY_ITEM_CACHE.set(cache_key, item)
+    return copy.deepcopy(item)
+
+def invalidate_emby_item(*item_ids):
+    """使指定项目（任意用户、任意字段集合）的缓存失效。"""
+    ids = {str(i) for i in item_ids if i}
+    if not ids:
+        return 0
+    removed = EMBY_ITEM_CACHE.discard_where(lambda key: key[1] in ids)
+    removed += SERIES_SNAPSHOT_CACHE.discard_where(lambda key: key in ids)
+    if removed:
+        print(f"🧹 已清除 {removed} 条 Emby 项目/剧集快照缓存: {', '.join(sorted(ids))}")
+    return removed
+
 def get_media_details(item, user_id):
     """
     获取媒体的详细信息，包括海报和TMDB链接。
@@ -1403,13 +2327,9 @@ def get_media_details(item, user_id):
         tmdb_id = series_provider_ids.get('Tmdb')
         if not tmdb_id and item.get('SeriesId'):
             print(f"⚠️ 无法从 Episode 获取 TMDB ID，尝试从 SeriesId ({item.get('SeriesId')}) 获取。")
-            series_id = item.get('SeriesId')
-            request_user_id = user_id or EMBY_USER_ID
-            url_part = f"/Users/{request_user_id}/Items/{series_id}" if request_user_id else f"/Items/{series_id}"
-            url = f"{EMBY_SERVER_URL}{url_part}"
-            response = make_request_with_retry('GET', url, params={'api_key': EMBY_API_KEY}, timeout=10)
-            if response:
-                tmdb_id = response.json().get('ProviderIds', {}).get('Tmdb')
+            series_item = get_emby_item(item.get('SeriesId'), 'ProviderIds', user_id)
+            if series_item:
+                tmdb_id = (series_item.get('ProviderIds') or {}).get('Tmdb')
         if not tmdb_id:
             print(f"⚠️ 仍然没有 TMDB ID，尝试通过标题搜索 TMDB。")
             tmdb_id = search_tmdb_by_title(item.get('SeriesName'), details.get('year'), media_type='tv')
@@ -1421,23 +2341,7 @@ def get_media_details(item, user_id):
                 details['tmdb_link'] = f"https://www.themoviedb.org/tv/{tmdb_id}"
     if tmdb_id:
         details['tmdb_id'] = tmdb_id
-        if tmdb_id in POSTER_CACHE:
-            cached_item = POSTER_CACHE[tmdb_id]
-            cached_time = datetime.fromisoformat(cached_item['timestamp'])
-            if datetime.now() - cached_time < timedelta(days=POSTER_CACHE_TTL_DAYS):
-                details['poster_url'] = cached_item['url']
-                print(f"✅ 从缓存获取到 TMDB ID {tmdb_id} 的海报链接。")
-                return details
-        url = f"https://api.themoviedb.org/3/{api_type}/{tmdb_id}?api_key={TMDB_API_TOKEN}&language=zh-CN"
-        proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-        response = make_request_with_retry('GET', url, timeout=10, proxies=proxies)
-        if response:
-            poster_path = response.json().get('poster_path')
-            if poster_path:
-                details['poster_url'] = f"https://image.tmdb.org/t/p/w500{poster_path}"
-                POSTER_CACHE[tmdb_id] = {'url': details['poster_url'], 'timestamp': datetime.now().isoformat()}
-                save_poster_cache()
-                print(f"✅ 成功从 TMDB 获取并缓存海报。")
+        details['poster_url'] = get_cached_poster_url(api_type, tmdb_id) or fetch_tmdb_poster_url(api_type, tmdb_id)
     return details
 
 def safe_edit_or_send_message(chat_id, message_id, text, buttons=None, disable_preview=True, delete_after=None):
@@ -1458,6 +2362,291 @@ def safe_edit_or_send_message(chat_id, message_id, text, buttons=None, disable_p
         else:
             send_deletable_telegram_notification(text=text, chat_id=chat_id, inline_buttons=buttons, disable_preview=disable_preview, delay_seconds=delete_after)
 
+TELEGRAM_FILE_ID_STORE = PersistentKVStore(TELEGRAM_FILE_ID_DB_PATH)
+
+LocalPoster = collections.namedtuple('LocalPoster', ['path', 'url'])
+
+class LocalPosterStore:
+    """
+    本地海报图片缓存（可选）：
+    - 每张海报只下载一次，按内容的 SHA-256 命名保存，图片 URL 到文件的映射保存在 index.db
+    - 以文件修改时间记录最近使用时间，总大小超过上限时删除最久未使用的文件及其索引条目
+    - 发送时直接以 multipart 上传本地文件，不依赖 Telegram 能否访问 TMDB 图片服务器
+    """
+
+    def __init__(self, directory, max_bytes, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._files = collections.OrderedDict()
+        self._total_bytes = 0
+        self._index = None
+        self._urls_by_name = {}  # 文件名 -> 指向该文件的图片 URL 集合，淘汰文件时同时删除索引
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """创建目录、打开索引并按修改时间载入已有文件。"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = PersistentKVStore(os.path.join(self.directory, 'index.db'))
+        self._index.start()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.img') and os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((st.st_mtime, name, st.st_size))
+        stale_urls = []
+        with self._lock:
+            for _, name, size in sorted(entries):
+                self._files[name] = size
+                self._total_bytes += size
+            for url, name in self._index.items():
+                if name in self._files:
+                    self._urls_by_name.setdefault(name, set()).add(url)
+                else:
+                    stale_urls.append(url)
+        for url in stale_urls:
+            self._index.delete(url)
+        print(f"🖼️ 本地海报缓存已加载 {len(entries)} 个文件，共 {self._total_bytes / 1048576:.1f} MB。")
+        self._evict()
+
+    def get_local(self, url):
+        """返回已缓存海报的 LocalPoster，未缓存时返回 None。"""
+        if not self.enabled or self._index is None or not url:
+            return None
+        name = self._index.get(url)
+        if not name:
+            return None
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return LocalPoster(path, url)
+
+    def fetch(self, url):
+        """返回本地海报，未缓存时下载并保存；失败返回 None。"""
+        local = self.get_local(url)
+        if local or not self.enabled or self._index is None or not url:
+            return local
+        with self._lock:
+            if url in self._inflight:
+                return None
+            self._inflight.add(url)
+        try:
+            proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+            response = make_request_with_retry('GET', url, timeout=20, proxies=proxies)
+            if not response or not response.content:
+                return None
+            content = response.content
+            name = hashlib.sha256(content).hexdigest() + '.img'
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            with self._lock:
+                if name not in self._files:
+                    self._files[name] = len(content)
+                    self._total_bytes += len(content)
+                self._files.move_to_end(name)
+                self._urls_by_name.setdefault(name, set()).add(url)
+            self._index.put(url, name)
+            print(f"✅ 海报已保存到本地缓存: {url}")
+        except OSError as e:
+            print(f"❌ 保存海报到本地缓存失败: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._inflight.discard(url)
+        self._evict()
+        return LocalPoster(path, url) if os.path.exists(path) else None
+
+    def prefetch(self, url):
+        """在后台下载海报（已缓存时忽略）。"""
+        if self.enabled and url and not self.get_local(url):
+            TASK_SCHEDULER.schedule(0, self.fetch, url)
+
+    def _evict(self):
+        removed, removed_urls = [], []
+        with self._lock:
+            while self._total_bytes > self.max_bytes and len(self._files) > 1:
+                name, size = self._files.popitem(last=False)
+                self._total_bytes -= size
+                removed.append(name)
+                removed_urls.extend(self._urls_by_name.pop(name, ()))
+        for url in removed_urls:
+            self._index.delete(url)
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        if removed:
+            print(f"🧹 本地海报缓存超出上限，已删除 {len(removed)} 个最久未使用的文件。")
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'files': len(self._files), 'size_mb': round(self._total_bytes / 1048576, 1), 'max_mb': round(self.max_bytes / 1048576, 1)}
+
+LOCAL_POSTER_STORE = LocalPosterStore(POSTER_STORE_DIR, POSTER_STORE_MAX_MB * 1048576, enabled=POSTER_STORE_ENABLED)
+register_metrics_provider('poster_store', LOCAL_POSTER_STORE.stats)
+
+def photo_upload_kwargs(payload):
+    """
+    photo 为本地海报时，将其从表单字段移到 multipart 文件上传参数中；
+    文件已被淘汰或无法读取时改回使用图片 URL。
+    """
+    photo = payload.get('photo')
+    if not isinstance(photo, LocalPoster):
+        return {}
+    try:
+        with open(photo.path, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        print(f"⚠️ 读取本地海报 {photo.path} 失败: {e}，改用图片链接发送。")
+        payload['photo'] = photo.url
+        return {}
+    del payload['photo']
+    return {'files': {'photo': (os.path.basename(photo.path) + '.jpg', content)}}
+
+def build_notification_payload(text, photo=None, chat_id=None, inline_buttons=None, disable_preview=False):
+    """构建通知的 Telegram 请求，返回 (method_name, payload)；photo 可以是图片 URL 或 file_id。"""
+    payload = {'chat_id': chat_id, 'parse_mode': 'MarkdownV2', 'disable_web_page_preview': disable_preview}
+    if inline_buttons:
+        keyboard_layout = inline_buttons if isinstance(inline_buttons[0], list) else [[button] for button in inline_buttons]
+        payload['reply_markup'] = json.dumps({'inline_keyboard': keyboard_layout})
+    if photo:
+        payload['photo'], payload['caption'] = photo, text
+        return 'sendPhoto', payload
+    payload['text'] = text
+    return 'sendMessage', payload
+
+TELEGRAM_FILE_ID_STATS = {'hits': 0, 'misses': 0, 'stale': 0, 'uploads': 0}
+TELEGRAM_FILE_ID_STATS_LOCK = threading.Lock()
+
+def _count_file_id(stat):
+    with TELEGRAM_FILE_ID_STATS_LOCK:
+        TELEGRAM_FILE_ID_STATS[stat] += 1
+
+def get_file_id_cache_stats():
+    """海报 file_id 缓存统计：命中、未命中、失效回退及新记录的 file_id 数。"""
+    with TELEGRAM_FILE_ID_STATS_LOCK:
+        stats = dict(TELEGRAM_FILE_ID_STATS)
+    lookups = stats['hits'] + stats['misses'] + stats['stale']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+    return stats
+
+register_metrics_provider('telegram_file_ids', get_file_id_cache_stats)
+
+def remember_photo_file_id(photo_url, response):
+    """从 sendPhoto 的响应中取出最大尺寸图片的 file_id，按图片 URL 持久化缓存并返回。"""
+    try:
+        photos = (response.json().get('result') or {}).get('photo') or []
+    except ValueError:
+        return None
+    file_id = photos[-1].get('file_id') if photos else None
+    if file_id:
+        TELEGRAM_FILE_ID_STORE.put(photo_url, file_id)
+        _count_file_id('uploads')
+    return file_id
+
+STALE_FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file', 'file_id')  # Telegram 中表示 file_id 无效的错误信息片段
+
+def _is_stale_file_id_response(response):
+    """判断 sendPhoto 是否因 file_id 无效而失败（Telegram 返回 400 且错误信息明确指向文件标识，如 wrong file identifier / invalid file_id）。"""
+    if response is None or response.status_code != 400:
+        return False
+    try:
+        description = (response.json().get('description') or '').lower()
+    except ValueError:
+        return False
+    return any(marker in description for marker in STALE_FILE_ID_ERRORS)
+
+def send_photo_with_file_id(photo_url, send):
+    """
+    发送带海报的消息：send(photo, accept_status) 负责实际发送并返回响应。
+    有缓存的 file_id 时优先使用，file_id 失效则删除缓存并改用图片 URL 重发；使用 URL 发送成功后记录新的 file_id。
+    """
+    file_id = TELEGRAM_FILE_ID_STORE.get(photo_url)
+    if file_id:
+        return _handle_file_id_response(photo_url, send(file_id, (400,)), send)
+    _count_file_id('misses')
+    return _send_photo_by_url_or_upload(photo_url, send)
+
+def _send_photo_by_url_or_upload(photo_url, send):
+    """
+    没有可用 file_id 时发送海报：本地已缓存则直接上传文件，否则使用图片 URL；
+    URL 发送失败且启用了本地海报缓存时，下载图片后再以上传方式重试。成功后记录 file_id。
+    """
+    local = LOCAL_POSTER_STORE.get_local(photo_url)
+    response = send(local or photo_url, ())
+    if not response and not local and LOCAL_POSTER_STORE.enabled:
+        local = LOCAL_POSTER_STORE.fetch(photo_url)
+        if local:
+            print(f"🔁 使用本地缓存的海报文件重新发送: {photo_url}")
+            response = send(local, ())
+    if response:
+        remember_photo_file_id(photo_url, response)
+    return response
+
+def _handle_file_id_response(photo_url, response, send):
+    """处理使用 file_id 发送的结果：file_id 失效时删除缓存并改用图片 URL 重发。"""
+    if not _is_stale_file_id_response(response):
+        _count_file_id('hits')
+        return response if response is None or response.status_code < 300 else None
+    print(f"⚠️ 海报 file_id 已失效，改用图片链接发送: {photo_url}")
+    TELEGRAM_FILE_ID_STORE.delete(photo_url)
+    _count_file_id('stale')
+    return _send_photo_by_url_or_upload(photo_url, send)
+
+def fan_out_notification(destinations, text, photo_url=None, inline_buttons=None):
+    """
+    将同一条通知并发发送到多个聊天，destinations 为 [(chat_id, 自动删除秒数或 None), ...]。
+    有海报时优先使用已缓存的 file_id；没有缓存则先向第一个目标上传图片，取得 file_id 后再并发发送其余目标。
+    """
+    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+
+    def _submit(chat_id, photo, accept_status=()):
+        method_name, payload = build_notification_payload(text, photo, chat_id, inline_buttons)
+        return TELEGRAM_OUTBOX.submit(method_name, chat_id=chat_id, data=payload, timeout=20, proxies=proxies,
+                                      accept_status=accept_status, **photo_upload_kwargs(payload))
+
+    def _finish(chat_id, delete_after, response):
+        if not response or not delete_after:
+            return
+        message_id = (response.json().get('result') or {}).get('message_id')
+        if message_id:
+            MESSAGE_DELETIONS.schedule(chat_id, message_id, delete_after)
+
+    def _sender(chat_id):
+        return lambda photo, accept_status: _submit(chat_id, photo, accept_status).result()
+
+    pending = list(destinations)
+    file_id = TELEGRAM_FILE_ID_STORE.get(photo_url) if photo_url else None
+    if photo_url and not file_id and pending:
+        chat_id, delete_after = pending.pop(0)
+        print(f"🖼️ 向 Chat ID {chat_id} 上传海报并记录 file_id。")
+        response = send_photo_with_file_id(photo_url, _sender(chat_id))
+        _finish(chat_id, delete_after, response)
+        file_id = TELEGRAM_FILE_ID_STORE.get(photo_url)
+
+    photo = file_id or photo_url
+    futures = [(chat_id, delete_after, _submit(chat_id, photo, (400,) if file_id else ())) for chat_id, delete_after in pending]
+    for chat_id, delete_after, future in futures:
+        response = future.result()
+        if file_id:
+            response = _handle_file_id_response(photo_url, response, _sender(chat_id))
+        _finish(chat_id, delete_after, response)
+
 def send_telegram_notification(text, photo_url=None, chat_id=None, inline_buttons=None, disable_preview=False):
     """
     发送一个Telegram通知，可以选择带图片和内联按钮。
@@ -1472,20 +2661,18 @@ def send_telegram_notification(text, photo_url=None, chat_id=None, inline_button
         return
     print(f"💬 正在向 Chat ID {chat_id} 发送 Telegram 通知...")
     proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    api_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/" + ('sendPhoto' if photo_url else 'sendMessage')
-    payload = {'chat_id': chat_id, 'parse_mode': 'MarkdownV2', 'disable_web_page_preview': disable_preview}
     if photo_url:
-        payload['photo'], payload['caption'] = photo_url, text
-    else:
-        payload['text'] = text
-    if inline_buttons:
-        keyboard_layout = inline_buttons if isinstance(inline_buttons[0], list) else [[button] for button in inline_buttons]
-        payload['reply_markup'] = json.dumps({'inline_keyboard': keyboard_layout})
-    make_request_with_retry('POST', api_url, data=payload, timeout=20, proxies=proxies)
+        def _send(photo, accept_status):
+            method_name, payload = build_notification_payload(text, photo, chat_id, inline_buttons, disable_preview)
+            return telegram_api_request(method_name, chat_id=chat_id, data=payload, timeout=20, proxies=proxies,
+                                        accept_status=accept_status, **photo_upload_kwargs(payload))
+        return send_photo_with_file_id(photo_url, _send)
+    method_name, payload = build_notification_payload(text, None, chat_id, inline_buttons, disable_preview)
+    return telegram_api_request(method_name, chat_id=chat_id, data=payload, timeout=20, proxies=proxies)
 
 def send_deletable_telegram_notification(text, photo_url=None, chat_id=None, inline_buttons=None, delay_seconds=60, disable_preview=False):
     """
-    发送一个可自动删除的Telegram通知。
+    发送一个可自动删除的Telegram通知（发送在通知线程池中异步执行，删除交由消息删除队列统一调度）。
     :param text: 消息文本
     :param photo_url: 图片URL
     :param chat_id: 聊天ID
@@ -1493,30 +2680,22 @@ def send_deletable_telegram_notification(text, photo_url=None, chat_id=None, inl
     :param delay_seconds: 自动删除的延迟时间
     :param disable_preview: 是否禁用URL预览
     """
-    async def send_and_delete():
+    priority = get_telegram_priority()
+    update_state = getattr(TELEGRAM_UPDATE_CONTEXT, 'state', None)
+
+    def send_and_schedule_delete():
         proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
         if not chat_id:
             return
 
-        api_url_base = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/"
-        payload = {
-            'chat_id': chat_id,
-            'parse_mode': 'MarkdownV2',
-            'disable_web_page_preview': disable_preview
-        }
-
-        if inline_buttons:
-            keyboard_layout = inline_buttons if isinstance(inline_buttons[0], list) else [[button] for button in inline_buttons]
-            payload['reply_markup'] = json.dumps({'inline_keyboard': keyboard_layout})
-
-        api_url = api_url_base + ('sendPhoto' if photo_url else 'sendMessage')
-        if photo_url:
-            payload['photo'], payload['caption'] = photo_url, text
-        else:
-            payload['text'] = text
+        def _send(photo, accept_status=()):
+            method_name, payload = build_notification_payload(text, photo, chat_id, inline_buttons, disable_preview)
+            return telegram_api_request(method_name, chat_id=chat_id, priority=priority, update_state=update_state,
+                                        data=payload, timeout=20, proxies=proxies, accept_status=accept_status,
+                                        **photo_upload_kwargs(payload))
 
         print(f"💬 正在向 Chat ID {chat_id} 发送可删除的通知，{delay_seconds}秒后删除。")
-        response = make_request_with_retry('POST', api_url, data=payload, timeout=20, proxies=proxies)
+        response = send_photo_with_file_id(photo_url, _send) if photo_url else _send(None)
         if not response:
             return
 
@@ -1525,16 +2704,9 @@ def send_deletable_telegram_notification(text, photo_url=None, chat_id=None, inl
         if not message_id or delay_seconds <= 0:
             return
 
-        await asyncio.sleep(delay_seconds)
-        print(f"⏳ 正在删除消息 ID: {message_id}。")
-        delete_url = api_url_base + 'deleteMessage'
-        delete_payload = {'chat_id': chat_id, 'message_id': message_id}
-
-        del_response = make_request_with_retry('POST', delete_url, data=delete_payload, timeout=10, proxies=proxies, max_retries=5, retry_delay=5)
-        if del_response is None:
-            print(f"ℹ️ 删除消息 {message_id}：可能已不存在或无权限，已忽略。")
+        MESSAGE_DELETIONS.schedule(chat_id, message_id, delay_seconds)
 
-    threading.Thread(target=lambda: asyncio.run(send_and_delete())).start()
+    send_in_background(send_and_schedule_delete)
     
 def send_simple_telegram_message(text, chat_id=None, delay_seconds=60):
     """发送一个简单的可自动删除的文本消息。"""
@@ -1548,14 +2720,12 @@ def answer_callback_query(callback_query_id, text=None, show_alert=False):
     params = {'callback_query_id': callback_query_id, 'show_alert': show_alert}
     if text: params['text'] = text
     proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/answerCallbackQuery"
-    make_request_with_retry('POST', url, params=params, timeout=5, proxies=proxies)
+    telegram_api_request('answerCallbackQuery', priority=TELEGRAM_PRIORITY_INTERACTIVE, params=params, timeout=5, proxies=proxies)
 
 def edit_telegram_message(chat_id, message_id, text, inline_buttons=None, disable_preview=False):
     """编辑一个已发送的Telegram消息；返回请求响应对象（成功/失败均返回None）。"""
     print(f"✏️ 正在编辑 Chat ID {chat_id}, Message ID {message_id} 的消息。")
     proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageText"
     payload = {
         'chat_id': chat_id,
         'message_id': message_id,
@@ -1567,26 +2737,23 @@ def edit_telegram_message(chat_id, message_id, text, inline_buttons=None, disabl
         payload['reply_markup'] = json.dumps({'inline_keyboard': inline_buttons})
 
     try:
-        resp = make_request_with_retry('POST', url, json=payload, timeout=10, proxies=proxies)
+        resp = telegram_api_request('editMessageText', chat_id=chat_id, coalesce_key=('edit', str(chat_id), message_id), json=payload, timeout=10, proxies=proxies)
         return resp
     except Exception as e:
         print(f"❌ edit_telegram_message 调用异常：{e}")
         return None
 
 def delete_telegram_message(chat_id, message_id):
-    """删除一个Telegram消息。"""
+    """删除一个Telegram消息（同时取消该消息尚未执行的定时删除）。"""
+    MESSAGE_DELETIONS.cancel(chat_id, message_id)
     print(f"🗑️ 正在删除 Chat ID {chat_id}, Message ID {message_id} 的消息。")
     proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/deleteMessage"
     payload = {'chat_id': chat_id, 'message_id': message_id}
-    make_request_with_retry('POST', url, data=payload, timeout=10, proxies=proxies)
+    telegram_api_request('deleteMessage', chat_id=chat_id, data=payload, timeout=10, proxies=proxies)
 
 def delete_user_message_later(chat_id, message_id, delay_seconds=60):
     """在指定延迟后删除用户消息。"""
-    async def delete_later():
-        await asyncio.sleep(delay_seconds)
-        delete_telegram_message(chat_id, message_id)
-    threading.Thread(target=lambda: asyncio.run(delete_later())).start()
+    MESSAGE_DELETIONS.schedule(chat_id, message_id, delay_seconds)
     
 def is_super_admin(user_id):
     """检查用户ID是否是超级管理员。"""
@@ -1603,9 +2770,10 @@ def is_user_authorized(user_id):
     if not GROUP_ID:
         return False
     now = time.time()
-    if user_id in GROUP_MEMBER_CACHE and (now - GROUP_MEMBER_CACHE[user_id]['timestamp'] < 60):
-        print(f"👥 用户 {user_id} 授权状态从缓存获取：{GROUP_MEMBER_CACHE[user_id]['is_member']}")
-        return GROUP_MEMBER_CACHE[user_id]['is_member']
+    cached = GROUP_MEMBER_CACHE.get(user_id)
+    if cached is not None:
+        print(f"👥 用户 {user_id} 授权状态从缓存获取：{cached['is_member']}")
+        return cached['is_member']
     print(f"👥 正在查询用户 {user_id} 在群组 {GROUP_ID} 中的成员身份。")
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getChatMember"
     params = {'chat_id': GROUP_ID, 'user_id': user_id}
@@ -1632,9 +2800,9 @@ def is_bot_admin(chat_id, user_id):
         return True
     if chat_id > 0:
         return False
-    now = time.time()
-    if chat_id in ADMIN_CACHE and (now - ADMIN_CACHE[chat_id]['timestamp'] < 300):
-        return user_id in ADMIN_CACHE[chat_id]['admins']
+    cached = ADMIN_CACHE.get_entry(chat_id)
+    if cached is not None and not cached[1]:
+        return user_id in cached[0]
     admin_ids = []
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getChatAdministrators"
     params = {'chat_id': chat_id}
@@ -1643,11 +2811,11 @@ def is_bot_admin(chat_id, user_id):
     if response:
         admins = response.json().get('result', [])
         admin_ids = [admin['user']['id'] for admin in admins]
-        ADMIN_CACHE[chat_id] = {'admins': admin_ids, 'timestamp': now}
+        ADMIN_CACHE[chat_id] = admin_ids
         return user_id in admin_ids
     else:
-        if chat_id in ADMIN_CACHE:
-            return user_id in ADMIN_CACHE[chat_id]['admins']
+        if cached is not None:
+            return user_id in cached[0]
         return False
 
 def get_active_sessions():
@@ -1824,17 +2992,11 @@ def send_message_to_emby_session(session_id, message, chat_id):
 def get_resolution_for_item(item_id, user_id=None):
     """获取指定项目的视频分辨率。"""
     print(f"ℹ️ 正在获取项目 {item_id} 的分辨率。")
-    request_user_id = user_id or EMBY_USER_ID
-    if not request_user_id:
-        url = f"{EMBY_SERVER_URL}/Items/{item_id}"
-    else:
-        url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{item_id}"
-    params = {'api_key': EMBY_API_KEY, 'Fields': 'MediaSources'}
-    response = make_request_with_retry('GET', url, params=params, timeout=10)
-    if not response:
+    item_data = get_emby_item(item_id, 'MediaSources', user_id)
+    if not item_data:
         print(f"❌ 获取项目 {item_id} 的媒体源信息失败。")
         return "未知分辨率"
-    media_sources = response.json().get('MediaSources', [])
+    media_sources = item_data.get('MediaSources', [])
     if not media_sources:
         print(f"❌ 项目 {item_id} 媒体源为空。")
         return "未知分辨率"
@@ -1848,106 +3010,355 @@ def get_resolution_for_item(item_id, user_id=None):
     return "未知分辨率"
 
 def get_series_season_media_info(series_id):
-    """获取剧集各季度的媒体信息（视频/音频规格）。"""
+    """
+    获取剧集各季度的媒体信息（视频/音频规格）。
+    通过一次递归查询取回全部剧集及其媒体源，在内存中按季分组，每季取第一个有媒体流信息的剧集作为代表。
+    """
     print(f"ℹ️ 正在获取剧集 {series_id} 的季规格。")
     request_user_id = EMBY_USER_ID
     if not request_user_id: return ["错误：此功能需要配置 Emby User ID"]
-    seasons_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    seasons_params = {'api_key': EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Season'}
-    seasons_response = make_request_with_retry('GET', seasons_url, params=seasons_params, timeout=10)
-    if not seasons_response: return ["查询季度列表失败"]
-    seasons = seasons_response.json().get('Items', [])
-    if not seasons: return ["未找到任何季度"]
+    episodes_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
+    episodes_params = {
+        'api_key': EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Episode', 'Recursive': 'true',
+        'Fields': 'MediaSources,ParentIndexNumber,IndexNumber', 'SortBy': 'ParentIndexNumber,IndexNumber', 'SortOrder': 'Ascending'
+    }
+    episodes_response = make_request_with_retry('GET', episodes_url, params=episodes_params, timeout=30)
+    if not episodes_response: return ["查询剧集列表失败"]
+    episodes = episodes_response.json().get('Items', [])
+    if not episodes: return ["未找到任何季度"]
+
+    episodes_by_season = {}
+    for episode in episodes:
+        season_num = episode.get('ParentIndexNumber')
+        if season_num is not None:
+            episodes_by_season.setdefault(season_num, []).append(episode)
+
     season_info_lines = []
-    for season in sorted(seasons, key=lambda s: s.get('IndexNumber', 0)):
-        season_num, season_id = season.get('IndexNumber'), season.get('Id')
-        if season_num is None or season_id is None: continue
-        print(f"ℹ️ 正在查询第 {season_num} 季 ({season_id}) 的剧集。")
-        episodes_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-        episodes_params = {'api_key': EMBY_API_KEY, 'ParentId': season_id, 'IncludeItemTypes': 'Episode', 'Limit': 1, 'Fields': 'Id'}
-        episodes_response = make_request_with_retry('GET', episodes_url, params=episodes_params, timeout=10)
-        season_line = f"S{season_num:02d}：\n    规格未知"
-        if episodes_response and episodes_response.json().get('Items'):
-            first_episode_id = episodes_response.json()['Items'][0].get('Id')
-            stream_details = get_media_stream_details(first_episode_id, request_user_id)
-            if stream_details:
-                formatted_parts = format_stream_details_message(stream_details, is_season_info=True, prefix='series')
-                if formatted_parts:
-                    escaped_parts = [escape_markdown(part) for part in formatted_parts]
-                    season_line = f"S{season_num:02d}：\n" + "\n".join(escaped_parts)
+    for season_num in sorted(episodes_by_season):
+        season_line = f"S{season_num:02d}：\n    规格未知"
+        for episode in sorted(episodes_by_season[season_num], key=lambda e: e.get('IndexNumber') or 0):
+            stream_details = _parse_media_streams(episode.get('MediaSources'))
+            if not stream_details:
+                continue
+            formatted_parts = format_stream_details_message(stream_details, is_season_info=True, prefix='series')
+            if formatted_parts:
+                escaped_parts = [escape_markdown(part) for part in formatted_parts]
+                season_line = f"S{season_num:02d}：\n" + "\n".join(escaped_parts)
+            break
         season_info_lines.append(season_line)
     return season_info_lines if season_info_lines else ["未找到剧集规格信息"]
 
-def get_episode_item_by_number(series_id, season_number, episode_number):
-    """根据季号和集号获取剧集项目的Emby Item对象。"""
-    print(f"ℹ️ 正在精确查询剧集 {series_id} 的 S{season_number:02d}E{episode_number:02d} 的项目信息。")
+class SeriesSnapshot:
+    """
+    剧集全部分集的快照（来自一次递归查询）：
+    - 按 (季号, 集号) 建立索引，按季分组并记录每季的 SeasonId 与集数
+    - 最新一集取季号/集号最大的分集
+    """
+
+    def __init__(self, series_id, episodes):
+        self.series_id = series_id
+        self.by_number = {}
+        self.by_season = {}
+        self.season_ids = {}
+        for episode in episodes:
+            season_num, episode_num = episode.get('ParentIndexNumber'), episode.get('IndexNumber')
+            if season_num is None:
+                continue
+            season_num = int(season_num)
+            self.by_season.setdefault(season_num, []).append(episode)
+            if episode.get('SeasonId'):
+                self.season_ids.setdefault(season_num, episode.get('SeasonId'))
+            if episode_num is not None:
+                self.by_number.setdefault((season_num, int(episode_num)), episode)
+        for season_episodes in self.by_season.values():
+            season_episodes.sort(key=lambda e: e.get('IndexNumber') or 0)
+        self.latest_episode = self.by_number[max(self.by_number)] if self.by_number else {}
+
+    def episode(self, season_number, episode_number):
+        return self.by_number.get((int(season_number), int(episode_number)))
+
+    def any_in_season(self, season_number):
+        episodes = self.by_season.get(int(season_number))
+        return episodes[0] if episodes else None
+
+    def episode_counts(self):
+        return {season_num: len(episodes) for season_num, episodes in self.by_season.items()}
+
+    def episodes_by_season(self, include_specials=False):
+        """返回 {season_num: set(episode_nums)}。"""
+        mapping = {}
+        for season_num, episode_num in self.by_number:
+            if season_num == 0 and not include_specials:
+                continue
+            mapping.setdefault(season_num, set()).add(episode_num)
+        return mapping
+
+SERIES_SNAPSHOT_CACHE = BoundedTTLCache('剧集快照缓存', maxsize=200, ttl=SERIES_SNAPSHOT_TTL)
+SERIES_SNAPSHOT_LOCKS = [threading.Lock() for _ in range(32)]  # 固定大小的锁池，按剧集ID哈希选锁
+
+def get_series_snapshot(series_id, fresh=False):
+    """获取剧集的分集快照（短时缓存，同一剧集并发请求只查询一次），失败返回 None。"""
     request_user_id = EMBY_USER_ID
     if not all([EMBY_SERVER_URL, EMBY_API_KEY, series_id, request_user_id]):
         return None
+    with SERIES_SNAPSHOT_LOCKS[hash(str(series_id)) % len(SERIES_SNAPSHOT_LOCKS)]:
+        if not fresh:
+            snapshot = SERIES_SNAPSHOT_CACHE.get(series_id)
+            if snapshot is not None:
+                return snapshot
+        print(f"ℹ️ 正在获取剧集 {series_id} 的全部分集列表。")
+        api_endpoint = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
+        params = {
+            'api_key': EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Episode', 'Recursive': 'true',
+            'SortBy': 'ParentIndexNumber,IndexNumber', 'SortOrder': 'Ascending',
+            'Fields': 'ProviderIds,Path,ServerId,DateCreated,ParentIndexNumber,IndexNumber,SeriesName,SeriesProviderIds,Overview'
+        }
+        response = make_request_with_retry('GET', api_endpoint, params=params, timeout=15)
+        if not response:
+            print(f"❌ 获取剧集 {series_id} 的分集列表失败。")
+            return None
+        snapshot = SeriesSnapshot(series_id, response.json().get('Items', []))
+        SERIES_SNAPSHOT_CACHE.set(series_id, snapshot)
+        print(f"✅ 剧集 {series_id} 分集快照已建立（共 {len(snapshot.by_season)} 季，{len(snapshot.by_number)} 集）。")
+        return snapshot
 
-    api_endpoint = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY,
-        'ParentId': series_id,
-        'IncludeItemTypes': 'Episode',
-        'Recursive': 'true',
-        'Fields': 'Id,ParentIndexNumber,IndexNumber',
-        'ParentIndexNumber': season_number,
-        'IndexNumber': episode_number
-    }
-    response = make_request_with_retry('GET', api_endpoint, params=params, timeout=15)
-    
-    if response and response.json().get('Items'):
-        episode_item = response.json()['Items'][0]
-        print(f"✅ 精确匹配成功，项目 ID: {episode_item.get('Id')}")
-        return episode_item
-    else:
-        print(f"❌ Emby API 未能找到 S{season_number:02d}E{episode_number:02d}。")
-        return None
+def get_episode_item_by_number(series_id, season_number, episode_number):
+    """根据季号和集号获取剧集项目的Emby Item对象。"""
+    print(f"ℹ️ 正在精确查询剧集 {series_id} 的 S{season_number:02d}E{episode_number:02d} 的项目信息。")
+    snapshot = get_series_snapshot(series_id)
+    episode_item = snapshot.episode(season_number, episode_number) if snapshot else None
+    if episode_item:
+        print(f"✅ 精确匹配成功，项目 ID: {episode_item.get('Id')}")
+        return episode_item
+    print(f"❌ Emby API 未能找到 S{season_number:02d}E{episode_number:02d}。")
+    return None
 
 def get_any_episode_from_season(series_id, season_number):
     """获取指定季中任意一集的信息，用于规格参考。"""
     print(f"ℹ️ 正在查找第 {season_number} 季中的任意一集作为规格参考...")
-    request_user_id = EMBY_USER_ID
-    if not all([EMBY_SERVER_URL, EMBY_API_KEY, series_id, request_user_id]): return None
-
-    api_endpoint = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY,
-        'ParentId': series_id,
-        'IncludeItemTypes': 'Episode',
-        'Recursive': 'true',
-        'Fields': 'Id,ParentIndexNumber',
-        'ParentIndexNumber': season_number,
-        'Limit': 1
-    }
-    response = make_request_with_retry('GET', api_endpoint, params=params, timeout=15)
-    
-    if response and response.json().get('Items'):
-        episode_item = response.json()['Items'][0]
+    snapshot = get_series_snapshot(series_id)
+    episode_item = snapshot.any_in_season(season_number) if snapshot else None
+    if episode_item:
         print(f"✅ 找到第 {season_number} 季的参考集，ID: {episode_item.get('Id')}")
         return episode_item
-    else:
-        print(f"❌ 未能在第 {season_number} 季中找到任何剧集。")
-        return None
+    print(f"❌ 未能在第 {season_number} 季中找到任何剧集。")
+    return None
 
 def _get_latest_episode_info(series_id):
     """获取指定剧集系列的最新一集信息。"""
     print(f"ℹ️ 正在获取剧集 {series_id} 的最新剧集信息。")
-    request_user_id = EMBY_USER_ID
-    if not all([EMBY_SERVER_URL, EMBY_API_KEY, series_id, request_user_id]): return {}
-    api_endpoint = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Episode', 'Recursive': 'true',
-        'SortBy': 'ParentIndexNumber,IndexNumber', 'SortOrder': 'Descending', 'Limit': 1,
-        'Fields': 'ProviderIds,Path,ServerId,DateCreated,ParentIndexNumber,IndexNumber,SeriesName,SeriesProviderIds,Overview'
-    }
-    response = make_request_with_retry('GET', api_endpoint, params=params, timeout=15)
-    latest_episode = response.json()['Items'][0] if response and response.json().get('Items') else {}
+    snapshot = get_series_snapshot(series_id)
+    latest_episode = snapshot.latest_episode if snapshot else {}
     if latest_episode:
         print(f"✅ 获取到最新剧集: S{latest_episode.get('ParentIndexNumber')}E{latest_episode.get('IndexNumber')}")
     return latest_episode
 
+class EmbyLibraryIndex:
+    """
+    进程内的 Emby 电影/剧集索引，供 /search、/manage 本地检索：
+    - 启动时全量拉取一次（名称、原名、年份、路径、Provider IDs）
+    - library.new / library.deleted 事件及机器人删除操作实时更新
+    - 独立线程定期按 MinDateLastSaved 增量同步，每天全量重建一次以清理遗漏的删除
+    - 检索时忽略大小写、全半角和标点，按词匹配（"spider man" 可匹配 "Spider-Man: No Way Home"）
+    """
+
+    FIELDS = 'ProviderIds,Path,ProductionYear,OriginalTitle,DateLastSaved'
+    PAGE_SIZE = 1000
+
+    def __init__(self, full_rebuild_interval=86400):
+        self.full_rebuild_interval = full_rebuild_interval
+        self._items = {}  # 项目ID -> (精简条目, 检索键, 检索键拼接串)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_sync_utc = None
+        self._last_rebuild = None
+        self._stats = {'local_searches': 0, 'fallback_searches': 0, 'delta_syncs': 0, 'rebuilds': 0}
+
+    @property
+    def ready(self):
+        return self._last_rebuild is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def _fetch(self, extra_params=None):
+        """分页拉取电影/剧集，失败返回 None。"""
+        if not all([EMBY_SERVER_URL, EMBY_API_KEY, EMBY_USER_ID]):
+            return None
+        url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items"
+        items, start_index = [], 0
+        while True:
+            params = {
+                'api_key': EMBY_API_KEY, 'IncludeItemTypes': 'Movie,Series', 'Recursive': 'true',
+                'Fields': self.FIELDS, 'StartIndex': start_index, 'Limit': self.PAGE_SIZE
+            }
+            params.update(extra_params or {})
+            response = make_request_with_retry('GET', url, params=params, timeout=60)
+            if not response:
+                return None
+            data = response.json()
+            page = data.get('Items', [])
+            items.extend(page)
+            start_index += len(page)
+            if not page or start_index >= (data.get('TotalRecordCount') or 0):
+                return items
+
+    @classmethod
+    def _entry(cls, item):
+        record = {k: item.get(k) for k in ('Id', 'Name', 'OriginalTitle', 'Type', 'ProductionYear', 'Path', 'ProviderIds')}
+        keys = tuple({''.join(cls._tokenize(record.get(k))) for k in ('Name', 'OriginalTitle') if record.get(k)})
+        return record, keys, '\n'.join(keys)
+
+    def rebuild(self):
+        """全量重建索引。"""
+        sync_started = datetime.now(timezone.utc) - timedelta(seconds=60)
+        started = time.monotonic()
+        items = self._fetch()
+        if items is None:
+            print("❌ 全量构建 Emby 媒体库索引失败。")
+            return False
+        records = {item.get('Id'): self._entry(item) for item in items if item.get('Id')}
+        with self._lock:
+            self._items = records
+            self._stats['rebuilds'] += 1
+        self._last_sync_utc = sync_started
+        self._last_rebuild = time.monotonic()
+        print(f"✅ Emby 媒体库索引已构建：{len(records)} 个电影/剧集，耗时 {time.monotonic() - started:.2f} 秒。")
+        return True
+
+    def delta_sync(self):
+        """增量同步自上次同步以来有改动的条目。"""
+        sync_started = datetime.now(timezone.utc) - timedelta(seconds=60)
+        items = self._fetch({'MinDateLastSaved': self._last_sync_utc.strftime('%Y-%m-%dT%H:%M:%SZ')})
+        if items is None:
+            print("❌ Emby 媒体库索引增量同步失败。")
+            return False
+        with self._lock:
+            for item in items:
+                if item.get('Id'):
+                    self._items[item['Id']] = self._entry(item)
+            self._stats['delta_syncs'] += 1
+        self._last_sync_utc = sync_started
+        if items:
+            print(f"🔄 Emby 媒体库索引增量同步：更新 {len(items)} 个条目。")
+        return True
+
+    def start(self, interval):
+        """启动独立的同步线程（全量构建和分页请求较慢，不占用共享的任务调度线程池）。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='library-index', daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        """索引未建立或到达全量重建周期时全量重建，否则增量同步；每 interval 秒一次。"""
+        while True:
+            try:
+                if not self.ready or time.monotonic() - self._last_rebuild >= self.full_rebuild_interval:
+                    self.rebuild()
+                else:
+                    self.delta_sync()
+            except Exception as e:
+                print(f"❌ 同步 Emby 媒体库索引时异常: {e}")
+            time.sleep(interval)
+
+    def refresh_item(self, item_id):
+        """从 Emby 重新获取单个条目并更新索引。"""
+        item = get_emby_item(item_id, self.FIELDS, fresh=True)
+        if item and item.get('Type') in ('Movie', 'Series'):
+            with self._lock:
+                self._items[item['Id']] = self._entry(item)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._items.pop(item_id, None)
+
+    def on_library_event(self, event_type, item):
+        """根据 library.new / library.deleted 事件更新索引。"""
+        if not self.ready:
+            return
+        item_type, item_id = item.get('Type'), item.get('Id')
+        if event_type == 'library.deleted':
+            if item_type in ('Movie', 'Series'):
+                self.remove(item_id)
+            return
+        if item_type in ('Movie', 'Series'):
+            TASK_SCHEDULER.schedule(0, self.refresh_item, item_id)
+        elif item_type in ('Season', 'Episode') and item.get('SeriesId'):
+            with self._lock:
+                known = item['SeriesId'] in self._items
+            if not known:
+                TASK_SCHEDULER.schedule(0, self.refresh_item, item['SeriesId'])
+
+    @staticmethod
+    def _tokenize(text):
+        """统一大小写与全半角，将空白、标点和符号视为分隔符，返回词列表。"""
+        return re.sub(r'[\W_]+', ' ', unicodedata.normalize('NFKC', text or '').casefold()).split()
+
+    def search(self, term, year=None):
+        """
+        按名称/原名检索：完全匹配 > 前缀匹配 > 连续子串匹配 > 所有词均出现；year 不为空时按年份过滤。
+        """
+        tokens = self._tokenize(term)
+        needle = ''.join(tokens)
+        with self._lock:
+            entries = list(self._items.values())
+            self._stats['local_searches'] += 1
+        if not needle:
+            return []
+        ranked = []
+        for record, keys, joined in entries:
+            if tokens[0] not in joined or (year and str(record.get('ProductionYear') or '') != str(year)):
+                continue
+            if needle in keys:
+                rank = 0
+            elif any(k.startswith(needle) for k in keys):
+                rank = 1
+            elif any(needle in k for k in keys):
+                rank = 2
+            elif any(all(t in k for t in tokens) for k in keys):
+                rank = 3
+            else:
+                continue
+            ranked.append((rank, record.get('Name') or '', record))
+        ranked.sort(key=lambda r: (r[0], r[1]))
+        return [dict(record) for _, _, record in ranked]
+
+    def count_fallback(self):
+        with self._lock:
+            self._stats['fallback_searches'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, items=len(self._items))
+        stats['ready'] = self.ready
+        stats['last_sync_utc'] = self._last_sync_utc.strftime('%Y-%m-%dT%H:%M:%SZ') if self._last_sync_utc else None
+        return stats
+
+EMBY_LIBRARY_INDEX = EmbyLibraryIndex()
+register_metrics_provider('library_index', EMBY_LIBRARY_INDEX.stats)
+
+def search_emby_library(search_term, year=None, timeout=20):
+    """搜索 Emby 中的电影/剧集：索引已就绪时本地检索，否则调用 Emby 搜索接口。"""
+    if LIBRARY_INDEX_ENABLED and EMBY_LIBRARY_INDEX.ready:
+        results = EMBY_LIBRARY_INDEX.search(search_term, year)
+        print(f"⚡ 本地媒体库索引检索 '{search_term}'，找到 {len(results)} 个结果。")
+        return results
+    EMBY_LIBRARY_INDEX.count_fallback()
+    url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items"
+    params = {
+        'api_key': EMBY_API_KEY,
+        'SearchTerm': search_term,
+        'IncludeItemTypes': 'Movie,Series',
+        'Recursive': 'true',
+        'Fields': 'ProviderIds,Path,ProductionYear,Name'
+    }
+    if year:
+        params['Years'] = year
+    response = make_request_with_retry('GET', url, params=params, timeout=timeout)
+    return response.json().get('Items', []) if response else []
+
 def send_search_emby_and_format(query, chat_id, user_id, is_group_chat, mention):
     """
     执行Emby搜索并格式化结果。如果Emby直接搜索无果，则尝试通过TMDB进行后备搜索。
@@ -1975,19 +3386,7 @@ def send_search_emby_and_format(query, chat_id, user_id, is_group_chat, mention)
         send_deletable_telegram_notification("错误：机器人管理员尚未在配置文件中设置 Emby `user_id`。", chat_id=chat_id)
         return
 
-    url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY, 
-        'SearchTerm': search_term, 
-        'IncludeItemTypes': 'Movie,Series',
-        'Recursive': 'true', 
-        'Fields': 'ProviderIds,Path,ProductionYear,Name'
-    }
-    if year_for_filter: 
-        params['Years'] = year_for_filter
-        
-    response = make_request_with_retry('GET', url, params=params, timeout=20)
-    results = response.json().get('Items', []) if response else []
+    results = search_emby_library(search_term, year_for_filter)
 
     intro_override = None
 
@@ -2001,24 +3400,10 @@ def send_search_emby_and_format(query, chat_id, user_id, is_group_chat, mention)
         if tmdb_alternatives:
             for alt in tmdb_alternatives:
                 alt_title = alt['title']
-                alt_params = {
-                    'api_key': EMBY_API_KEY, 
-                    'SearchTerm': alt_title, 
-                    'IncludeItemTypes': 'Movie,Series',
-                    'Recursive': 'true', 
-                    'Fields': 'ProviderIds,Path,ProductionYear,Name'
-                }
-                if year_for_filter:
-                    alt_params['Years'] = year_for_filter
-
-                alt_response = make_request_with_retry('GET', url, params=alt_params, timeout=10)
-                
-                if alt_response:
-                    emby_items = alt_response.json().get('Items', [])
-                    for item in emby_items:
-                        if item.get('Name').lower() == alt_title.lower() and item.get('Id') not in found_emby_ids:
-                            alternative_results.append(item)
-                            found_emby_ids.add(item.get('Id'))
+                for item in search_emby_library(alt_title, year_for_filter, timeout=10):
+                    if (item.get('Name') or '').lower() == alt_title.lower() and item.get('Id') not in found_emby_ids:
+                        alternative_results.append(item)
+                        found_emby_ids.add(item.get('Id'))
         
         if not alternative_results:
             send_deletable_telegram_notification(f"在 Emby 中找不到与“{escape_markdown(original_query)}”相关的任何内容。", chat_id=chat_id)
@@ -2085,30 +3470,10 @@ def send_search_results_page(chat_id, search_id, user_id, page=1, message_id=Non
 def get_local_episodes_by_season(series_id, user_id=None):
     """返回 {season_num: set(episode_nums)}，跳过 S00 特别篇。"""
     print(f"ℹ️ 正在汇总剧集 {series_id} 的本地分季集号。")
-    request_user_id = user_id or EMBY_USER_ID
-    if not all([EMBY_SERVER_URL, EMBY_API_KEY, request_user_id, series_id]):
+    snapshot = get_series_snapshot(series_id)
+    if not snapshot:
         return {}
-    url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY,
-        'ParentId': series_id,
-        'IncludeItemTypes': 'Episode',
-        'Recursive': 'true',
-        'Fields': 'ParentIndexNumber,IndexNumber'
-    }
-    resp = make_request_with_retry('GET', url, params=params, timeout=15)
-    if not resp:
-        return {}
-    mapping = {}
-    for ep in resp.json().get('Items', []):
-        s = ep.get('ParentIndexNumber')
-        e = ep.get('IndexNumber')
-        if s is None or e is None:
-            continue
-        s = int(s); e = int(e)
-        if s == 0:
-            continue
-        mapping.setdefault(s, set()).add(e)
+    mapping = snapshot.episodes_by_season()
     print(f"✅ 本地分季集号统计完成（共 {len(mapping)} 季）。")
     return mapping
 
@@ -2118,13 +3483,9 @@ def get_tmdb_season_numbers(series_tmdb_id):
     print(f"ℹ️ 正在查询 TMDB 剧集 {series_tmdb_id} 的季列表。")
     if not TMDB_API_TOKEN or not series_tmdb_id:
         return []
-    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    url = f"https://api.themoviedb.org/3/tv/{series_tmdb_id}"
-    params = {'api_key': TMDB_API_TOKEN, 'language': 'zh-CN'}
-    resp = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies)
-    if not resp:
+    data = tmdb_get(f"tv/{series_tmdb_id}", {'language': 'zh-CN'})
+    if not data:
         return []
-    data = resp.json()
     seasons = data.get('seasons', []) or []
     nums = []
     for s in seasons:
@@ -2138,24 +3499,22 @@ def get_tmdb_season_numbers(series_tmdb_id):
     print(f"✅ TMDB 季列表：{nums}")
     return nums
 
-def get_tmdb_season_details(series_tmdb_id, season_number):
+def get_tmdb_season_details(series_tmdb_id, season_number, fresh=False, cache_only=False):
     """从TMDB获取指定剧集季度详情，包含：
     - total_episodes: TMDB该季条目数
     - max_episode_number: TMDB该季的最大集号（按 episode_number 最大值）
     - episode_numbers: TMDB该季所有集号列表（升序，去重）
     - is_finale_marked: TMDB最后一集是否标记为 finale
+    - is_complete: 是否为已完结季（finale 且全部已播出）
+    fresh / cache_only 含义同 tmdb_get。
     """
     print(f"ℹ️ 正在查询 TMDB 剧集 {series_tmdb_id} 第 {season_number} 季的详情。")
     if not all([TMDB_API_TOKEN, series_tmdb_id, season_number is not None]):
         return None
-    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-    url = f"https://api.themoviedb.org/3/tv/{series_tmdb_id}/season/{season_number}"
-    params = {'api_key': TMDB_API_TOKEN, 'language': 'zh-CN'}
-    response = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies)
-    if not response:
+    data = tmdb_get(f"tv/{series_tmdb_id}/season/{season_number}", {'language': 'zh-CN'}, fresh=fresh, cache_only=cache_only)
+    if not data:
         return None
 
-    data = response.json()
     episodes = data.get('episodes', [])
     if not episodes:
         print(f"❌ TMDB 未找到第 {season_number} 季的剧集列表。")
@@ -2178,9 +3537,24 @@ def get_tmdb_season_details(series_tmdb_id, season_number):
         'total_episodes': len(episodes),
         'max_episode_number': max_ep,
         'episode_numbers': sorted(set(nums)),
-        'is_finale_marked': is_finale
+        'is_finale_marked': is_finale,
+        'is_complete': _is_tmdb_season_complete(episodes)
     }
 
+TMDB_SEASON_EXECUTOR = ThreadPoolExecutor(max_workers=TMDB_SEASON_WORKERS, thread_name_prefix='tmdb-season')
+
+def get_tmdb_season_details_for_progress(series_tmdb_id, season_number, is_current):
+    """
+    供进度/缺集统计使用的季详情：往季直接使用缓存；
+    当前季只读取缓存判断是否已完结，未完结（或未缓存）时直接请求 TMDB 以获取最新集数。
+    """
+    if not is_current:
+        return get_tmdb_season_details(series_tmdb_id, season_number)
+    cached = get_tmdb_season_details(series_tmdb_id, season_number, cache_only=True)
+    if cached and cached.get('is_complete'):
+        return cached
+    return get_tmdb_season_details(series_tmdb_id, season_number, fresh=True)
+
 def build_seasonwise_progress_and_missing_lines(series_tmdb_id, series_id, latest_season_num, latest_episode_num):
     """
     - 最大季（latest_season_num）：
@@ -2196,15 +3570,19 @@ def build_seasonwise_progress_and_missing_lines(series_tmdb_id, series_id, lates
     if not series_tmdb_id or series_id is None or latest_season_num is None:
         return lines
 
-    local_map = get_local_episodes_by_season(series_id, EMBY_USER_ID)
     local_latest = int(latest_season_num)
 
-    tmdb_seasons = [s for s in get_tmdb_season_numbers(series_tmdb_id) if s <= local_latest]
+    # TMDB 季列表在线程池中获取，同时在当前线程查询本地分集；各季详情再并发获取（不创建事件循环，可在任意上下文中调用）
+    season_numbers_future = TMDB_SEASON_EXECUTOR.submit(get_tmdb_season_numbers, series_tmdb_id)
+    local_map = get_local_episodes_by_season(series_id, EMBY_USER_ID)
+    tmdb_seasons = [s for s in season_numbers_future.result() if s <= local_latest]
     if not tmdb_seasons:
         tmdb_seasons = sorted([s for s in local_map.keys() if s <= local_latest])
+    season_infos = list(TMDB_SEASON_EXECUTOR.map(
+        lambda s: get_tmdb_season_details_for_progress(series_tmdb_id, s, s == local_latest), tmdb_seasons
+    ))
 
-    for s in tmdb_seasons:
-        tmdb_info = get_tmdb_season_details(series_tmdb_id, s)
+    for s, tmdb_info in zip(tmdb_seasons, season_infos):
         if not tmdb_info:
             continue
 
@@ -2269,13 +3647,10 @@ def build_progress_lines_for_library_new(item, media_details):
 
         series_tmdb_id = media_details.get('tmdb_id')
         if not series_tmdb_id:
-            request_user_id = EMBY_USER_ID
-            if request_user_id:
-                series_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{series_id}"
-                params = {'api_key': EMBY_API_KEY, 'Fields': 'ProviderIds'}
-                resp = make_request_with_retry('GET', series_url, params=params, timeout=10)
-                if resp:
-                    series_tmdb_id = (resp.json().get('ProviderIds') or {}).get('Tmdb')
+            if EMBY_USER_ID:
+                series_item = get_emby_item(series_id, 'ProviderIds')
+                if series_item:
+                    series_tmdb_id = (series_item.get('ProviderIds') or {}).get('Tmdb')
 
         if not series_tmdb_id:
             return []
@@ -2285,22 +3660,22 @@ def build_progress_lines_for_library_new(item, media_details):
         print(f"⚠️ 生成新增通知进度/缺集时异常：{e}")
         return []
 
-def get_media_stream_details(item_id, user_id=None):
-    """获取指定项目的媒体流信息（视频、音频、字幕）。"""
+def get_media_stream_details(item_id, user_id=None, fresh=False):
+    """获取指定项目的媒体流信息（视频、音频、字幕）。fresh 为 True 时跳过项目缓存。"""
     print(f"ℹ️ 正在获取项目 {item_id} 的媒体流信息。")
     request_user_id = user_id or EMBY_USER_ID
     if not all([EMBY_SERVER_URL, EMBY_API_KEY, request_user_id]): return None
 
-    url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{item_id}"
-    params = {'api_key': EMBY_API_KEY, 'Fields': 'MediaSources'}
-    response = make_request_with_retry('GET', url, params=params, timeout=10)
+    item_data = get_emby_item(item_id, 'MediaSources', request_user_id, fresh=fresh)
+    if not item_data: return None
+    stream_details = _parse_media_streams(item_data.get('MediaSources'))
+    if stream_details:
+        print(f"✅ 获取到项目 {item_id} 的媒体流信息。")
+    return stream_details
 
-    if not response: return None
-    item_data = response.json()
-    media_sources = item_data.get('MediaSources', [])
+def _parse_media_streams(media_sources):
+    """从 Emby MediaSources 中提取视频、音频、字幕信息，无可用信息时返回 None。"""
     if not media_sources: return None
-    print(f"✅ 获取到项目 {item_id} 的媒体流信息。")
-
     video_info, audio_info_list, subtitle_info_list = {}, [], []
     for stream in media_sources[0].get('MediaStreams', []):
         if stream.get('Type') == 'Video' and not video_info:
@@ -2526,16 +3901,13 @@ def get_emby_libraries():
 
 def get_series_item_basic(series_id: str):
     """获取剧集基本信息（Name/Year/Path），失败返回 None。"""
-    try:
-        url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{series_id}"
-        params = {'api_key': EMBY_API_KEY, 'Fields': 'Path,Name,ProductionYear'}
-        resp = make_request_with_retry('GET', url, params=params, timeout=10)
-        return resp.json() if resp else None
-    except Exception:
-        return None
+    return get_emby_item(series_id, 'Path,Name,ProductionYear')
 
 def get_series_season_id_map(series_id: str):
-    """返回 {season_number:int -> season_id:str}；跳过 S00。"""
+    """返回 {season_number:int -> season_id:str}；跳过 S00。优先使用分集快照，快照中缺少季信息时查询季列表。"""
+    snapshot = get_series_snapshot(series_id)
+    if snapshot and snapshot.season_ids:
+        return {sn: sid for sn, sid in snapshot.season_ids.items() if sn != 0}
     url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items"
     params = {'api_key': EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Season'}
     resp = make_request_with_retry('GET', url, params=params, timeout=15)
@@ -2565,36 +3937,28 @@ def delete_emby_seasons(series_id: str, seasons: list[int]):
             continue
         msg = delete_emby_item(sid, f"S{sn:02d}")
         logs.append(msg)
+    invalidate_emby_item(series_id)
     return "\n".join(logs) if logs else "未删除任何季。"
 
 
 def delete_emby_episodes(series_id: str, season_to_eps: dict[int, list[int]]):
     """从 Emby 删除指定集，返回日志字符串。"""
     logs = []
-    season_map = get_series_season_id_map(series_id)
+    snapshot = get_series_snapshot(series_id, fresh=True)
+    if not snapshot:
+        return "❌ 拉取 Emby 剧集的集列表失败"
     for sn, eps in sorted(season_to_eps.items()):
-        sid = season_map.get(sn)
-        if not sid:
+        if sn not in snapshot.by_season:
             logs.append(f"🟡 未找到 Emby 季 S{sn:02d}")
             continue
-        url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items"
-        params = {'api_key': EMBY_API_KEY, 'ParentId': sid, 'IncludeItemTypes': 'Episode', 'Fields': 'IndexNumber,Name'}
-        resp = make_request_with_retry('GET', url, params=params, timeout=15)
-        if not resp:
-            logs.append(f"❌ 拉取 Emby 季 S{sn:02d} 的集列表失败")
-            continue
-        ep_map = {}
-        for ep in resp.json().get('Items', []):
-            n = ep.get('IndexNumber')
-            if n is not None:
-                ep_map[int(n)] = ep.get('Id')
         for e in eps:
-            eid = ep_map.get(e)
-            if not eid:
+            episode = snapshot.episode(sn, e)
+            if not episode:
                 logs.append(f"🟡 未找到 Emby 项 S{sn:02d}E{e:02d}")
                 continue
-            msg = delete_emby_item(eid, f"S{sn:02d}E{e:02d}")
+            msg = delete_emby_item(episode.get('Id'), f"S{sn:02d}E{e:02d}")
             logs.append(msg)
+    invalidate_emby_item(series_id)
     return "\n".join(logs) if logs else "未删除任何集。"
 
 
@@ -2722,13 +4086,10 @@ def send_search_detail(chat_id, search_id, item_index, user_id):
     if not request_user_id:
         send_deletable_telegram_notification("错误：机器人管理员尚未设置 Emby `user_id`。", chat_id=chat_id)
         return
-    full_item_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{item_id}"
-    params = {'api_key': EMBY_API_KEY, 'Fields': 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated'}
-    response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-    if not response:
+    item = get_emby_item(item_id, 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated', request_user_id)
+    if not item:
         send_deletable_telegram_notification("获取详细信息失败。", chat_id=chat_id)
         return
-    item = response.json()
     item_type, raw_title, raw_overview = item.get('Type'), item.get('Name', '未知标题'), item.get('Overview', '暂无剧情简介')
     final_year = extract_year_from_path(item.get('Path')) or item.get('ProductionYear') or ''
     media_details = get_media_details(item, request_user_id)
@@ -2803,6 +4164,40 @@ def send_search_detail(chat_id, search_id, item_index, user_id):
         delay_seconds=90
     )
 
+def format_runtime_stats_lines():
+    """生成运行状态页面的文本行：各缓存的命中/未命中/淘汰统计及队列状态。"""
+    lines = ["", "缓存："]
+    for cache in CACHE_REGISTRY:
+        st = cache.stats()
+        lines.append(f"• {cache.name}：{st['size']}/{st['maxsize']} 条，命中率 {st['hit_rate'] * 100:.1f}%")
+        lines.append(f"  命中 {st['hits']}，过期命中 {st['stale_hits']}，未命中 {st['misses']}，淘汰 {st['evictions']}，过期 {st['expirations']}")
+    stats = collect_runtime_stats()
+    tmdb_stats = stats.get('tmdb_cache', {})
+    file_id_stats = stats.get('telegram_file_ids', {})
+    lines.append(f"• 海报 file_id：命中率 {file_id_stats.get('hit_rate', 0) * 100:.1f}%，命中 {file_id_stats.get('hits', 0)}，未命中 {file_id_stats.get('misses', 0)}，失效回退 {file_id_stats.get('stale', 0)}")
+    lines.append(f"• TMDB 接口：实际调用 {tmdb_stats.get('api_calls', 0)} 次，缓存节省 {tmdb_stats.get('saved_calls', 0)} 次（其中 404 负缓存 {tmdb_stats.get('negative_hits', 0)} 次）")
+    for name, st in stats.get('ip_geolocation', {}).items():
+        skip_text = f"，暂停 {st['skipped_for_seconds']}s" if st['skipped_for_seconds'] else ""
+        lines.append(f"• IP接口 {name}：调用 {st['calls']}，失败 {st['failures']}，平均耗时 {st['avg_latency_ms']}ms{skip_text}")
+    lines.append("")
+    lines.append("队列：")
+    webhook_queue = stats.get('webhook_queue', {})
+    lines.append(f"• Webhook 待处理 {webhook_queue.get('pending', 0)}，延时任务 {webhook_queue.get('scheduled_tasks', 0)}")
+    outbox = stats.get('telegram_outbox', {})
+    depth = outbox.get('queue_depth', {})
+    lines.append(f"• Telegram 发送队列：交互 {depth.get('interactive', 0)}，批量 {depth.get('bulk', 0)}，平均等待 {outbox.get('avg_wait_seconds', 0)}s")
+    lines.append(f"• 待删除消息 {stats.get('message_deletions', {}).get('pending', 0)}")
+    index_stats = stats.get('library_index', {})
+    if index_stats.get('ready'):
+        lines.append(f"• 媒体库索引：{index_stats.get('items', 0)} 个条目，本地检索 {index_stats.get('local_searches', 0)} 次，接口检索 {index_stats.get('fallback_searches', 0)} 次")
+    interaction_stats = stats.get('interaction_state', {})
+    if interaction_stats:
+        lines.append("")
+        lines.append("交互状态：")
+        for namespace, st in interaction_stats.items():
+            lines.append(f"• {INTERACTION_CACHES[namespace].name}：{st['size']}/{st['maxsize']} 条，约 {st['memory_bytes'] / 1024:.1f} KB")
+    return lines
+
 def send_settings_menu(chat_id, user_id, message_id=None, menu_key='root'):
     """
     发送或编辑设置菜单。
@@ -2833,7 +4228,10 @@ def send_settings_menu(chat_id, user_id, message_id=None, menu_key='root'):
         text_parts.append("管理机器人的各项功能与通知！")
         
     buttons = []
-    if menu_key == 'ip_api_selection':
+    if menu_key == 'runtime_stats':
+        text_parts.extend(escape_markdown(line) for line in format_runtime_stats_lines())
+        buttons.append([{'text': '🔄 刷新', 'callback_data': f'n_runtime_stats_{user_id}'}])
+    elif menu_key == 'ip_api_selection':
         text_parts.append("请选择一个IP地理位置查询服务接口。")
         current_provider = get_setting('settings.ip_api_provider') or 'baidu'
         for child_key in node['children']:
@@ -2880,7 +4278,6 @@ def post_update_result_to_telegram(*, chat_id: int, message_id: int, callback_me
     try:
         if len(escaped_result) < 900:
             if is_photo_card:
-                url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageCaption"
                 payload = {
                     'chat_id': chat_id,
                     'message_id': message_id,
@@ -2888,7 +4285,7 @@ def post_update_result_to_telegram(*, chat_id: int, message_id: int, callback_me
                     'parse_mode': 'MarkdownV2',
                     'reply_markup': json.dumps({'inline_keyboard': []})
                 }
-                resp = make_request_with_retry('POST', url, json=payload, timeout=10)
+                resp = telegram_api_request('editMessageCaption', chat_id=chat_id, coalesce_key=('edit', str(chat_id), message_id), json=payload, timeout=10)
                 used_original = bool(resp)
             else:
                 resp = edit_telegram_message(chat_id, message_id, escaped_result, inline_buttons=[])
@@ -2896,7 +4293,6 @@ def post_update_result_to_telegram(*, chat_id: int, message_id: int, callback_me
         else:
             summary_message = "✅ 更新成功！\n详细日志见下方新消息。"
             if is_photo_card:
-                url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageCaption"
                 payload = {
                     'chat_id': chat_id,
                     'message_id': message_id,
@@ -2904,7 +4300,7 @@ def post_update_result_to_telegram(*, chat_id: int, message_id: int, callback_me
                     'parse_mode': 'MarkdownV2',
                     'reply_markup': json.dumps({'inline_keyboard': []})
                 }
-                make_request_with_retry('POST', url, json=payload, timeout=10)
+                telegram_api_request('editMessageCaption', chat_id=chat_id, coalesce_key=('edit', str(chat_id), message_id), json=payload, timeout=10)
             else:
                 edit_telegram_message(chat_id, message_id, escape_markdown(summary_message), inline_buttons=[])
 
@@ -2986,12 +4382,9 @@ def handle_callback_query(callback_query):
         answer_callback_query(query_id, text="正在执行删除...", show_alert=False)
 
         def _paths_for_series(_series_id):
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{_series_id}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Path,Name,ProductionYear'}
-            resp = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-            if not resp:
+            item = get_emby_item(_series_id, 'Path,Name,ProductionYear')
+            if not item:
                 return None, None, "❌ 获取节目路径失败。"
-            item = resp.json()
             base_path = item.get('Path') or ""
             if base_path and os.path.splitext(base_path)[1]:
                 base_path = os.path.dirname(base_path)
@@ -3520,13 +4913,11 @@ def handle_callback_query(callback_query):
         if action == 'delete':
             item_id, initiator_id_str = rest_params.split('_')
             answer_callback_query(query_id, "正在获取节目类型...")
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item_id}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Type'}
-            response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-            if not response:
+            item_data = get_emby_item(item_id, 'Type')
+            if not item_data:
                 edit_telegram_message(chat_id, message_id, escape_markdown("❌ 获取节目类型失败，请重试。"), inline_buttons=[])
                 return
-            item_type = response.json().get('Type')
+            item_type = item_data.get('Type')
             if item_type == 'Movie':
                 buttons = [
                     [{'text': '⏏️ 从Emby中删除节目', 'callback_data': f'm_deleteemby_{item_id}_{initiator_id_str}'}],
@@ -3598,13 +4989,10 @@ def handle_callback_query(callback_query):
                 edit_telegram_message(chat_id, message_id, escape_markdown("❌ 操作失败：网盘目录 (media_cloud_path) 未在配置中设置。"), inline_buttons=buttons)
                 return
 
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item_id}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Path,Name,ProductionYear'}
-            response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-            if not response:
+            item_data = get_emby_item(item_id, 'Path,Name,ProductionYear')
+            if not item_data:
                 answer_callback_query(query_id, "获取项目信息失败！", show_alert=True)
                 return
-            item_data = response.json()
             item_name = item_data.get('Name', '未知节目')
             year = item_data.get('ProductionYear')
             full_item_name = f"{item_name} ({year})" if item_name and year else item_name
@@ -3632,13 +5020,10 @@ def handle_callback_query(callback_query):
             item_id_to_delete, initiator_id_str = rest_params.split('_')
             answer_callback_query(query_id, "正在获取信息并执行删除...", show_alert=False)
 
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item_id_to_delete}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Name,ProductionYear'}
-            response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
+            item_data = get_emby_item(item_id_to_delete, 'Name,ProductionYear')
 
             full_item_name = f"项目 (ID: {item_id_to_delete})"
-            if response:
-                item_data = response.json()
+            if item_data:
                 name = item_data.get('Name', '')
                 year = item_data.get('ProductionYear')
                 if name and year:
@@ -3655,14 +5040,12 @@ def handle_callback_query(callback_query):
             item_id, initiator_id_str = rest_params.split('_')
             answer_callback_query(query_id, "正在执行删除操作...", show_alert=False)
 
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item_id}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Path'}
-            response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-            if not response:
+            item_data = get_emby_item(item_id, 'Path')
+            if not item_data:
                 edit_telegram_message(chat_id, message_id, "❌ 获取项目路径失败，无法删除。", inline_buttons=[])
                 return
 
-            item_path = response.json().get('Path')
+            item_path = item_data.get('Path')
 
             if action == 'deletelocalconfirm':
                 result_message = delete_media_files(item_path, delete_local=True)
@@ -3679,14 +5062,12 @@ def handle_callback_query(callback_query):
             item_id, initiator_id_str = rest_params.split('_')
             answer_callback_query(query_id, "正在从云端更新文件...", show_alert=False)
 
-            full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item_id}"
-            params = {'api_key': EMBY_API_KEY, 'Fields': 'Path'}
-            response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-            if not response:
+            item_data = get_emby_item(item_id, 'Path')
+            if not item_data:
                 edit_telegram_message(chat_id, message_id, "❌ 获取项目路径失败，无法更新。", inline_buttons=[])
                 return
 
-            item_path = response.json().get('Path')
+            item_path = item_data.get('Path')
             if item_path and os.path.splitext(item_path)[1]:
                 item_path = os.path.dirname(item_path)
 
@@ -3809,7 +5190,7 @@ def handle_telegram_command(message):
                 original_user_id = user_search_state.get(chat_id)
                 if original_user_id is None or original_user_id != user_id:
                     return
-                del user_search_state[chat_id]
+                user_search_state.pop(chat_id, None)
                 print(f"🔍 用户 {user_id} 发起了搜索: {msg_text}")
                 send_search_emby_and_format(msg_text, chat_id, user_id, is_group_chat, mention)
                 return
@@ -3822,7 +5203,7 @@ def handle_telegram_command(message):
             
             if state == 'awaiting_new_user_credentials':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 parts = msg_text.split()
                 if len(parts) > 2 or (len(parts) > 0 and ' ' in parts[0]):
                     error_msg = "❌ 格式错误。用户名不能包含空格，且用户名和密码之间只能用一个空格分隔。"
@@ -3843,7 +5224,7 @@ def handle_telegram_command(message):
 
             if state == 'awaiting_rename_info':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 parts = msg_text.split()
                 if len(parts) != 2 or ' ' in parts[0] or ' ' in parts[1]:
                     error_msg = "❌ 格式错误。请输入旧用户名和新用户名，用一个空格隔开，且两者均不能包含空格。"
@@ -3862,7 +5243,7 @@ def handle_telegram_command(message):
 
             if state == 'awaiting_password_change_info':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 parts = msg_text.split()
                 if len(parts) > 2 or (len(parts) > 0 and ' ' in parts[0]):
                     error_msg = "❌ 格式错误。用户名不能包含空格，且用户名和新密码之间只能用一个空格分隔。"
@@ -3891,7 +5272,7 @@ def handle_telegram_command(message):
 
             if state == 'awaiting_user_to_delete':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 username_to_delete = msg_text.strip()
 
                 emby_bot_username = (CONFIG.get('emby', {}).get('username') or "").lower()
@@ -3916,13 +5297,13 @@ def handle_telegram_command(message):
 
             if state == 'awaiting_message_for_session':
                 session_id_to_send = ctx['session_id']
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 print(f"✉️ 用户 {user_id} 回复了消息，发送给会话 {session_id_to_send}: {msg_text}")
                 send_message_to_emby_session(session_id_to_send, msg_text, chat_id)
                 return
 
             if state == 'awaiting_broadcast_message':
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 sessions_to_broadcast = [s for s in get_active_sessions() if s.get('NowPlayingItem')]
                 if not sessions_to_broadcast:
                     send_simple_telegram_message("当前无人观看，无需群发。", chat_id)
@@ -3965,7 +5346,7 @@ def handle_telegram_command(message):
                         [{'text': '↩️ 退出管理', 'callback_data': f'm_exit_dummy_{user_id}'}],
                     ]
 
-                    del user_context[chat_id]
+                    user_context.pop(chat_id, None)
                     if origin_msg_id:
                         edit_telegram_message(chat_id, origin_msg_id, escape_markdown(msg), inline_buttons=buttons)
                     else:
@@ -4008,7 +5389,7 @@ def handle_telegram_command(message):
                         [{'text': '↩️ 退出管理', 'callback_data': f'm_exit_dummy_{user_id}'}],
                     ]
 
-                    del user_context[chat_id]
+                    user_context.pop(chat_id, None)
                     if origin_msg_id:
                         edit_telegram_message(chat_id, origin_msg_id, escape_markdown(msg), inline_buttons=buttons)
                     else:
@@ -4019,7 +5400,7 @@ def handle_telegram_command(message):
 
             if state == 'awaiting_manage_query':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 if original_message_id:
                     delete_telegram_message(chat_id, original_message_id)
                 print(f"🗃️ 用户 {user_id} 回复了管理查询: {msg_text}")
@@ -4028,7 +5409,7 @@ def handle_telegram_command(message):
             
             if state == 'awaiting_new_show_info':
                 original_message_id = ctx.get('message_id')
-                del user_context[chat_id]
+                user_context.pop(chat_id, None)
                 
                 parts = msg_text.split()
                 if len(parts) < 3 or not parts[-2].isdigit() or len(parts[-2]) != 4:
@@ -4093,12 +5474,8 @@ def handle_telegram_command(message):
                         forced_media_type = 'movie'
 
                     if forced_media_type:
-                        url = f"https://api.themoviedb.org/3/{forced_media_type}/{tmdb_id}"
-                        params = {'api_key': TMDB_API_TOKEN, 'language': 'zh-CN'}
-                        proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-                        response = make_request_with_retry('GET', url, params=params, timeout=10, proxies=proxies, max_retries=1)
-                        if response:
-                            tmdb_details = response.json()
+                        tmdb_details = tmdb_get(f"{forced_media_type}/{tmdb_id}", {'language': 'zh-CN'}, max_retries=1)
+                        if tmdb_details:
                             if not tmdb_details.get('title') and not tmdb_details.get('name'):
                                 tmdb_details = None
                     
@@ -4160,12 +5537,13 @@ def handle_telegram_command(message):
             "📊 /status" + escape_markdown(" - 查看Emby服务器上的当前播放状态（仅限服务器管理员）。\n\n") +
             "⚙️ /settings" + escape_markdown(" - 进入交互式菜单以配置机器人通知和功能（仅限服务器管理员）。\n\n") +
             "🗃️ /manage" + escape_markdown(" - 管理Emby节目、媒体文件和用户（仅限服务器管理员）。\n\n") +
+            "🌐 /ipdb" + escape_markdown(" - 重新加载本地IP数据库，/ipdb update 先下载最新数据（仅限服务器管理员）。\n\n") +
             escape_markdown("您可以直接输入命令开始使用。")
         )
         send_telegram_notification(text=welcome_text, chat_id=chat_id, disable_preview=True)
         return
 
-    if command in ['/status', '/settings', '/manage']:
+    if command in ['/status', '/settings', '/manage', '/ipdb']:
         if not is_super_admin(user_id):
             send_simple_telegram_message("权限不足：此命令仅限超级管理员使用。", chat_id)
             print(f"🚫 拒绝用户 {user_id} 执行管理员命令 {command}")
@@ -4198,6 +5576,12 @@ def handle_telegram_command(message):
             send_settings_menu(chat_id, user_id)
             return
 
+        if command == '/ipdb':
+            download = msg_text[len('/ipdb'):].strip().lower() == 'update'
+            success, result_message = reload_local_ip_database(download=download)
+            send_simple_telegram_message(f"{'✅' if success else '❌'} {result_message}", chat_id)
+            return
+
         if command == '/manage':
             search_term = msg_text[len('/manage'):].strip()
             if search_term:
@@ -4243,20 +5627,7 @@ def send_manage_emby_and_format(query, chat_id, user_id, is_group_chat, mention)
         send_deletable_telegram_notification("错误：机器人管理员尚未在配置文件中设置 Emby `user_id`。", chat_id=chat_id)
         return
 
-    url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items"
-    params = {
-        'api_key': EMBY_API_KEY, 
-        'SearchTerm': search_term, 
-        'IncludeItemTypes': 'Movie,Series',
-        'Recursive': 'true', 
-        'Fields': 'ProviderIds,Path,ProductionYear,Name'
-    }
-
-    if year_for_filter:
-        params['Years'] = year_for_filter
-        
-    response = make_request_with_retry('GET', url, params=params, timeout=20)
-    results = response.json().get('Items', []) if response else []
+    results = search_emby_library(search_term, year_for_filter)
 
     if not results:
         send_deletable_telegram_notification(f"在 Emby 中找不到与“{escape_markdown(original_query)}”相关的任何内容。", chat_id=chat_id)
@@ -4322,13 +5693,10 @@ def send_manage_detail(chat_id, search_id, item_index, user_id):
     if not request_user_id:
         send_deletable_telegram_notification("错误：机器人管理员尚未设置 Emby `user_id`。", chat_id=chat_id)
         return
-    full_item_url = f"{EMBY_SERVER_URL}/Users/{request_user_id}/Items/{item_id}"
-    params = {'api_key': EMBY_API_KEY, 'Fields': 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated'}
-    response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-    if not response:
+    item = get_emby_item(item_id, 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated', request_user_id)
+    if not item:
         send_deletable_telegram_notification("获取详细信息失败。", chat_id=chat_id)
         return
-    item = response.json()
     item_type, raw_title, raw_overview = item.get('Type'), item.get('Name', '未知标题'), item.get('Overview', '暂无剧情简介')
     final_year = extract_year_from_path(item.get('Path')) or item.get('ProductionYear') or ''
     media_details = get_media_details(item, request_user_id)
@@ -4408,45 +5776,70 @@ def send_manage_detail(chat_id, search_id, item_index, user_id):
         delay_seconds=180
     )
 
+def dispatch_telegram_update(update):
+    """处理一条Telegram更新（消息或按钮回调）。"""
+    if 'message' in update:
+        message = update['message']
+        chat_id = message['chat']['id']
+        message_id = message['message_id']
+
+        is_group_chat = chat_id < 0
+        should_delete = False
+        if not is_group_chat:
+            should_delete = True
+        else:
+            msg_text = message.get('text', '')
+            if msg_text.startswith('/'):
+                should_delete = True
+            elif 'reply_to_message' in message:
+                bot_id = int(TELEGRAM_TOKEN.split(':')[0])
+                if message['reply_to_message']['from']['id'] == bot_id:
+                    should_delete = True
+
+        if should_delete:
+            delete_user_message_later(chat_id, message_id, delay_seconds=60)
+
+        handle_telegram_command(message)
+
+    elif 'callback_query' in update:
+        handle_callback_query(update['callback_query'])
+
+def set_telegram_webhook():
+    """向Telegram注册Webhook地址（推送模式），成功返回 True。"""
+    print(f"🔗 正在注册 Telegram Webhook: {TELEGRAM_WEBHOOK_URL}")
+    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+    payload = {'url': TELEGRAM_WEBHOOK_URL, 'allowed_updates': json.dumps(['message', 'callback_query'])}
+    payload['secret_token'] = TELEGRAM_WEBHOOK_SECRET
+    if not CONFIG.get('telegram', {}).get('webhook_secret'):
+        print("ℹ️ 未配置 webhook_secret，已为本次运行随机生成校验密钥。")
+    response = telegram_api_request('setWebhook', priority=TELEGRAM_PRIORITY_INTERACTIVE, data=payload, timeout=10, proxies=proxies)
+    if response and response.json().get('ok'):
+        print("✅ Telegram Webhook 注册成功。")
+        return True
+    print("❌ Telegram Webhook 注册失败。")
+    return False
+
+def delete_telegram_webhook():
+    """删除已注册的Telegram Webhook，以便使用 getUpdates 轮询。"""
+    proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+    telegram_api_request('deleteWebhook', priority=TELEGRAM_PRIORITY_INTERACTIVE, data={'drop_pending_updates': False}, timeout=10, proxies=proxies)
+
 def poll_telegram_updates():
-    """轮询Telegram API获取更新。"""
+    """轮询Telegram API获取更新，并交给按会话分发的处理线程池。"""
     update_id = 0
+    delete_telegram_webhook()
     print("🤖 Telegram 命令轮询服务已启动...")
     while True:
         try:
             url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
             params = {'offset': update_id + 1, 'timeout': 30}
             proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
-            response = requests.get(url, params=params, timeout=40, proxies=proxies)
+            response = HTTP_SESSIONS.get(url, proxies).get(url, params=params, timeout=40, proxies=proxies)
             if response.status_code == 200:
                 updates = response.json().get('result', [])
                 for update in updates:
                     update_id = update['update_id']
-                    if 'message' in update:
-                        message = update['message']
-                        chat_id = message['chat']['id']
-                        message_id = message['message_id']
-                        
-                        is_group_chat = chat_id < 0
-                        should_delete = False
-                        if not is_group_chat:
-                            should_delete = True
-                        else:
-                            msg_text = message.get('text', '')
-                            if msg_text.startswith('/'):
-                                should_delete = True
-                            elif 'reply_to_message' in message:
-                                bot_id = int(TELEGRAM_TOKEN.split(':')[0])
-                                if message['reply_to_message']['from']['id'] == bot_id:
-                                    should_delete = True
-                        
-                        if should_delete:
-                            delete_user_message_later(chat_id, message_id, delay_seconds=60)
-
-                        handle_telegram_command(message)
-
-                    elif 'callback_query' in update:
-                        handle_callback_query(update['callback_query'])
+                    TELEGRAM_DISPATCHER.submit(update)
             else:
                 print(f"❌ 轮询 Telegram 更新失败: {response.status_code} - {response.text}")
                 time.sleep(10)
@@ -4463,580 +5856,1509 @@ def poll_telegram_updates():
             traceback.print_exc()
             time.sleep(5)
 
-class WebhookHandler(BaseHTTPRequestHandler):
-    """处理Emby Webhook请求的HTTP请求处理程序。"""
+TELEGRAM_UPDATE_CONTEXT = threading.local()
 
-    def do_POST(self):
-        """处理POST请求，解析并处理Emby事件。"""
-        print("🔔 接收到 Webhook 请求。")
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data_bytes = self.rfile.read(content_length)
+class TelegramUpdateDispatcher:
+    """
+    按会话分发 Telegram 更新的处理线程池：
+    - 同一会话的更新按接收顺序逐条处理，不同会话并行处理
+    - 同时执行的处理函数数量不超过 max_workers
+    - 统计从收到更新到首次发出应答（回复/编辑/回调应答）的延迟
+    """
 
-            content_type = self.headers.get('Content-Type', '').lower()
-            json_string = None
+    def __init__(self, handler, max_workers=4):
+        self.handler = handler
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='telegram-update', initializer=self._init_worker)
+        self._chat_queues = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = collections.deque(maxlen=500)
+        self._handled = 0
+
+    @staticmethod
+    def _init_worker():
+        TELEGRAM_PRIORITY_CONTEXT.priority = TELEGRAM_PRIORITY_INTERACTIVE
+
+    @staticmethod
+    def chat_key(update):
+        """返回更新所属的会话标识，用于保证同一会话内的处理顺序。"""
+        if 'message' in update:
+            return update['message']['chat']['id']
+        if 'callback_query' in update:
+            callback_query = update['callback_query']
+            message = callback_query.get('message') or {}
+            return (message.get('chat') or {}).get('id') or callback_query.get('from', {}).get('id')
+        return None
 
-            if 'application/json' in content_type:
-                json_string = post_data_bytes.decode('utf-8')
-            elif 'application/x-www-form-urlencoded' in content_type:
-                parsed_form = parse_qs(post_data_bytes.decode('utf-8'))
-                json_string = parsed_form.get('data', [None])[0]
-            else:
-                print(f"❌ 不支持的 Content-Type: {content_type}")
-                self.send_response(400); self.end_headers()
+    def submit(self, update):
+        """将更新加入其会话的队列；会话当前空闲时立即安排处理。"""
+        key = self.chat_key(update)
+        state = {'received_at': time.monotonic(), 'answered': False}
+        with self._lock:
+            queue = self._chat_queues.get(key)
+            if queue is not None:
+                queue.append((update, state))
                 return
+            self._chat_queues[key] = collections.deque([(update, state)])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        with self._lock:
+            update, state = self._chat_queues[key].popleft()
+            self._in_flight += 1
+        TELEGRAM_UPDATE_CONTEXT.state = state
+        try:
+            self.handler(update)
+        except Exception as e:
+            print(f"❌ 处理 Telegram 更新时发生未处理错误: {e}")
+            traceback.print_exc()
+        finally:
+            TELEGRAM_UPDATE_CONTEXT.state = None
+            with self._lock:
+                self._in_flight -= 1
+                self._handled += 1
+                if self._chat_queues[key]:
+                    self._executor.submit(self._drain, key)
+                else:
+                    del self._chat_queues[key]
 
-            if not json_string:
-                print("❌ Webhook 请求中没有数据。")
-                self.send_response(400); self.end_headers()
+    def record_answer(self, state):
+        """在首次向用户发出应答时记录延迟。"""
+        if not state or state['answered']:
+            return
+        state['answered'] = True
+        latency = time.monotonic() - state['received_at']
+        with self._lock:
+            self._latencies.append(latency)
+        if latency > 5:
+            print(f"⚠️ Telegram 更新应答延迟较高: {latency:.2f}s")
+
+    def stats(self):
+        """处理中/排队中的更新数及应答延迟统计（最近 500 条）。"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            queued = sum(len(q) for q in self._chat_queues.values())
+            stats = {'in_flight': self._in_flight, 'queued': queued, 'handled': self._handled}
+        if latencies:
+            stats['answer_latency_seconds'] = {
+                'avg': round(sum(latencies) / len(latencies), 3),
+                'p50': round(latencies[len(latencies) // 2], 3),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                'max': round(latencies[-1], 3),
+            }
+        return stats
+
+TELEGRAM_DISPATCHER = TelegramUpdateDispatcher(dispatch_telegram_update, max_workers=TELEGRAM_UPDATE_WORKERS)
+register_metrics_provider('telegram_updates', TELEGRAM_DISPATCHER.stats)
+
+class TaskScheduler:
+    """
+    基于最小堆的延时任务调度器：
+    - 单个调度线程按到期时间取出任务，交给线程池执行，避免慢任务阻塞其他任务
+    - schedule() 返回任务ID，可通过 cancel() 取消尚未执行的任务
+    """
+
+    def __init__(self, max_workers=4, name='scheduler'):
+        self.name = name
+        self._heap = []
+        self._tasks = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._thread = None
+
+    def start(self):
+        """启动调度线程（重复调用无副作用）。"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
                 return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        print(f"⏱️ 任务调度器 {self.name} 已启动。")
+
+    def schedule(self, delay_seconds, callback, *args, **kwargs):
+        """在 delay_seconds 秒后执行 callback(*args, **kwargs)，返回任务ID。"""
+        task_id = next(self._counter)
+        entry = (time.monotonic() + max(0, delay_seconds), task_id, callback, args, kwargs)
+        with self._cond:
+            self._tasks[task_id] = entry
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return task_id
+
+    def cancel(self, task_id):
+        """取消一个尚未执行的任务，成功返回 True。"""
+        with self._cond:
+            return self._tasks.pop(task_id, None) is not None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._tasks)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][1] not in self._tasks:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait_seconds = self._heap[0][0] - time.monotonic()
+                    if wait_seconds <= 0:
+                        break
+                    self._cond.wait(wait_seconds)
+                _, task_id, callback, args, kwargs = heapq.heappop(self._heap)
+                self._tasks.pop(task_id, None)
+            self._executor.submit(self._execute, callback, args, kwargs)
 
-            event_data = json.loads(unquote(json_string))
-            print("\n--- Emby Webhook 推送内容开始 ---\n")
-            print(json.dumps(event_data, indent=2, ensure_ascii=False))
-            print("\n--- Emby Webhook 推送内容结束 ---\n")
+    def _execute(self, callback, args, kwargs):
+        try:
+            callback(*args, **kwargs)
+        except Exception as e:
+            print(f"❌ 调度任务 {getattr(callback, '__name__', callback)} 执行失败: {e}")
+            traceback.print_exc()
 
-            event_type = event_data.get('Event')
-            item_from_webhook = event_data.get('Item', {}) or {}
-            user = event_data.get('User', {}) or {}
-            session = event_data.get('Session', {}) or {}
-            playback_info = event_data.get('PlaybackInfo', {}) or {}
-            print(f"ℹ️ 检测到 Emby 事件: {event_type}")
-            
-            if event_type == "library.new":
-                if not any([
-                    get_setting('settings.notification_management.library_new.to_group'),
-                    get_setting('settings.notification_management.library_new.to_channel'),
-                    get_setting('settings.notification_management.library_new.to_private')
-                ]):
-                    print("⚠️ 已关闭新增节目通知，跳过。")
-                    self.send_response(204); self.end_headers()
-                    return
+TASK_SCHEDULER = TaskScheduler(max_workers=SCHEDULER_MAX_WORKERS)
 
-                item = item_from_webhook
-                stream_details = None
-
-                if item.get('Id') and EMBY_USER_ID:
-                    print(f"ℹ️ 正在使用 Emby API 补充项目 {item.get('Id')} 的元数据。")
-                    full_item_url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{item.get('Id')}"
-                    params = {'api_key': EMBY_API_KEY, 'Fields': 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated,SeriesProviderIds,ParentIndexNumber,SeriesId'}
-                    response = make_request_with_retry('GET', full_item_url, params=params, timeout=10)
-                    if response:
-                        item = response.json()
-                        print("✅ 补充元数据成功。")
-                    else:
-                        print("❌ 补充元数据失败，将使用 Webhook 原始数据。")
-
-                media_details = get_media_details(item, event_data.get('User', {}).get('Id'))
-                added_summary, added_list = parse_episode_ranges_from_description(event_data.get('Description', ''))
-
-                if item.get('Type') == 'Series':
-                    def sxxeyy_key(s_str):
-                        match = re.match(r'S(\d+)E(\d+)', s_str, re.IGNORECASE)
-                        if match:
-                            return int(match.group(1)), int(match.group(2))
-                        return 0, 0
-
-                    if added_list:
-                        print("🔍 规格查找策略 1: 检查本次新增的剧集...")
-                        sorted_added_list = sorted(added_list, key=sxxeyy_key)
-                        for ep_str in sorted_added_list:
-                            s_num, e_num = sxxeyy_key(ep_str)
-                            if s_num > 0 and e_num > 0:
-                                episode_item = get_episode_item_by_number(item.get('Id'), s_num, e_num)
-                                if episode_item:
-                                    temp_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
-                                    if temp_details:
-                                        print(f"✅ 规格查找成功 (策略 1): 使用 {ep_str} 的规格。")
-                                        stream_details = temp_details
-                                        break
-                    
-                    if not stream_details and added_list:
-                        print("🔍 规格查找策略 2: 检查同季的其他剧集...")
-                        involved_seasons = sorted(list(set(sxxeyy_key(s)[0] for s in added_list if sxxeyy_key(s)[0] > 0)))
-                        for s_num in involved_seasons:
-                            episode_item = get_any_episode_from_season(item.get('Id'), s_num)
-                            if episode_item:
-                                temp_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
-                                if temp_details:
-                                    print(f"✅ 规格查找成功 (策略 2): 使用 S{s_num:02d} 中参考集 (ID: {episode_item.get('Id')}) 的规格。")
-                                    stream_details = temp_details
-                                    break
-                    
-                    if not stream_details:
-                        print("🔍 规格查找策略 3: 回退至获取媒体库最新一集。")
-                        episode_item = _get_latest_episode_info(item.get('Id'))
-                        if episode_item:
-                            stream_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
-                            if stream_details:
-                                s_num = episode_item.get('ParentIndexNumber', 0)
-                                e_num = episode_item.get('IndexNumber', 0)
-                                print(f"✅ 规格查找成功 (策略 3): 使用了媒体库最新集 S{s_num:02d}E{e_num:02d} (ID: {episode_item.get('Id')}) 的规格。")
-                else:
-                    print("ℹ️ 新增项目为电影/其他类型，准备延时以等待Emby分析媒体源...")
-                    time.sleep(30)
-                    print(f"🔍 规格查找策略 1: 尝试获取项目 {item.get('Name')} (ID: {item.get('Id')}) 的精确规格...")
-                    stream_details = get_media_stream_details(item.get('Id'), None)
-                    if stream_details:
-                        print(f"✅ 规格查找成功 (策略 1): 成功获取项目 {item.get('Name')} (ID: {item.get('Id')}) 的规格。")
-
-                if not stream_details and item.get('Type') == 'Episode':
-                    season_num = item.get('ParentIndexNumber')
-                    series_id = item.get('SeriesId')
-                    if season_num is not None and series_id:
-                        print(f"🔍 规格查找策略 2: 策略1失败，尝试查找 S{season_num:02d} 中其他剧集的规格作为参考...")
-                        ref_episode_item = get_any_episode_from_season(series_id, season_num)
-                        if ref_episode_item:
-                            stream_details = get_media_stream_details(ref_episode_item.get('Id'), EMBY_USER_ID)
-                            if stream_details:
-                                print(f"✅ 规格查找成功 (策略 2): 使用了同季参考集 (ID: {ref_episode_item.get('Id')}) 的规格。")
-
-                if not stream_details:
-                    print("❌ 所有规格查找策略均失败，将发送不含规格的通知。")
-
-                parts = []
-                raw_episode_info = ""
-                if item.get('Type') == 'Episode':
-                    s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), item.get('Name')
-                    raw_episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
-
-                if item.get('Type') in ['Episode', 'Series', 'Season']:
-                    raw_title = item.get('SeriesName', item.get('Name', '未知标题'))
-                else:
-                    raw_title = item.get('Name', '未知标题')
+TELEGRAM_PRIORITY_INTERACTIVE = 0  # 交互回复（命令/按钮响应）
+TELEGRAM_PRIORITY_BULK = 1  # 批量通知（入库/播放等推送）
+TELEGRAM_PRIORITY_CONTEXT = threading.local()
 
-                title_with_year_and_episode = f"{raw_title} ({media_details.get('year')})" if media_details.get('year') else raw_title
-                title_with_year_and_episode += raw_episode_info
-                action_text = "✅ 新增"
-                item_type_cn = "剧集" if item.get('Type') in ['Episode', 'Series', 'Season'] else "电影" if item.get('Type') == 'Movie' else ""
+def get_telegram_priority():
+    """返回当前线程发送Telegram请求时使用的优先级（默认为批量通知）。"""
+    return getattr(TELEGRAM_PRIORITY_CONTEXT, 'priority', TELEGRAM_PRIORITY_BULK)
 
-                if get_setting('settings.content_settings.new_library_notification.show_media_detail'):
-                    if get_setting('settings.content_settings.new_library_notification.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
-                        full_title_line = f"[{escape_markdown(title_with_year_and_episode)}]({media_details.get('tmdb_link')})"
-                    else:
-                        full_title_line = escape_markdown(title_with_year_and_episode)
-                    parts.append(f"{action_text}{item_type_cn} {full_title_line}")
-                else:
-                    parts.append(f"{action_text}{item_type_cn}")
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量。调用方需自行加锁。"""
 
-                if added_summary:
-                    count_match = re.search(r'(\d+)\s*项目', (event_data.get('Title') or ''))
-                    count_str = f"（共 {count_match.group(1)} 集）" if count_match else ""
-                    parts.append(f"本次新增：{escape_markdown(added_summary)}{escape_markdown(count_str)}")
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
 
-                if get_setting('settings.content_settings.new_library_notification.show_media_type'):
-                    raw_program_type = get_program_type_from_path(item.get('Path'))
-                    if raw_program_type:
-                        parts.append(f"节目类型：{escape_markdown(raw_program_type)}")
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-                if get_setting('settings.content_settings.new_library_notification.show_overview'):
-                    overview_text = item.get('Overview', '暂无剧情简介')
-                    if overview_text:
-                        overview_text = overview_text[:150] + "..." if len(overview_text) > 150 else overview_text
-                        parts.append(f"剧情：{escape_markdown(overview_text)}")
+    def wait_time(self, now):
+        """返回距离下一个可用令牌还需等待的秒数（0 表示可立即发送）。"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
 
-                if stream_details:
-                    formatted_specs = format_stream_details_message(stream_details, prefix='new_library_notification')
-                    for part in formatted_specs:
-                        parts.append(escape_markdown(part))
-
-                if get_setting('settings.content_settings.new_library_notification.show_progress_status'):
-                    progress_lines = build_progress_lines_for_library_new(item, media_details)
-                    if progress_lines:
-                        parts.extend(progress_lines)
-
-                if get_setting('settings.content_settings.new_library_notification.show_timestamp'):
-                    parts.append(f"入库时间：{escape_markdown(datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'))}")
-
-                message = "\n".join(parts)
-                photo_url = None
-                if get_setting('settings.content_settings.new_library_notification.show_poster'):
-                    photo_url = media_details.get('poster_url')
-
-                buttons = []
-                if get_setting('settings.content_settings.new_library_notification.show_view_on_server_button') and EMBY_REMOTE_URL:
-                    item_id_, server_id = item.get('Id'), item.get('ServerId')
-                    if item_id_ and server_id:
-                        item_url = f"{EMBY_REMOTE_URL}/web/index.html#!/item?id={item_id_}&serverId={server_id}"
-                        buttons.append([{'text': '➡️ 在服务器中查看', 'url': item_url}])
-
-                auto_delete_group   = get_setting('settings.auto_delete_settings.new_library.to_group')
-                auto_delete_channel = get_setting('settings.auto_delete_settings.new_library.to_channel')
-                auto_delete_private = get_setting('settings.auto_delete_settings.new_library.to_private')
-
-                if get_setting('settings.notification_management.library_new.to_group') and GROUP_ID:
-                    print(f"✉️ 向群组 {GROUP_ID} 发送新增通知。")
-                    if auto_delete_group:
-                        send_deletable_telegram_notification(message, photo_url, chat_id=GROUP_ID, inline_buttons=buttons if buttons else None, delay_seconds=60)
-                    else:
-                        send_telegram_notification(message, photo_url, chat_id=GROUP_ID, inline_buttons=buttons if buttons else None)
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
 
-                if get_setting('settings.notification_management.library_new.to_channel') and CHANNEL_ID:
-                    print(f"✉️ 向频道 {CHANNEL_ID} 发送新增通知。")
-                    if auto_delete_channel:
-                        send_deletable_telegram_notification(message, photo_url, chat_id=CHANNEL_ID, inline_buttons=buttons if buttons else None, delay_seconds=60)
-                    else:
-                        send_telegram_notification(message, photo_url, chat_id=CHANNEL_ID, inline_buttons=buttons if buttons else None)
+class TelegramOutbox:
+    """
+    Telegram 出站请求队列：
+    - 全局令牌桶（默认 30 条/秒）+ 每个会话的令牌桶（群组/频道默认 20 条/分钟，私聊默认 1 条/秒）
+    - 同一会话内严格先进先出，且同一时刻只有一个请求在发送；优先级只用于在不同会话之间选择：交互回复优先于批量通知
+    - 同一条消息尚未发出的多次编辑会合并为最后一次
+    - 每个会话一个先进先出队列；可发送会话的队首按 (优先级, 序号) 进入就绪堆，被限流的会话进入等待堆（按可发送时间排序），
+      出队只需查看堆顶，无需遍历整个队列
+    """
+    CHAT_LIMITED_METHODS = ('sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'editMessageText', 'editMessageCaption', 'editMessageMedia')
+
+    def __init__(self, workers=4, global_rate=30, group_rate_per_minute=20, private_rate=1):
+        self.workers = workers
+        self.group_rate = group_rate_per_minute / 60
+        self.private_rate = private_rate
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._chat_queues = {}  # chat_id -> deque[(优先级, 序号, 请求)]，未指定 chat_id 的请求放在 None 下
+        self._ready = []  # [(优先级, 序号, chat_id)]，惰性删除：出队时与会话队首核对
+        self._throttled = []  # [(可发送时间, chat_id)]
+        self._throttled_chats = set()
+        self._coalescing = {}
+        self._busy_chats = set()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stats = {'sent': 0, 'coalesced': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+
+    def start(self):
+        """启动发送线程（重复调用无副作用）。"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'telegram-sender-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"📤 Telegram 发送队列已启动（{self.workers} 个发送线程）。")
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if self._is_group_or_channel(chat_id):
+                bucket = TokenBucket(self.group_rate, max(1, round(self.group_rate * 60)))
+            else:
+                bucket = TokenBucket(self.private_rate, max(1, self.private_rate))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _is_group_or_channel(chat_id):
+        """群组/超级群组/频道的 ID 为负数，频道也可以用 @用户名 指定；配置的频道一律按群组限速。"""
+        chat_id = str(chat_id)
+        return chat_id.startswith('-') or chat_id.startswith('@') or (bool(CHANNEL_ID) and chat_id == str(CHANNEL_ID))
+
+    def submit(self, method_name, chat_id=None, priority=None, coalesce_key=None, **request_kwargs):
+        """将一个 Telegram API 请求加入队列，返回 Future（结果为 make_request_with_retry 的返回值）。"""
+        if priority is None:
+            priority = get_telegram_priority()
+        with self._cond:
+            if coalesce_key is not None:
+                job = self._coalescing.get(coalesce_key)
+                if job is not None:
+                    job['request_kwargs'] = request_kwargs
+                    self._stats['coalesced'] += 1
+                    print(f"🔗 合并对同一消息的编辑请求: {method_name}")
+                    return job['future']
+            job = {
+                'method_name': method_name,
+                'chat_id': str(chat_id) if chat_id is not None else None,
+                'chat_limited': chat_id is not None and method_name in self.CHAT_LIMITED_METHODS,
+                'coalesce_key': coalesce_key,
+                'request_kwargs': request_kwargs,
+                'future': Future(),
+                'enqueued_at': time.monotonic(),
+            }
+            queue = self._chat_queues.setdefault(job['chat_id'], collections.deque())
+            queue.append((priority, next(self._counter), job))
+            if len(queue) == 1:
+                self._mark_ready_locked(job['chat_id'])
+            if coalesce_key is not None:
+                self._coalescing[coalesce_key] = job
+            self._cond.notify()
+            return job['future']
+
+    def _mark_ready_locked(self, chat_id):
+        """会话空闲且未被限流时，将其队首放入就绪堆。"""
+        queue = self._chat_queues.get(chat_id)
+        if queue and chat_id not in self._busy_chats and chat_id not in self._throttled_chats:
+            heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_id))
+
+    def _take_next_locked(self):
+        """取出下一个可发送的请求；没有时返回 (None, 需要等待的秒数)。"""
+        now = time.monotonic()
+        global_wait = self._global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        while self._throttled and self._throttled[0][0] <= now:
+            _, chat_id = heapq.heappop(self._throttled)
+            self._throttled_chats.discard(chat_id)
+            self._mark_ready_locked(chat_id)
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._chat_queues.get(chat_id)
+            if not queue or queue[0][1] != seq or chat_id in self._busy_chats or chat_id in self._throttled_chats:
+                continue
+            job = queue[0][2]
+            if job['chat_limited']:
+                chat_wait = self._chat_bucket(chat_id).wait_time(now)
+                if chat_wait > 0:
+                    self._throttled_chats.add(chat_id)
+                    heapq.heappush(self._throttled, (now + chat_wait, chat_id))
+                    continue
+                self._chat_bucket(chat_id).consume(now)
+            self._global_bucket.consume(now)
+            queue.popleft()
+            if not queue:
+                del self._chat_queues[chat_id]
+            if job['coalesce_key'] is not None:
+                self._coalescing.pop(job['coalesce_key'], None)
+            if chat_id is not None:
+                self._busy_chats.add(chat_id)
+            else:
+                self._mark_ready_locked(None)
+            return job, 0
+        return None, (max(0, self._throttled[0][0] - now) if self._throttled else None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    job, wait_seconds = self._take_next_locked() if self._chat_queues else (None, None)
+                    if job:
+                        break
+                    self._cond.wait(wait_seconds)
+                waited = time.monotonic() - job['enqueued_at']
+                self._stats['sent'] += 1
+                self._stats['total_wait'] += waited
+                self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+            try:
+                url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/{job['method_name']}"
+                job['future'].set_result(make_request_with_retry('POST', url, **job['request_kwargs']))
+            except Exception as e:
+                job['future'].set_exception(e)
+            finally:
+                with self._cond:
+                    if job['chat_id'] is not None:
+                        self._busy_chats.discard(job['chat_id'])
+                        self._mark_ready_locked(job['chat_id'])
+                    self._cond.notify_all()
+
+    def stats(self):
+        """队列深度（按优先级）、已发送数、合并数及排队等待时间统计。"""
+        with self._cond:
+            depth = {'interactive': 0, 'bulk': 0}
+            for queue in self._chat_queues.values():
+                for priority, _, _ in queue:
+                    depth['interactive' if priority == TELEGRAM_PRIORITY_INTERACTIVE else 'bulk'] += 1
+            sent = self._stats['sent']
+            return {
+                'queue_depth': depth,
+                'sent': sent,
+                'coalesced': self._stats['coalesced'],
+                'avg_wait_seconds': round(self._stats['total_wait'] / sent, 3) if sent else 0,
+                'max_wait_seconds': round(self._stats['max_wait'], 3),
+            }
 
-                if get_setting('settings.notification_management.library_new.to_private') and ADMIN_USER_ID:
-                    print(f"✉️ 向管理员 {ADMIN_USER_ID} 发送新增通知。")
-                    if auto_delete_private:
-                        send_deletable_telegram_notification(message, photo_url, chat_id=ADMIN_USER_ID, inline_buttons=buttons if buttons else None, delay_seconds=60)
-                    else:
-                        send_telegram_notification(message, photo_url, chat_id=ADMIN_USER_ID, inline_buttons=buttons if buttons else None)
+TELEGRAM_OUTBOX = TelegramOutbox(
+    workers=TELEGRAM_SENDER_WORKERS,
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    group_rate_per_minute=TELEGRAM_GROUP_RATE_PER_MINUTE,
+    private_rate=TELEGRAM_PRIVATE_RATE
+)
+register_metrics_provider('telegram_outbox', TELEGRAM_OUTBOX.stats)
+NOTIFICATION_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='telegram-notify')  # 等待发送结果的批量通知线程池
+
+def send_in_background(func, *args, **kwargs):
+    """在通知线程池中执行发送函数并立即返回 Future，调用方（如 Webhook 事件处理线程）不必等待 Telegram 限流。"""
+    def _log_exception(future):
+        if future.exception() is not None:
+            print(f"❌ 后台发送通知 {getattr(func, '__name__', func)} 失败: {future.exception()}")
+    future = NOTIFICATION_EXECUTOR.submit(func, *args, **kwargs)
+    future.add_done_callback(_log_exception)
+    return future
+
+def telegram_api_request(method_name, chat_id=None, priority=None, coalesce_key=None, update_state=None, **request_kwargs):
+    """
+    通过发送队列调用 Telegram Bot API 并等待结果，返回值与 make_request_with_retry 相同。
+    update_state 为触发本次请求的 Telegram 更新的处理状态，默认取当前线程正在处理的更新，用于统计应答延迟。
+    """
+    TELEGRAM_DISPATCHER.record_answer(update_state or getattr(TELEGRAM_UPDATE_CONTEXT, 'state', None))
+    future = TELEGRAM_OUTBOX.submit(method_name, chat_id=chat_id, priority=priority, coalesce_key=coalesce_key, **request_kwargs)
+    return future.result()
 
-                self.send_response(200); self.end_headers()
+class MessageDeletionQueue:
+    """
+    统一管理所有定时删除的Telegram消息：
+    - 删除任务由 TaskScheduler 定时，到期后交给独立的删除线程池执行（含失败重试），不占用共享调度线程
+    - 待删除消息逐条写入 PersistentKVStore，重启后 load() 会恢复（已过期的立即删除）
+    - 支持按 (chat_id, message_id) 取消
+    """
+
+    def __init__(self, scheduler, store, legacy_path=None, max_workers=2, max_attempts=5, retry_delay=5):
+        self.scheduler = scheduler
+        self.store = store
+        self.legacy_path = legacy_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._pending = {}
+        self._task_ids = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='message-delete')
+
+    @staticmethod
+    def _key(chat_id, message_id):
+        return f"{chat_id}:{message_id}"
+
+    def _migrate_legacy_file(self):
+        """将旧版 JSON 文件中的待删除消息导入数据库并删除旧文件。"""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            self.store.import_items(entries.items(), ttl=7 * 86400)
+            os.remove(self.legacy_path)
+            print(f"📦 已将 {len(entries)} 条待删除消息从旧版文件迁移到数据库。")
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"❌ 迁移旧版待删除消息列表失败: {e}，将忽略。")
+
+    def load(self):
+        """从磁盘恢复待删除消息并重新调度。"""
+        self._migrate_legacy_file()
+        entries = dict(self.store.items())
+        now = time.time()
+        with self._lock:
+            for key, entry in entries.items():
+                self._pending[key] = entry
+                self._task_ids[key] = self.scheduler.schedule(max(0, entry['due'] - now), self._delete, key)
+        if entries:
+            print(f"♻️ 已恢复 {len(entries)} 条待删除消息。")
+        return len(entries)
+
+    def schedule(self, chat_id, message_id, delay_seconds):
+        """在 delay_seconds 秒后删除指定消息；同一消息重复调度时以最后一次为准。"""
+        key = self._key(chat_id, message_id)
+        with self._lock:
+            old_task_id = self._task_ids.pop(key, None)
+            if old_task_id is not None:
+                self.scheduler.cancel(old_task_id)
+            self._pending[key] = {'chat_id': chat_id, 'message_id': message_id, 'due': time.time() + delay_seconds}
+            self._task_ids[key] = self.scheduler.schedule(delay_seconds, self._delete, key)
+            self.store.put(key, self._pending[key], ttl=delay_seconds + 86400)
+
+    def cancel(self, chat_id, message_id):
+        """取消指定消息的定时删除，成功返回 True。"""
+        key = self._key(chat_id, message_id)
+        with self._lock:
+            task_id = self._task_ids.pop(key, None)
+            if task_id is None:
+                return False
+            self.scheduler.cancel(task_id)
+            self._pending.pop(key, None)
+            self.store.delete(key)
+            return True
+
+    def _delete(self, key):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            self._task_ids.pop(key, None)
+            if entry is None:
                 return
+        self._executor.submit(self._send_delete, key, entry)
 
-            if event_type == "library.deleted":
-                if not get_setting('settings.notification_management.library_deleted'):
-                    print("⚠️ 已关闭删除节目通知，跳过。")
-                    self.send_response(204); self.end_headers()
+    def _send_delete(self, key, entry):
+        """在删除线程池中调用 deleteMessage；请求失败时在本线程内按 retry_delay 重试，最终结果确定后才删除持久化记录。"""
+        print(f"⏳ 正在删除消息 ID: {entry['message_id']}。")
+        proxies = {'http': HTTP_PROXY, 'https': HTTP_PROXY} if HTTP_PROXY else None
+        payload = {'chat_id': entry['chat_id'], 'message_id': entry['message_id']}
+        try:
+            for attempt in range(self.max_attempts):
+                response = telegram_api_request('deleteMessage', chat_id=entry['chat_id'], data=payload, timeout=10, proxies=proxies, max_retries=1, accept_status=(400,))
+                if response is not None:
+                    if response.status_code == 400:
+                        print(f"ℹ️ 删除消息 {entry['message_id']}：可能已不存在或无权限，已忽略。")
                     return
+                if attempt + 1 < self.max_attempts:
+                    time.sleep(self.retry_delay)
+            print(f"❌ 删除消息 {entry['message_id']} 失败，已放弃。")
+        except Exception as e:
+            print(f"❌ 删除消息 {entry['message_id']} 时异常: {e}")
+        finally:
+            self.store.delete(key)
 
-                item = item_from_webhook
-                item_type = item.get('Type')
-                if item_type not in ['Movie', 'Series', 'Season', 'Episode']:
-                    print(f"⚠️ 忽略不支持的删除事件类型: {item_type}")
-                    self.send_response(204); self.end_headers()
-                    return
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
 
-                if item_type in ['Episode', 'Season'] and item.get('SeriesId'):
-                    series_id = item.get('SeriesId')
-                    try:
-                        url = f"{EMBY_SERVER_URL}/Users/{EMBY_USER_ID}/Items/{series_id}"
-                        params = {'api_key': EMBY_API_KEY, 'Fields': 'ProviderIds,Path,ProductionYear,ServerId'}
-                        resp = make_request_with_retry('GET', url, params=params, timeout=10)
-                        series_stub = resp.json() if resp else {}
-                    except Exception:
-                        series_stub = {}
-                    media_details = get_media_details(series_stub or item, EMBY_USER_ID)
-                    display_title = series_stub.get('Name') or item.get('SeriesName') or item.get('Name', '未知标题')
-                    year = series_stub.get('ProductionYear') or extract_year_from_path((series_stub.get('Path') or item.get('Path') or ''))
-                else:
-                    media_details = get_media_details(item, EMBY_USER_ID)
-                    display_title = item.get('Name', '未知标题')
-                    year = item.get('ProductionYear') or extract_year_from_path(item.get('Path'))
-
-                episode_info = ""
-                if item_type == 'Episode':
-                    s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), (item.get('Name') or '')
-                    episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
-                elif item_type == 'Season':
-                    s = item.get('IndexNumber')
-                    episode_info = f" 第 {s} 季" if s is not None else ""
-
-                title_full = f"{display_title} ({year})" if year else display_title
-                title_full += episode_info
-                parts = []
-                action_text = "🗑️ 删除"
-                item_type_cn = "剧集" if item_type in ['Series', 'Season', 'Episode'] else "电影"
-
-                if get_setting('settings.content_settings.library_deleted_notification.show_media_detail'):
-                    if get_setting('settings.content_settings.library_deleted_notification.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
-                        parts.append(f"{action_text}{item_type_cn} [{escape_markdown(title_full)}]({media_details.get('tmdb_link')})")
-                    else:
-                        parts.append(f"{action_text}{item_type_cn} {escape_markdown(title_full)}")
-                else:
-                    parts.append(f"{action_text}{item_type_cn}")
+MESSAGE_DELETIONS_STORE = PersistentKVStore(PENDING_DELETIONS_DB_PATH)
+MESSAGE_DELETIONS = MessageDeletionQueue(TASK_SCHEDULER, MESSAGE_DELETIONS_STORE, legacy_path=PENDING_DELETIONS_PATH)
+register_metrics_provider('message_deletions', lambda: {'pending': len(MESSAGE_DELETIONS)})
+
+class WebhookJournal:
+    """
+    基于磁盘的 Webhook 事件队列（日志目录）：
+    - 每个事件写入一个独立文件（先写临时文件再原子重命名），文件名为递增序号，与系统时钟无关；
+      启动时从已有文件（含失败目录）中的最大序号继续递增
+    - 处理完成后调用 ack() 删除对应文件；处理失败调用 fail()，事件保留并延时重试，
+      累计失败 max_attempts 次后移入 dead_letter 目录
+    - 启动时 load() 会按顺序重放目录中尚未处理的事件，并清理残留的临时文件
+    """
 
-                if get_setting('settings.content_settings.library_deleted_notification.show_media_type'):
-                    program_type = get_program_type_from_path(item.get('Path') or '')
-                    if program_type:
-                        parts.append(f"节目类型：{escape_markdown(program_type)}")
+    ATTEMPTS_KEY = '_journal_attempts'
 
-                deleted_summary, _ = parse_episode_ranges_from_description(event_data.get('Description', ''))
-                if deleted_summary:
-                    parts.append(f"已删除：{escape_markdown(deleted_summary)}")
+    def __init__(self, directory, max_attempts=3, retry_delay=60):
+        self.directory = directory
+        self.dead_letter_dir = os.path.join(directory, 'dead_letter')
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        self._seq = 0
 
-                if get_setting('settings.content_settings.library_deleted_notification.show_overview'):
-                    ov = (item.get('Overview') or '')[:150]
-                    if ov:
-                        parts.append(f"剧情：{escape_markdown(ov + ('...' if len(item.get('Overview') or '') > 150 else ''))}")
+    @staticmethod
+    def _entry_seq(entry_id):
+        try:
+            return int(entry_id.split('_')[0])
+        except ValueError:
+            return 0
 
-                if get_setting('settings.content_settings.library_deleted_notification.show_timestamp'):
-                    now_str = datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
-                    parts.append(f"删除时间：{escape_markdown(now_str)}")
+    def load(self):
+        """扫描日志目录，清理临时文件，将未处理的事件按序号顺序放回内存队列。"""
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    print(f"⚠️ 清理 Webhook 队列临时文件 {name} 失败: {e}")
+        entry_ids = sorted((f[:-5] for f in os.listdir(self.directory) if f.endswith('.json')), key=lambda e: (self._entry_seq(e), e))
+        dead_ids = [f[:-5] for f in os.listdir(self.dead_letter_dir) if f.endswith('.json')]
+        with self._cond:
+            self._seq = max([self._seq] + [self._entry_seq(e) for e in entry_ids + dead_ids])
+            for entry_id in entry_ids:
+                self._pending.append(entry_id)
+            self._cond.notify_all()
+        if entry_ids:
+            print(f"♻️ Webhook 队列中有 {len(entry_ids)} 个未处理事件，将按顺序重放。")
+        return len(entry_ids)
+
+    def _path(self, entry_id):
+        return os.path.join(self.directory, f"{entry_id}.json")
+
+    def append(self, event):
+        """将事件持久化后入队，返回事件ID。"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._cond:
+            self._seq += 1
+            entry_id = f"{self._seq:020d}"
+        tmp_path = self._path(entry_id) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(event, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(entry_id))
+        with self._cond:
+            self._pending.append(entry_id)
+            self._cond.notify()
+        return entry_id
+
+    def get(self):
+        """阻塞获取下一条待处理事件，返回 (entry_id, event)。无法读取的事件文件会被移入 dead_letter 目录。"""
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                entry_id = self._pending.popleft()
+            try:
+                with open(self._path(entry_id), 'r', encoding='utf-8') as f:
+                    return entry_id, json.load(f)
+            except FileNotFoundError:
+                continue
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"❌ 读取 Webhook 队列事件 {entry_id} 失败: {e}，已移入 dead_letter 目录。")
+                try:
+                    os.makedirs(self.dead_letter_dir, exist_ok=True)
+                    os.replace(self._path(entry_id), os.path.join(self.dead_letter_dir, f"{entry_id}.json"))
+                except OSError:
+                    pass
 
-                message = "\n".join(parts)
-                photo_url = media_details.get('poster_url') if get_setting('settings.content_settings.library_deleted_notification.show_poster') else None
+    def ack(self, entry_id):
+        """标记事件已处理完成并删除其文件。"""
+        try:
+            os.remove(self._path(entry_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠️ 删除已处理的队列事件 {entry_id} 失败: {e}")
 
-                if ADMIN_USER_ID:
-                    auto_del = get_setting('settings.auto_delete_settings.library_deleted')
-                    if auto_del:
-                        send_deletable_telegram_notification(message, photo_url, chat_id=ADMIN_USER_ID, delay_seconds=60)
-                    else:
-                        send_telegram_notification(message, photo_url, chat_id=ADMIN_USER_ID)
-                else:
-                    print("⚠️ 删除通知跳过：未配置 ADMIN_USER_ID。")
-                self.send_response(200); self.end_headers()
+    def fail(self, entry_id):
+        """标记事件处理失败：记录失败次数后延时重新入队；累计失败 max_attempts 次后移入 dead_letter 目录。"""
+        path = self._path(entry_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                event = json.load(f)
+            attempts = event.get(self.ATTEMPTS_KEY, 0) + 1
+            if attempts >= self.max_attempts:
+                os.makedirs(self.dead_letter_dir, exist_ok=True)
+                os.replace(path, os.path.join(self.dead_letter_dir, f"{entry_id}.json"))
+                print(f"☠️ Webhook 事件 {entry_id} 已失败 {attempts} 次，移入 {self.dead_letter_dir}。")
                 return
+            event[self.ATTEMPTS_KEY] = attempts
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(event, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"❌ 记录 Webhook 事件 {entry_id} 的失败状态时出错: {e}")
+            return
+        delay = self.retry_delay * attempts
+        print(f"🔁 Webhook 事件 {entry_id} 处理失败（第 {attempts} 次），{delay} 秒后重试。")
+        TASK_SCHEDULER.schedule(delay, self._requeue, entry_id)
 
-            user_and_system_events = [
-                "user.authenticated", "user.authenticationfailed", "user.created",
-                "user.policyupdated", "user.passwordchanged", "user.deleted",
-                "system.serverrestartrequired"
-            ]
+    def _requeue(self, entry_id):
+        with self._cond:
+            self._pending.append(entry_id)
+            self._cond.notify()
 
-            if event_type in user_and_system_events:
-                config_map = {
-                    "user.authenticated": 'settings.notification_management.advanced.user_login_success',
-                    "user.authenticationfailed": 'settings.notification_management.advanced.user_login_failure',
-                    "user.created": 'settings.notification_management.advanced.user_creation_deletion',
-                    "user.deleted": 'settings.notification_management.advanced.user_creation_deletion',
-                    "user.policyupdated": 'settings.notification_management.advanced.user_updates',
-                    "user.passwordchanged": 'settings.notification_management.advanced.user_updates',
-                    "system.serverrestartrequired": 'settings.notification_management.advanced.server_restart_required',
-                }
-                
-                config_path = config_map.get(event_type)
-                if not config_path or not get_setting(config_path):
-                    print(f"⚠️ 已关闭 {event_type} 事件通知，跳过。")
-                    self.send_response(204); self.end_headers(); return
-
-                if not ADMIN_USER_ID:
-                    print(f"⚠️ 未配置 ADMIN_USER_ID，无法发送用户/系统事件通知。")
-                    self.send_response(204); self.end_headers(); return
-                
-                time_str = get_event_time_str(event_data)
-                parts = []
-                icon = "ℹ️"
-                custom_title = ""
-
-                username = user.get('Name')
-                if event_type == "user.authenticated":
-                    icon = "✅"
-                    custom_title = f"用户 {username} 已成功登录"
-                    session_info = event_data.get("Session", {})
-                    ip_address = session_info.get('RemoteEndPoint', '')
-                    location = get_ip_geolocation(ip_address)
-                    parts.append(f"客户端: {escape_markdown(session_info.get('Client'))}")
-                    parts.append(f"设备: {escape_markdown(session_info.get('DeviceName'))}")
-                    parts.append(f"位置: `{escape_markdown(ip_address)}` {escape_markdown(location)}")
-                
-                elif event_type == "user.authenticationfailed":
-                    icon = "⚠️"
-                    original_title = event_data.get("Title", "")
-                    username_match = re.search(r'(?:来自|from)\s+(.+?)\s+(?:的登录|on)', original_title)
-                    username = username_match.group(1).strip() if username_match else "未知"
-                    custom_title = f"用户 {username} 登录失败"
-                    desc_text = event_data.get("Description", "")
-                    ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', desc_text)
-                    ip_address = ip_match.group(1) if ip_match else "未知IP"
-                    location = get_ip_geolocation(ip_address)
-                    device_info = event_data.get("DeviceInfo", {})
-                    parts.append(f"客户端: {escape_markdown(device_info.get('AppName'))}")
-                    parts.append(f"设备: {escape_markdown(device_info.get('Name'))}")
-                    parts.append(f"位置: `{escape_markdown(ip_address)}` {escape_markdown(location)}")
-                
-                    if username != "未知":
-                        all_users = get_all_emby_users()
-                        if username in all_users:
-                            failure_reason = "失败原因：密码错误"
-                        else:
-                            failure_reason = "失败原因：用户不存在"
-                        parts.append(escape_markdown(failure_reason))
-
-                elif event_type == "user.created":
-                    icon = "➕"
-                    custom_title = f"用户 {username} 已成功创建"
-                elif event_type == "user.deleted":
-                    icon = "➖"
-                    custom_title = f"用户 {username} 已删除"
-                elif event_type == "user.policyupdated":
-                    icon = "🔧"
-                    custom_title = f"用户 {username} 的策略已更新"
-                elif event_type == "user.passwordchanged":
-                    icon = "🔧"
-                    custom_title = f"用户 {username} 的密码已修改"
-                elif event_type == "system.serverrestartrequired":
-                    icon = "🔄"
-                    custom_title = "服务器需要重启"
-                    parts.append(escape_markdown(event_data.get("Title", "")))
-                
-                message_parts = [f"{icon} *{escape_markdown(custom_title)}*"]
-                message_parts.extend(parts)
-                if time_str != "未知":
-                    message_parts.append(f"时间: {escape_markdown(time_str)}")
-                    
-                message = "\n".join(message_parts)
-
-                autodelete_config_map = {
-                    "user.authenticated": 'settings.auto_delete_settings.advanced.user_login',
-                    "user.authenticationfailed": 'settings.auto_delete_settings.advanced.user_login',
-                    "user.created": 'settings.auto_delete_settings.advanced.user_management',
-                    "user.deleted": 'settings.auto_delete_settings.advanced.user_management',
-                    "user.policyupdated": 'settings.auto_delete_settings.advanced.user_management',
-                    "user.passwordchanged": 'settings.auto_delete_settings.advanced.user_management',
-                    "system.serverrestartrequired": 'settings.auto_delete_settings.advanced.server_events',
-                }
-                autodelete_path = autodelete_config_map.get(event_type)
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
 
-                if autodelete_path and get_setting(autodelete_path):
-                    send_deletable_telegram_notification(message, chat_id=ADMIN_USER_ID, delay_seconds=180)
-                else:
-                    send_telegram_notification(message, chat_id=ADMIN_USER_ID)
-                
-                self.send_response(200); self.end_headers()
-                return
+WEBHOOK_JOURNAL = WebhookJournal(WEBHOOK_QUEUE_DIR)
+register_metrics_provider('webhook_queue', lambda: {'pending': len(WEBHOOK_JOURNAL), 'scheduled_tasks': len(TASK_SCHEDULER), 'coalescing': len(LIBRARY_NEW_COALESCER)})
+EVENT_DEFERRED = object()  # process_emby_event 返回此值表示事件将由延时任务完成并自行确认
 
-            elif event_type in ["playback.start", "playback.unpause", "playback.stop", "playback.pause"]:
-                event_key_map = {
-                    'playback.start': 'playback_start',
-                    'playback.unpause': 'playback_start',
-                    'playback.stop': 'playback_stop',
-                    'playback.pause': 'playback_pause'
-                }
-                notification_type = event_key_map.get(event_type)
-                if not notification_type or not get_setting(f'settings.notification_management.{notification_type}'):
-                    print(f"⚠️ 已关闭 {event_type} 通知，跳过。")
-                    self.send_response(204); self.end_headers(); return
-
-                if not ADMIN_USER_ID:
-                    print("⚠️ 未配置 ADMIN_USER_ID，跳过发送播放通知。")
-                    self.send_response(204); self.end_headers(); return
-
-                if event_type in ["playback.start", "playback.unpause"]:
-                    now = time.time()
-                    event_key = ((user or {}).get('Id'), (item_from_webhook or {}).get('Id'))
-                    if now - recent_playback_notifications.get(event_key, 0) < PLAYBACK_DEBOUNCE_SECONDS:
-                        print(f"⏳ 忽略 {event_type} 事件，因为它发生在防抖时间 ({PLAYBACK_DEBOUNCE_SECONDS}秒) 内。")
-                        self.send_response(204); self.end_headers(); return
-                    recent_playback_notifications[event_key] = now
-
-                item = item_from_webhook or {}
-                media_details = get_media_details(item, (user or {}).get('Id'))
-                stream_details = get_media_stream_details(item.get('Id'), (user or {}).get('Id'))
-
-                raw_title = item.get('SeriesName') if item.get('Type') == 'Episode' else item.get('Name', '未知标题')
-                raw_episode_info = ""
-                if item.get('Type') == 'Episode':
-                    s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), item.get('Name')
-                    raw_episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
-
-                title_with_year_and_episode = f"{raw_title} ({media_details.get('year')})" if media_details.get('year') else raw_title
-                title_with_year_and_episode += raw_episode_info
-
-                action_text_map = {
-                    "playback.start": "▶️ 开始播放",
-                    "playback.unpause": "▶️ 继续播放",
-                    "playback.stop": "⏹️ 停止播放",
-                    "playback.pause": "⏸️ 暂停播放"
-                }
-                action_text = action_text_map.get(event_type, "")
-                item_type_cn = "剧集" if item.get('Type') in ['Episode', 'Series'] else ("电影" if item.get('Type') == 'Movie' else "")
+def ack_when_sent(result, entry_ids):
+    """
+    result 为后台发送通知的 Future 时，在发送结束后确认 entry_ids（发送抛出异常则标记失败以便重试）；
+    否则立即确认。
+    """
+    def _finish(future=None):
+        failed = future is not None and future.exception() is not None
+        for entry_id in entry_ids:
+            (WEBHOOK_JOURNAL.fail if failed else WEBHOOK_JOURNAL.ack)(entry_id)
+    if isinstance(result, Future):
+        result.add_done_callback(_finish)
+    else:
+        _finish()
 
-                parts = []
-                if get_setting('settings.content_settings.playback_action.show_media_detail'):
-                    if get_setting('settings.content_settings.playback_action.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
-                        full_title_line = f"[{escape_markdown(title_with_year_and_episode)}]({media_details.get('tmdb_link')})"
-                    else:
-                        full_title_line = escape_markdown(title_with_year_and_episode)
-                    parts.append(f"{action_text}{item_type_cn} {full_title_line}")
-                else:
-                    parts.append(f"{action_text}{item_type_cn}")
-
-                if get_setting('settings.content_settings.playback_action.show_user'):
-                    parts.append(f"用户：{escape_markdown((user or {}).get('Name', '未知用户'))}")
-                if get_setting('settings.content_settings.playback_action.show_player'):
-                    parts.append(f"播放器：{escape_markdown((session or {}).get('Client', ''))}")
-                if get_setting('settings.content_settings.playback_action.show_device'):
-                    parts.append(f"设备：{escape_markdown((session or {}).get('DeviceName', ''))}")
-
-                if get_setting('settings.content_settings.playback_action.show_location'):
-                    ip = (session or {}).get('RemoteEndPoint', '').split(':')[0]
-                    loc = get_ip_geolocation(ip)
-                    if loc == "局域网":
-                        parts.append(f"位置：{escape_markdown('局域网')}")
-                    else:
-                        parts.append(f"位置：`{escape_markdown(ip)}` {escape_markdown(loc)}")
-                
-                if get_setting('settings.content_settings.playback_action.show_progress'):
-                    pos_ticks, run_ticks = (playback_info or {}).get('PositionTicks'), item.get('RunTimeTicks')
-                    if pos_ticks is not None and run_ticks and run_ticks > 0:
-                        percent = (pos_ticks / run_ticks) * 100
-                        progress = (
-                            f"进度：已观看 {percent:.1f}%"
-                            if event_type == "playback.stop"
-                            else f"进度：{percent:.1f}% ({format_ticks_to_hms(pos_ticks)} / {format_ticks_to_hms(run_ticks)})"
-                        )
-                        parts.append(escape_markdown(progress))
+def process_webhook_journal():
+    """持续从 Webhook 队列中取出事件并按顺序处理。"""
+    print("📬 Webhook 事件处理服务已启动...")
+    while True:
+        entry_id, event_data = WEBHOOK_JOURNAL.get()
+        try:
+            result = process_emby_event(event_data, entry_id)
+        except Exception as e:
+            print(f"❌ 处理 Webhook 事件 {entry_id} 时发生错误: {e}")
+            traceback.print_exc()
+            WEBHOOK_JOURNAL.fail(entry_id)
+            continue
+        if result is not EVENT_DEFERRED:
+            ack_when_sent(result, [entry_id])
+
+def find_series_stream_details(series_id, added_list):
+    """
+    为新增的剧集查找一个可代表其规格的媒体流信息：
+    依次尝试本次新增的剧集、同季的其他剧集、媒体库最新一集。
+    """
+    stream_details = None
 
+    def sxxeyy_key(s_str):
+        match = re.match(r'S(\d+)E(\d+)', s_str, re.IGNORECASE)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        return 0, 0
+
+    if added_list:
+        print("🔍 规格查找策略 1: 检查本次新增的剧集...")
+        sorted_added_list = sorted(added_list, key=sxxeyy_key)
+        for ep_str in sorted_added_list:
+            s_num, e_num = sxxeyy_key(ep_str)
+            if s_num > 0 and e_num > 0:
+                episode_item = get_episode_item_by_number(series_id, s_num, e_num)
+                if episode_item:
+                    temp_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
+                    if temp_details:
+                        print(f"✅ 规格查找成功 (策略 1): 使用 {ep_str} 的规格。")
+                        stream_details = temp_details
+                        break
+
+    if not stream_details and added_list:
+        print("🔍 规格查找策略 2: 检查同季的其他剧集...")
+        involved_seasons = sorted(list(set(sxxeyy_key(s)[0] for s in added_list if sxxeyy_key(s)[0] > 0)))
+        for s_num in involved_seasons:
+            episode_item = get_any_episode_from_season(series_id, s_num)
+            if episode_item:
+                temp_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
+                if temp_details:
+                    print(f"✅ 规格查找成功 (策略 2): 使用 S{s_num:02d} 中参考集 (ID: {episode_item.get('Id')}) 的规格。")
+                    stream_details = temp_details
+                    break
+
+    if not stream_details:
+        print("🔍 规格查找策略 3: 回退至获取媒体库最新一集。")
+        episode_item = _get_latest_episode_info(series_id)
+        if episode_item:
+            stream_details = get_media_stream_details(episode_item.get('Id'), EMBY_USER_ID)
+            if stream_details:
+                s_num = episode_item.get('ParentIndexNumber', 0)
+                e_num = episode_item.get('IndexNumber', 0)
+                print(f"✅ 规格查找成功 (策略 3): 使用了媒体库最新集 S{s_num:02d}E{e_num:02d} (ID: {episode_item.get('Id')}) 的规格。")
+    return stream_details
+
+async def enrich_library_new_event(event_data):
+    """
+    并发补充 library.new 事件所需的信息，返回 (item, media_details, stream_details, progress_lines)：
+    - 先通过 Emby API 补充项目元数据（后续查询都依赖它）
+    - 剧集：TMDB 详情 → 逐季进度 与 规格查找 两条链并发执行
+    - 电影/其他：仅获取 TMDB 详情，规格由延时任务检查
+    """
+    item = event_data.get('Item', {}) or {}
+    if item.get('Id') and EMBY_USER_ID:
+        print(f"ℹ️ 正在使用 Emby API 补充项目 {item.get('Id')} 的元数据。")
+        fields = 'ProviderIds,Path,Overview,ProductionYear,ServerId,DateCreated,SeriesProviderIds,ParentIndexNumber,SeriesId'
+        full_item = await asyncio.to_thread(get_emby_item, item.get('Id'), fields)
+        if full_item:
+            item = full_item
+            print("✅ 补充元数据成功。")
+        else:
+            print("❌ 补充元数据失败，将使用 Webhook 原始数据。")
+
+    user_id = (event_data.get('User', {}) or {}).get('Id')
+    if item.get('Type') != 'Series':
+        media_details = await asyncio.to_thread(get_media_details, item, user_id)
+        return item, media_details, None, None
+
+    _, added_list = parse_episode_ranges_from_description(event_data.get('Description', ''))
+
+    async def _details_and_progress():
+        media_details = await asyncio.to_thread(get_media_details, item, user_id)
+        progress_lines = None
+        if get_setting('settings.content_settings.new_library_notification.show_progress_status'):
+            progress_lines = await asyncio.to_thread(build_progress_lines_for_library_new, item, media_details)
+        return media_details, progress_lines
+
+    (media_details, progress_lines), stream_details = await asyncio.gather(
+        _details_and_progress(),
+        asyncio.to_thread(find_series_stream_details, item.get('Id'), added_list)
+    )
+    return item, media_details, stream_details, progress_lines
+
+def check_library_new_stream_details(event_data, item, media_details, entry_id=None, attempt=0, started_at=None):
+    """
+    定时检查新增电影/单集的媒体源是否已被Emby分析完成：
+    一旦获取到规格立即发送通知；否则按退避间隔重新调度，超过截止时间后发送不含规格的通知。
+    """
+    started_at = started_at or time.monotonic()
+    print(f"🔍 规格查找策略 1: 第 {attempt + 1} 次尝试获取项目 {item.get('Name')} (ID: {item.get('Id')}) 的精确规格...")
+    stream_details = get_media_stream_details(item.get('Id'), None, fresh=attempt > 0)
+    if stream_details:
+        print(f"✅ 规格查找成功 (策略 1): 成功获取项目 {item.get('Name')} (ID: {item.get('Id')}) 的规格。")
+    else:
+        delay = STREAM_CHECK_INTERVALS[min(attempt, len(STREAM_CHECK_INTERVALS) - 1)]
+        if time.monotonic() - started_at + delay <= STREAM_CHECK_DEADLINE:
+            print(f"⏳ 项目 {item.get('Id')} 的媒体源尚未分析完成，{delay} 秒后重试。")
+            TASK_SCHEDULER.schedule(delay, check_library_new_stream_details, event_data, item, media_details, entry_id, attempt + 1, started_at)
+            return
+        print(f"⚠️ 等待项目 {item.get('Id')} 的媒体源分析已超过 {STREAM_CHECK_DEADLINE} 秒，停止等待。")
+
+    try:
+        result = send_library_new_notification(event_data, item, media_details, stream_details)
+    except Exception as e:
+        print(f"❌ 发送项目 {item.get('Id')} 的新增通知时发生错误: {e}")
+        traceback.print_exc()
+        if entry_id:
+            WEBHOOK_JOURNAL.fail(entry_id)
+        return
+    ack_when_sent(result, [entry_id] if entry_id else [])
+
+def send_library_new_notification(event_data, item, media_details, stream_details, progress_lines=None):
+    """
+    根据已补充的元数据和规格信息构建新增节目通知，并在后台发送到群组/频道/管理员。progress_lines 为空时现场计算。
+    返回发送任务的 Future，没有发送目标时返回 None。
+    """
+    added_summary, _ = parse_episode_ranges_from_description(event_data.get('Description', ''))
+
+    if not stream_details and item.get('Type') == 'Episode':
+        season_num = item.get('ParentIndexNumber')
+        series_id = item.get('SeriesId')
+        if season_num is not None and series_id:
+            print(f"🔍 规格查找策略 2: 策略1失败，尝试查找 S{season_num:02d} 中其他剧集的规格作为参考...")
+            ref_episode_item = get_any_episode_from_season(series_id, season_num)
+            if ref_episode_item:
+                stream_details = get_media_stream_details(ref_episode_item.get('Id'), EMBY_USER_ID)
                 if stream_details:
-                    formatted_specs = format_stream_details_message(stream_details, prefix='playback_action')
-                    for part in formatted_specs:
-                        parts.append(escape_markdown(part))
-
-                raw_program_type = get_program_type_from_path(item.get('Path'))
-                if raw_program_type and get_setting('settings.content_settings.playback_action.show_media_type'):
-                    parts.append(f"节目类型：{escape_markdown(raw_program_type)}")
-
-                webhook_overview = item.get('Overview')
-                if webhook_overview and get_setting('settings.content_settings.playback_action.show_overview'):
-                    overview = webhook_overview[:150] + '...' if len(webhook_overview) > 150 else webhook_overview
-                    parts.append(f"剧情：{escape_markdown(overview)}")
-
-                if get_setting('settings.content_settings.playback_action.show_timestamp'):
-                    parts.append(f"时间：{escape_markdown(datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'))}")
-
-                message = "\n".join(parts)
-                print(f"✉️ 向管理员 {ADMIN_USER_ID} 发送播放通知。")
-
-                buttons = []
-                photo_url = media_details.get('poster_url') if get_setting('settings.content_settings.playback_action.show_poster') else None
-                if EMBY_REMOTE_URL and get_setting('settings.content_settings.playback_action.show_view_on_server_button'):
-                    item_id, server_id = item.get('Id'), item.get('ServerId') or (event_data.get('Server', {}).get('Id') if event_data else None)
-                    if item_id and server_id:
-                        buttons.append([{'text': '➡️ 在服务器中查看', 'url': f"{EMBY_REMOTE_URL}/web/index.html#!/item?id={item_id}&serverId={server_id}"}])
-
-                auto_delete_path_map = {
-                    'playback.start': 'settings.auto_delete_settings.playback_start',
-                    'playback.unpause': 'settings.auto_delete_settings.playback_start',
-                    'playback.pause': 'settings.auto_delete_settings.playback_pause',
-                    'playback.stop': 'settings.auto_delete_settings.playback_stop'
-                }
-                auto_delete_path = auto_delete_path_map.get(event_type)
-                if auto_delete_path and get_setting(auto_delete_path):
-                    send_deletable_telegram_notification(
-                        message, photo_url, chat_id=ADMIN_USER_ID,
-                        inline_buttons=buttons if buttons else None, delay_seconds=60
-                    )
+                    print(f"✅ 规格查找成功 (策略 2): 使用了同季参考集 (ID: {ref_episode_item.get('Id')}) 的规格。")
+
+    if not stream_details:
+        print("❌ 所有规格查找策略均失败，将发送不含规格的通知。")
+
+    parts = []
+    raw_episode_info = ""
+    if item.get('Type') == 'Episode':
+        s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), item.get('Name')
+        raw_episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
+
+    if item.get('Type') in ['Episode', 'Series', 'Season']:
+        raw_title = item.get('SeriesName', item.get('Name', '未知标题'))
+    else:
+        raw_title = item.get('Name', '未知标题')
+
+    title_with_year_and_episode = f"{raw_title} ({media_details.get('year')})" if media_details.get('year') else raw_title
+    title_with_year_and_episode += raw_episode_info
+    action_text = "✅ 新增"
+    item_type_cn = "剧集" if item.get('Type') in ['Episode', 'Series', 'Season'] else "电影" if item.get('Type') == 'Movie' else ""
+
+    if get_setting('settings.content_settings.new_library_notification.show_media_detail'):
+        if get_setting('settings.content_settings.new_library_notification.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
+            full_title_line = f"[{escape_markdown(title_with_year_and_episode)}]({media_details.get('tmdb_link')})"
+        else:
+            full_title_line = escape_markdown(title_with_year_and_episode)
+        parts.append(f"{action_text}{item_type_cn} {full_title_line}")
+    else:
+        parts.append(f"{action_text}{item_type_cn}")
+
+    if added_summary:
+        count_match = re.search(r'(\d+)\s*项目', (event_data.get('Title') or ''))
+        count_str = f"（共 {count_match.group(1)} 集）" if count_match else ""
+        parts.append(f"本次新增：{escape_markdown(added_summary)}{escape_markdown(count_str)}")
+
+    if get_setting('settings.content_settings.new_library_notification.show_media_type'):
+        raw_program_type = get_program_type_from_path(item.get('Path'))
+        if raw_program_type:
+            parts.append(f"节目类型：{escape_markdown(raw_program_type)}")
+
+    if get_setting('settings.content_settings.new_library_notification.show_overview'):
+        overview_text = item.get('Overview', '暂无剧情简介')
+        if overview_text:
+            overview_text = overview_text[:150] + "..." if len(overview_text) > 150 else overview_text
+            parts.append(f"剧情：{escape_markdown(overview_text)}")
+
+    if stream_details:
+        formatted_specs = format_stream_details_message(stream_details, prefix='new_library_notification')
+        for part in formatted_specs:
+            parts.append(escape_markdown(part))
+
+    if get_setting('settings.content_settings.new_library_notification.show_progress_status'):
+        if progress_lines is None:
+            progress_lines = build_progress_lines_for_library_new(item, media_details)
+        if progress_lines:
+            parts.extend(progress_lines)
+
+    if get_setting('settings.content_settings.new_library_notification.show_timestamp'):
+        parts.append(f"入库时间：{escape_markdown(datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'))}")
+
+    message = "\n".join(parts)
+    photo_url = None
+    if get_setting('settings.content_settings.new_library_notification.show_poster'):
+        photo_url = media_details.get('poster_url')
+
+    buttons = []
+    if get_setting('settings.content_settings.new_library_notification.show_view_on_server_button') and EMBY_REMOTE_URL:
+        item_id_, server_id = item.get('Id'), item.get('ServerId')
+        if item_id_ and server_id:
+            item_url = f"{EMBY_REMOTE_URL}/web/index.html#!/item?id={item_id_}&serverId={server_id}"
+            buttons.append([{'text': '➡️ 在服务器中查看', 'url': item_url}])
+
+    destinations = []
+    for target, chat_id in (('group', GROUP_ID), ('channel', CHANNEL_ID), ('private', ADMIN_USER_ID)):
+        if get_setting(f'settings.notification_management.library_new.to_{target}') and chat_id:
+            delete_after = 60 if get_setting(f'settings.auto_delete_settings.new_library.to_{target}') else None
+            destinations.append((chat_id, delete_after))
+    if destinations:
+        print(f"✉️ 向 {', '.join(str(chat_id) for chat_id, _ in destinations)} 发送新增通知。")
+        return send_in_background(fan_out_notification, destinations, message, photo_url, buttons if buttons else None)
+
+def handle_library_new_event(event_data, entry_id=None):
+    """补充元数据并发送新增节目通知（返回发送任务的 Future）；电影/单集需等待媒体源分析时返回 EVENT_DEFERRED。"""
+    item, media_details, stream_details, progress_lines = asyncio.run(enrich_library_new_event(event_data))
+    LOCAL_POSTER_STORE.prefetch(media_details.get('poster_url'))
+
+    if item.get('Type') == 'Series':
+        return send_library_new_notification(event_data, item, media_details, stream_details, progress_lines)
+
+    print("ℹ️ 新增项目为电影/其他类型，将定时检查Emby媒体源分析结果...")
+    TASK_SCHEDULER.schedule(STREAM_CHECK_INTERVALS[0], check_library_new_stream_details, event_data, item, media_details, entry_id)
+    return EVENT_DEFERRED
+
+def merge_library_new_events(events):
+    """
+    将同一剧集的多个 library.new 事件合并为一个剧集级事件：
+    汇总各事件 Description 中的集号及单集事件的季/集号，按季压缩为连续区间后写回 Description。
+    """
+    base_event = next((e for e in events if (e.get('Item') or {}).get('Type') == 'Series'), events[0])
+    episodes = set()
+    for event in events:
+        _, expanded = parse_episode_ranges_from_description(event.get('Description', ''))
+        for ep_str in expanded:
+            match = re.match(r'S(\d+)E(\d+)', ep_str)
+            if match:
+                episodes.add((int(match.group(1)), int(match.group(2))))
+        item = event.get('Item') or {}
+        if item.get('Type') == 'Episode' and item.get('ParentIndexNumber') is not None and item.get('IndexNumber') is not None:
+            episodes.add((int(item['ParentIndexNumber']), int(item['IndexNumber'])))
+
+    ranges = []
+    for season_num, episode_num in sorted(episodes):
+        if ranges and ranges[-1][0] == season_num and ranges[-1][2] == episode_num - 1:
+            ranges[-1][2] = episode_num
+        else:
+            ranges.append([season_num, episode_num, episode_num])
+    tokens = [f"S{s:02d}E{start:02d}" + (f"-E{end:02d}" if end != start else "") for s, start, end in ranges]
+
+    merged = dict(base_event)
+    base_item = base_event.get('Item') or {}
+    if base_item.get('Type') != 'Series':
+        merged['Item'] = {
+            'Id': base_item.get('SeriesId'), 'Type': 'Series',
+            'Name': base_item.get('SeriesName') or base_item.get('Name'),
+            'SeriesName': base_item.get('SeriesName'), 'ServerId': base_item.get('ServerId')
+        }
+    merged['Description'] = ", ".join(tokens)
+    return merged
+
+class LibraryNewCoalescer:
+    """
+    按剧集聚合 library.new 事件：同一剧集的首个事件到达后等待 window 秒，
+    期间到达的事件合并为一次元数据补充和一条通知；事件在通知发送成功后统一确认出队，
+    处理失败时全部标记为失败（保留在队列中延时重试）。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _series_key(item):
+        if item.get('Type') == 'Series':
+            return item.get('Id')
+        if item.get('Type') in ('Season', 'Episode'):
+            return item.get('SeriesId')
+        return None
+
+    def add(self, event_data, entry_id=None):
+        """加入聚合窗口，返回 True；非剧集类事件不聚合，返回 False。"""
+        series_key = self._series_key(event_data.get('Item') or {})
+        if not series_key:
+            return False
+        with self._lock:
+            group = self._pending.get(series_key)
+            if group is None:
+                self._pending[series_key] = [(event_data, entry_id)]
+                TASK_SCHEDULER.schedule(self.window, self.flush, series_key)
+                print(f"⏳ 剧集 {series_key} 的新增事件将在 {self.window} 秒后合并发送。")
+            else:
+                group.append((event_data, entry_id))
+                print(f"➕ 剧集 {series_key} 的新增事件已并入等待中的通知（共 {len(group)} 个）。")
+        return True
+
+    def flush(self, series_key):
+        with self._lock:
+            group = self._pending.pop(series_key, None)
+        if not group:
+            return
+        entry_ids = [entry_id for _, entry_id in group if entry_id]
+        try:
+            if len(group) == 1:
+                result = handle_library_new_event(group[0][0], group[0][1])
+            else:
+                print(f"📦 合并剧集 {series_key} 的 {len(group)} 个新增事件为一条通知。")
+                result = handle_library_new_event(merge_library_new_events([event for event, _ in group]))
+        except Exception as e:
+            print(f"❌ 处理剧集 {series_key} 的合并新增事件时发生错误: {e}，事件保留在队列中等待重试。")
+            traceback.print_exc()
+            for entry_id in entry_ids:
+                WEBHOOK_JOURNAL.fail(entry_id)
+            return
+        if result is EVENT_DEFERRED:
+            return
+        ack_when_sent(result, entry_ids)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(group) for group in self._pending.values())
+
+LIBRARY_NEW_COALESCER = LibraryNewCoalescer(LIBRARY_NEW_COALESCE_SECONDS)
+
+def process_emby_event(event_data, entry_id=None):
+    """
+    处理一条已入队的Emby Webhook事件：补充元数据、查询TMDB/地理位置并发送Telegram通知。
+    若事件需等待延时任务完成（如等待媒体源分析），返回 EVENT_DEFERRED，由延时任务负责确认队列条目；
+    通知在后台发送时返回其 Future，发送结束后再确认队列条目。
+    """
+    event_type = event_data.get('Event')
+    item_from_webhook = event_data.get('Item', {}) or {}
+    user = event_data.get('User', {}) or {}
+    session = event_data.get('Session', {}) or {}
+    playback_info = event_data.get('PlaybackInfo', {}) or {}
+    print(f"ℹ️ 检测到 Emby 事件: {event_type}")
+
+    if event_type in ("library.new", "library.deleted"):
+        invalidate_emby_item(item_from_webhook.get('Id'), item_from_webhook.get('SeriesId'),
+                             item_from_webhook.get('SeasonId'), item_from_webhook.get('ParentId'))
+        EMBY_LIBRARY_INDEX.on_library_event(event_type, item_from_webhook)
+
+    if event_type == "library.new":
+        if not any([
+            get_setting('settings.notification_management.library_new.to_group'),
+            get_setting('settings.notification_management.library_new.to_channel'),
+            get_setting('settings.notification_management.library_new.to_private')
+        ]):
+            print("⚠️ 已关闭新增节目通知，跳过。")
+            return
+
+        if LIBRARY_NEW_COALESCE_SECONDS > 0 and LIBRARY_NEW_COALESCER.add(event_data, entry_id):
+            return EVENT_DEFERRED
+        return handle_library_new_event(event_data, entry_id)
+
+    if event_type == "library.deleted":
+        if not get_setting('settings.notification_management.library_deleted'):
+            print("⚠️ 已关闭删除节目通知，跳过。")
+            return
+
+        item = item_from_webhook
+        item_type = item.get('Type')
+        if item_type not in ['Movie', 'Series', 'Season', 'Episode']:
+            print(f"⚠️ 忽略不支持的删除事件类型: {item_type}")
+            return
+
+        if item_type in ['Episode', 'Season'] and item.get('SeriesId'):
+            series_id = item.get('SeriesId')
+            series_stub = get_emby_item(series_id, 'ProviderIds,Path,ProductionYear,ServerId') or {}
+            media_details = get_media_details(series_stub or item, EMBY_USER_ID)
+            display_title = series_stub.get('Name') or item.get('SeriesName') or item.get('Name', '未知标题')
+            year = series_stub.get('ProductionYear') or extract_year_from_path((series_stub.get('Path') or item.get('Path') or ''))
+        else:
+            media_details = get_media_details(item, EMBY_USER_ID)
+            display_title = item.get('Name', '未知标题')
+            year = item.get('ProductionYear') or extract_year_from_path(item.get('Path'))
+
+        episode_info = ""
+        if item_type == 'Episode':
+            s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), (item.get('Name') or '')
+            episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
+        elif item_type == 'Season':
+            s = item.get('IndexNumber')
+            episode_info = f" 第 {s} 季" if s is not None else ""
+
+        title_full = f"{display_title} ({year})" if year else display_title
+        title_full += episode_info
+        parts = []
+        action_text = "🗑️ 删除"
+        item_type_cn = "剧集" if item_type in ['Series', 'Season', 'Episode'] else "电影"
+
+        if get_setting('settings.content_settings.library_deleted_notification.show_media_detail'):
+            if get_setting('settings.content_settings.library_deleted_notification.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
+                parts.append(f"{action_text}{item_type_cn} [{escape_markdown(title_full)}]({media_details.get('tmdb_link')})")
+            else:
+                parts.append(f"{action_text}{item_type_cn} {escape_markdown(title_full)}")
+        else:
+            parts.append(f"{action_text}{item_type_cn}")
+
+        if get_setting('settings.content_settings.library_deleted_notification.show_media_type'):
+            program_type = get_program_type_from_path(item.get('Path') or '')
+            if program_type:
+                parts.append(f"节目类型：{escape_markdown(program_type)}")
+
+        deleted_summary, _ = parse_episode_ranges_from_description(event_data.get('Description', ''))
+        if deleted_summary:
+            parts.append(f"已删除：{escape_markdown(deleted_summary)}")
+
+        if get_setting('settings.content_settings.library_deleted_notification.show_overview'):
+            ov = (item.get('Overview') or '')[:150]
+            if ov:
+                parts.append(f"剧情：{escape_markdown(ov + ('...' if len(item.get('Overview') or '') > 150 else ''))}")
+
+        if get_setting('settings.content_settings.library_deleted_notification.show_timestamp'):
+            now_str = datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+            parts.append(f"删除时间：{escape_markdown(now_str)}")
+
+        message = "\n".join(parts)
+        photo_url = media_details.get('poster_url') if get_setting('settings.content_settings.library_deleted_notification.show_poster') else None
+
+        if ADMIN_USER_ID:
+            auto_del = get_setting('settings.auto_delete_settings.library_deleted')
+            if auto_del:
+                send_deletable_telegram_notification(message, photo_url, chat_id=ADMIN_USER_ID, delay_seconds=60)
+            else:
+                return send_in_background(send_telegram_notification, message, photo_url, chat_id=ADMIN_USER_ID)
+        else:
+            print("⚠️ 删除通知跳过：未配置 ADMIN_USER_ID。")
+        return
+
+    user_and_system_events = [
+        "user.authenticated", "user.authenticationfailed", "user.created",
+        "user.policyupdated", "user.passwordchanged", "user.deleted",
+        "system.serverrestartrequired"
+    ]
+
+    if event_type in user_and_system_events:
+        config_map = {
+            "user.authenticated": 'settings.notification_management.advanced.user_login_success',
+            "user.authenticationfailed": 'settings.notification_management.advanced.user_login_failure',
+            "user.created": 'settings.notification_management.advanced.user_creation_deletion',
+            "user.deleted": 'settings.notification_management.advanced.user_creation_deletion',
+            "user.policyupdated": 'settings.notification_management.advanced.user_updates',
+            "user.passwordchanged": 'settings.notification_management.advanced.user_updates',
+            "system.serverrestartrequired": 'settings.notification_management.advanced.server_restart_required',
+        }
+
+        config_path = config_map.get(event_type)
+        if not config_path or not get_setting(config_path):
+            print(f"⚠️ 已关闭 {event_type} 事件通知，跳过。")
+            return
+
+        if not ADMIN_USER_ID:
+            print(f"⚠️ 未配置 ADMIN_USER_ID，无法发送用户/系统事件通知。")
+            return
+
+        time_str = get_event_time_str(event_data)
+        parts = []
+        icon = "ℹ️"
+        custom_title = ""
+
+        username = user.get('Name')
+        if event_type == "user.authenticated":
+            icon = "✅"
+            custom_title = f"用户 {username} 已成功登录"
+            session_info = event_data.get("Session", {})
+            ip_address = session_info.get('RemoteEndPoint', '')
+            location = get_ip_geolocation(ip_address)
+            parts.append(f"客户端: {escape_markdown(session_info.get('Client'))}")
+            parts.append(f"设备: {escape_markdown(session_info.get('DeviceName'))}")
+            parts.append(f"位置: `{escape_markdown(ip_address)}` {escape_markdown(location)}")
+
+        elif event_type == "user.authenticationfailed":
+            icon = "⚠️"
+            original_title = event_data.get("Title", "")
+            username_match = re.search(r'(?:来自|from)\s+(.+?)\s+(?:的登录|on)', original_title)
+            username = username_match.group(1).strip() if username_match else "未知"
+            custom_title = f"用户 {username} 登录失败"
+            desc_text = event_data.get("Description", "")
+            ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', desc_text)
+            ip_address = ip_match.group(1) if ip_match else "未知IP"
+            location = get_ip_geolocation(ip_address)
+            device_info = event_data.get("DeviceInfo", {})
+            parts.append(f"客户端: {escape_markdown(device_info.get('AppName'))}")
+            parts.append(f"设备: {escape_markdown(device_info.get('Name'))}")
+            parts.append(f"位置: `{escape_markdown(ip_address)}` {escape_markdown(location)}")
+
+            if username != "未知":
+                all_users = get_all_emby_users()
+                if username in all_users:
+                    failure_reason = "失败原因：密码错误"
                 else:
-                    send_telegram_notification(
-                        message, photo_url, chat_id=ADMIN_USER_ID,
-                        inline_buttons=buttons if buttons else None
-                    )
+                    failure_reason = "失败原因：用户不存在"
+                parts.append(escape_markdown(failure_reason))
+
+        elif event_type == "user.created":
+            icon = "➕"
+            custom_title = f"用户 {username} 已成功创建"
+        elif event_type == "user.deleted":
+            icon = "➖"
+            custom_title = f"用户 {username} 已删除"
+        elif event_type == "user.policyupdated":
+            icon = "🔧"
+            custom_title = f"用户 {username} 的策略已更新"
+        elif event_type == "user.passwordchanged":
+            icon = "🔧"
+            custom_title = f"用户 {username} 的密码已修改"
+        elif event_type == "system.serverrestartrequired":
+            icon = "🔄"
+            custom_title = "服务器需要重启"
+            parts.append(escape_markdown(event_data.get("Title", "")))
+
+        message_parts = [f"{icon} *{escape_markdown(custom_title)}*"]
+        message_parts.extend(parts)
+        if time_str != "未知":
+            message_parts.append(f"时间: {escape_markdown(time_str)}")
+
+        message = "\n".join(message_parts)
+
+        autodelete_config_map = {
+            "user.authenticated": 'settings.auto_delete_settings.advanced.user_login',
+            "user.authenticationfailed": 'settings.auto_delete_settings.advanced.user_login',
+            "user.created": 'settings.auto_delete_settings.advanced.user_management',
+            "user.deleted": 'settings.auto_delete_settings.advanced.user_management',
+            "user.policyupdated": 'settings.auto_delete_settings.advanced.user_management',
+            "user.passwordchanged": 'settings.auto_delete_settings.advanced.user_management',
+            "system.serverrestartrequired": 'settings.auto_delete_settings.advanced.server_events',
+        }
+        autodelete_path = autodelete_config_map.get(event_type)
+
+        if autodelete_path and get_setting(autodelete_path):
+            send_deletable_telegram_notification(message, chat_id=ADMIN_USER_ID, delay_seconds=180)
+        else:
+            return send_in_background(send_telegram_notification, message, chat_id=ADMIN_USER_ID)
+
+        return
+
+    elif event_type in ["playback.start", "playback.unpause", "playback.stop", "playback.pause"]:
+        event_key_map = {
+            'playback.start': 'playback_start',
+            'playback.unpause': 'playback_start',
+            'playback.stop': 'playback_stop',
+            'playback.pause': 'playback_pause'
+        }
+        notification_type = event_key_map.get(event_type)
+        if not notification_type or not get_setting(f'settings.notification_management.{notification_type}'):
+            print(f"⚠️ 已关闭 {event_type} 通知，跳过。")
+            return
+
+        if not ADMIN_USER_ID:
+            print("⚠️ 未配置 ADMIN_USER_ID，跳过发送播放通知。")
+            return
+
+        if event_type in ["playback.start", "playback.unpause"]:
+            event_key = ((user or {}).get('Id'), (item_from_webhook or {}).get('Id'))
+            if not recent_playback_notifications.add(event_key, time.time(), ttl=PLAYBACK_DEBOUNCE_SECONDS):
+                print(f"⏳ 忽略 {event_type} 事件，因为它发生在防抖时间 ({PLAYBACK_DEBOUNCE_SECONDS}秒) 内。")
+                return
+
+        item = item_from_webhook or {}
+        media_details = get_media_details(item, (user or {}).get('Id'))
+        stream_details = get_media_stream_details(item.get('Id'), (user or {}).get('Id'))
+
+        raw_title = item.get('SeriesName') if item.get('Type') == 'Episode' else item.get('Name', '未知标题')
+        raw_episode_info = ""
+        if item.get('Type') == 'Episode':
+            s, e, en = item.get('ParentIndexNumber'), item.get('IndexNumber'), item.get('Name')
+            raw_episode_info = f" S{s:02d}E{e:02d} {en or ''}" if s is not None and e is not None else f" {en or ''}"
+
+        title_with_year_and_episode = f"{raw_title} ({media_details.get('year')})" if media_details.get('year') else raw_title
+        title_with_year_and_episode += raw_episode_info
+
+        action_text_map = {
+            "playback.start": "▶️ 开始播放",
+            "playback.unpause": "▶️ 继续播放",
+            "playback.stop": "⏹️ 停止播放",
+            "playback.pause": "⏸️ 暂停播放"
+        }
+        action_text = action_text_map.get(event_type, "")
+        item_type_cn = "剧集" if item.get('Type') in ['Episode', 'Series'] else ("电影" if item.get('Type') == 'Movie' else "")
+
+        parts = []
+        if get_setting('settings.content_settings.playback_action.show_media_detail'):
+            if get_setting('settings.content_settings.playback_action.media_detail_has_tmdb_link') and media_details.get('tmdb_link'):
+                full_title_line = f"[{escape_markdown(title_with_year_and_episode)}]({media_details.get('tmdb_link')})"
+            else:
+                full_title_line = escape_markdown(title_with_year_and_episode)
+            parts.append(f"{action_text}{item_type_cn} {full_title_line}")
+        else:
+            parts.append(f"{action_text}{item_type_cn}")
+
+        if get_setting('settings.content_settings.playback_action.show_user'):
+            parts.append(f"用户：{escape_markdown((user or {}).get('Name', '未知用户'))}")
+        if get_setting('settings.content_settings.playback_action.show_player'):
+            parts.append(f"播放器：{escape_markdown((session or {}).get('Client', ''))}")
+        if get_setting('settings.content_settings.playback_action.show_device'):
+            parts.append(f"设备：{escape_markdown((session or {}).get('DeviceName', ''))}")
+
+        if get_setting('settings.content_settings.playback_action.show_location'):
+            ip = (session or {}).get('RemoteEndPoint', '').split(':')[0]
+            loc = get_ip_geolocation(ip)
+            if loc == "局域网":
+                parts.append(f"位置：{escape_markdown('局域网')}")
+            else:
+                parts.append(f"位置：`{escape_markdown(ip)}` {escape_markdown(loc)}")
+
+        if get_setting('settings.content_settings.playback_action.show_progress'):
+            pos_ticks, run_ticks = (playback_info or {}).get('PositionTicks'), item.get('RunTimeTicks')
+            if pos_ticks is not None and run_ticks and run_ticks > 0:
+                percent = (pos_ticks / run_ticks) * 100
+                progress = (
+                    f"进度：已观看 {percent:.1f}%"
+                    if event_type == "playback.stop"
+                    else f"进度：{percent:.1f}% ({format_ticks_to_hms(pos_ticks)} / {format_ticks_to_hms(run_ticks)})"
+                )
+                parts.append(escape_markdown(progress))
+
+        if stream_details:
+            formatted_specs = format_stream_details_message(stream_details, prefix='playback_action')
+            for part in formatted_specs:
+                parts.append(escape_markdown(part))
+
+        raw_program_type = get_program_type_from_path(item.get('Path'))
+        if raw_program_type and get_setting('settings.content_settings.playback_action.show_media_type'):
+            parts.append(f"节目类型：{escape_markdown(raw_program_type)}")
+
+        webhook_overview = item.get('Overview')
+        if webhook_overview and get_setting('settings.content_settings.playback_action.show_overview'):
+            overview = webhook_overview[:150] + '...' if len(webhook_overview) > 150 else webhook_overview
+            parts.append(f"剧情：{escape_markdown(overview)}")
+
+        if get_setting('settings.content_settings.playback_action.show_timestamp'):
+            parts.append(f"时间：{escape_markdown(datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'))}")
+
+        message = "\n".join(parts)
+        print(f"✉️ 向管理员 {ADMIN_USER_ID} 发送播放通知。")
+
+        buttons = []
+        photo_url = media_details.get('poster_url') if get_setting('settings.content_settings.playback_action.show_poster') else None
+        if EMBY_REMOTE_URL and get_setting('settings.content_settings.playback_action.show_view_on_server_button'):
+            item_id, server_id = item.get('Id'), item.get('ServerId') or (event_data.get('Server', {}).get('Id') if event_data else None)
+            if item_id and server_id:
+                buttons.append([{'text': '➡️ 在服务器中查看', 'url': f"{EMBY_REMOTE_URL}/web/index.html#!/item?id={item_id}&serverId={server_id}"}])
+
+        auto_delete_path_map = {
+            'playback.start': 'settings.auto_delete_settings.playback_start',
+            'playback.unpause': 'settings.auto_delete_settings.playback_start',
+            'playback.pause': 'settings.auto_delete_settings.playback_pause',
+            'playback.stop': 'settings.auto_delete_settings.playback_stop'
+        }
+        auto_delete_path = auto_delete_path_map.get(event_type)
+        if auto_delete_path and get_setting(auto_delete_path):
+            send_deletable_telegram_notification(
+                message, photo_url, chat_id=ADMIN_USER_ID,
+                inline_buttons=buttons if buttons else None, delay_seconds=60
+            )
+        else:
+            return send_in_background(
+                send_telegram_notification, message, photo_url, chat_id=ADMIN_USER_ID,
+                inline_buttons=buttons if buttons else None
+            )
+
+        return
+
+    else:
+        print(f"ℹ️ 未处理的事件类型：{event_type}")
+        return
 
-                self.send_response(200); self.end_headers(); return
+class WebhookHandler(BaseHTTPRequestHandler):
+    """处理Emby Webhook请求的HTTP请求处理程序：仅解析、校验并写入队列，随后立即响应。"""
+
+    def is_metrics_request_allowed(self):
+        """/metrics 仅允许本机访问，或携带与 metrics_token 一致的 X-Metrics-Token 请求头。"""
+        try:
+            if ipaddress.ip_address(self.client_address[0]).is_loopback:
+                return True
+        except ValueError:
+            pass
+        received_token = self.headers.get('X-Metrics-Token', '')
+        return bool(METRICS_TOKEN) and hmac.compare_digest(received_token.encode('utf-8'), str(METRICS_TOKEN).encode('utf-8'))
 
+    def do_GET(self):
+        """处理GET请求：/metrics 返回运行状态统计（JSON）。"""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404); self.end_headers()
+            return
+        if not self.is_metrics_request_allowed():
+            self.send_response(403); self.end_headers()
+            return
+        body = json.dumps(collect_runtime_stats(), ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_telegram_webhook(self):
+        """处理Telegram推送的更新：校验 Secret Token 后交给更新分发线程池。"""
+        received_secret = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received_secret.encode('utf-8'), TELEGRAM_WEBHOOK_SECRET.encode('utf-8')):
+            print("❌ Telegram Webhook 请求的 Secret Token 校验失败，已拒绝。")
+            self.send_response(403); self.end_headers()
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            update = json.loads(self.rfile.read(content_length).decode('utf-8'))
+        except (ValueError, json.JSONDecodeError) as e:
+            print(f"❌ 解析 Telegram Webhook 数据失败: {e}")
+            self.send_response(400); self.end_headers()
+            return
+        if isinstance(update, dict) and 'update_id' in update:
+            TELEGRAM_DISPATCHER.submit(update)
+        self.send_response(200); self.end_headers()
+
+    def do_POST(self):
+        """处理POST请求，解析Emby事件并写入持久化队列；Telegram Webhook 路径交给 handle_telegram_webhook。"""
+        if TELEGRAM_WEBHOOK_URL and self.path.split('?')[0] == TELEGRAM_WEBHOOK_PATH:
+            self.handle_telegram_webhook()
+            return
+        print("🔔 接收到 Webhook 请求。")
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data_bytes = self.rfile.read(content_length)
+
+            content_type = self.headers.get('Content-Type', '').lower()
+            json_string = None
+
+            if 'application/json' in content_type:
+                json_string = post_data_bytes.decode('utf-8')
+            elif 'application/x-www-form-urlencoded' in content_type:
+                parsed_form = parse_qs(post_data_bytes.decode('utf-8'))
+                json_string = parsed_form.get('data', [None])[0]
             else:
-                print(f"ℹ️ 未处理的事件类型：{event_type}")
-                self.send_response(204); self.end_headers()
+                print(f"❌ 不支持的 Content-Type: {content_type}")
+                self.send_response(400); self.end_headers()
                 return
 
+            if not json_string:
+                print("❌ Webhook 请求中没有数据。")
+                self.send_response(400); self.end_headers()
+                return
+
+            event_data = json.loads(unquote(json_string))
+            if not isinstance(event_data, dict) or not event_data.get('Event'):
+                print("❌ Webhook 数据格式无效：缺少 Event 字段。")
+                self.send_response(400); self.end_headers()
+                return
+
+            print("\n--- Emby Webhook 推送内容开始 ---\n")
+            print(json.dumps(event_data, indent=2, ensure_ascii=False))
+            print("\n--- Emby Webhook 推送内容结束 ---\n")
+
+            entry_id = WEBHOOK_JOURNAL.append(event_data)
+            print(f"📥 事件 {event_data.get('Event')} 已写入队列 (ID: {entry_id})，当前待处理: {len(WEBHOOK_JOURNAL)}")
+            self.send_response(202); self.end_headers()
+
+        except json.JSONDecodeError as e:
+            print(f"❌ 解析 Webhook JSON 失败: {e}")
+            self.send_response(400)
+            self.end_headers()
         except Exception as e:
-            print(f"❌ 处理 Webhook 时发生错误: {e}")
+            print(f"❌ 接收 Webhook 时发生错误: {e}")
             traceback.print_exc()
             self.send_response(500)
             self.end_headers()
 
+
 class QuietWebhookHandler(WebhookHandler):
     """一个安静的Webhook处理程序，不打印常规的HTTP日志。"""
     def log_message(self, format, *args):
         pass
 
-def run_server(server_class=HTTPServer, handler_class=WebhookHandler, port=8080):
+class PooledHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    使用有界线程池并发处理请求的HTTP服务器：
+    - 最多 max_workers 个请求同时处理
+    - 排队中的连接超过 max_pending 时，接收线程阻塞等待，由内核 backlog 承担背压
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_workers=8, max_pending=64):
+        self.request_queue_size = max(128, max_workers + max_pending)  # listen backlog，默认的 5 在突发请求下会导致连接被重置
+        super().__init__(server_address, handler_class)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._process_request_in_pool, request, client_address)
+        except Exception:
+            self._slots.release()
+            self.shutdown_request(request)
+            raise
+
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+def run_server(server_class=PooledHTTPServer, handler_class=WebhookHandler, port=8080):
     """启动HTTP服务器。"""
     server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f"🚀 服务器已在 http://0.0.0.0:{port} 启动...")
+    if issubclass(server_class, PooledHTTPServer):
+        httpd = server_class(server_address, handler_class, max_workers=WEBHOOK_MAX_WORKERS, max_pending=WEBHOOK_MAX_PENDING)
+        print(f"🚀 服务器已在 http://0.0.0.0:{port} 启动（并发处理数: {WEBHOOK_MAX_WORKERS}，最大排队数: {WEBHOOK_MAX_PENDING}）...")
+    else:
+        httpd = server_class(server_address, handler_class)
+        print(f"🚀 服务器已在 http://0.0.0.0:{port} 启动...")
     httpd.serve_forever()
 
 if __name__ == '__main__':
     if not EMBY_USER_ID:
         print("="*60 + "\n⚠️ 严重警告：在 config.yaml 中未找到 'user_id' 配置。\n 这可能导致部分需要用户上下文的 Emby API 请求失败。\n 强烈建议配置一个有效的用户ID以确保所有功能正常运作。\n" + "="*60)
 
-    telegram_poll_thread = threading.Thread(target=poll_telegram_updates, daemon=True)
-    telegram_poll_thread.start()
+    TASK_SCHEDULER.start()
+    TELEGRAM_OUTBOX.start()
+    POSTER_CACHE.start()
+    TMDB_CACHE_STORE.start()
+    IP_GEO_CACHE_STORE.start()
+    TELEGRAM_FILE_ID_STORE.start()
+    LOCAL_POSTER_STORE.start()
+    if os.path.exists(IP_DB_PATH):
+        TASK_SCHEDULER.schedule(0, reload_local_ip_database)
+    TASK_SCHEDULER.schedule(CACHE_SWEEP_INTERVAL, sweep_registered_caches, CACHE_SWEEP_INTERVAL)
+    if LIBRARY_INDEX_ENABLED and EMBY_USER_ID:
+        EMBY_LIBRARY_INDEX.start(LIBRARY_INDEX_SYNC_INTERVAL)
+    MESSAGE_DELETIONS_STORE.start()
+    MESSAGE_DELETIONS.load()
+    WEBHOOK_JOURNAL.load()
+    webhook_worker_thread = threading.Thread(target=process_webhook_journal, daemon=True)
+    webhook_worker_thread.start()
+
+    if TELEGRAM_WEBHOOK_URL and set_telegram_webhook():
+        print(f"🤖 Telegram 使用 Webhook 推送模式，接收路径: {TELEGRAM_WEBHOOK_PATH}")
+    else:
+        telegram_poll_thread = threading.Thread(target=poll_telegram_updates, daemon=True)
+        telegram_poll_thread.start()
 
     run_server(handler_class=QuietWebhookHandler)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+IP 地理位置查询基准测试：生成 N 个地址段（默认 200000）的本地数据文件，统计 LocalIPDatabase 的加载耗时
+和随机查询的 p50/p99 延迟，并与逐段线性扫描做对比。
+加上 --http 参数时，再对各 HTTP 接口（baidu/pconline/vore/ipapi，配置了 Token 时包括 ip138）各发起若干次真实查询
+（需要外网），统计每次查询的耗时和失败次数。
+
+用法：python bench/ip_lookup_bench.py [地址段数] [--http [每个接口的查询次数]]
+"""
+import os
+import sys
+import io
+import time
+import random
+import tempfile
+import ipaddress
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+
+PUBLIC_SAMPLE_IPS = ['114.114.114.114', '223.5.5.5', '119.29.29.29', '180.76.76.76', '8.8.8.8', '1.1.1.1', '202.96.128.86', '61.139.2.69']
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def write_ranges(path, count):
+    """把 IPv4 空间均分为 count 段写入数据文件，格式与 ip2region 源数据一致。"""
+    step = (2 ** 32) // count
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            start = i * step
+            end = (2 ** 32 - 1) if i == count - 1 else start + step - 1
+            f.write(f"{ipaddress.IPv4Address(start)}|{ipaddress.IPv4Address(end)}|中国|0|省份{i % 34}|城市{i % 300}|电信\n")
+
+
+def bench_local(count, workdir):
+    path = os.path.join(workdir, 'ip.txt')
+    write_ranges(path, count)
+    db = app.LocalIPDatabase()
+    started = time.perf_counter()
+    loaded = db.load(path)
+    load_time = time.perf_counter() - started
+
+    ips = [str(ipaddress.IPv4Address(random.getrandbits(32))) for _ in range(100000)]
+    latencies = []
+    for ip in ips:
+        t = time.perf_counter()
+        db.lookup(ip)
+        latencies.append(time.perf_counter() - t)
+    print(f"LocalIPDatabase：加载 {loaded} 个地址段耗时 {load_time:.2f} 秒")
+    print(f"  查询 {len(ips)} 次  p50 {percentile(latencies, 50) * 1e6:.1f} µs  p99 {percentile(latencies, 99) * 1e6:.1f} µs")
+
+    starts, ends, locations = list(db._starts), list(db._ends), db._locations
+    latencies = []
+    for ip in ips[:200]:
+        t = time.perf_counter()
+        value = int(ipaddress.IPv4Address(ip))
+        next((locations[i] for i in range(len(starts)) if starts[i] <= value <= ends[i]), None)
+        latencies.append(time.perf_counter() - t)
+    print(f"  线性扫描对比（{len(latencies)} 次）  p50 {percentile(latencies, 50) * 1000:.2f} ms  p99 {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+def bench_http(samples):
+    providers = ['baidu', 'pconline', 'vore', 'ipapi']
+    if app.CONFIG.get('settings', {}).get('ip_api_token_ip138'):
+        providers.insert(1, 'ip138')
+    for name in providers:
+        geo_func = app.IP_GEO_PROVIDERS[name]
+        latencies = []
+        failures = 0
+        for i in range(samples):
+            ip = PUBLIC_SAMPLE_IPS[i % len(PUBLIC_SAMPLE_IPS)]
+            t = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    result = geo_func(ip)
+                except Exception:
+                    result = None
+            latencies.append(time.perf_counter() - t)
+            if not result or result.startswith("未知位置"):
+                failures += 1
+        print(f"HTTP 接口 {name}：查询 {samples} 次，失败 {failures} 次  p50 {percentile(latencies, 50) * 1000:.0f} ms  p99 {percentile(latencies, 99) * 1000:.0f} ms")
+
+
+def main():
+    args = sys.argv[1:]
+    http_samples = 0
+    if '--http' in args:
+        index = args.index('--http')
+        rest = args[index + 1:]
+        http_samples = int(rest[0]) if rest and rest[0].isdigit() else 5
+        args = args[:index]
+    count = int(args[0]) if args else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_local(count, tmp)
+    if http_samples:
+        bench_http(http_samples)
+
+
+if __name__ == '__main__':
+    main()
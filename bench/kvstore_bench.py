@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+PersistentKVStore 基准测试：写入 N 条（默认 100000）后统计写入延迟、SQLite 提交次数和读取延迟，
+并与旧版“每次写入整体重写 JSON 文件”的方式做对比（JSON 方式只实测 20 次写入后线性估算）。
+
+用法：python bench/kvstore_bench.py [条目数]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import PersistentKVStore
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def bench_kvstore(n, workdir):
+    store = PersistentKVStore(os.path.join(workdir, 'bench.db'))
+    commits = [0]
+    original_flush = store.flush
+
+    def counting_flush():
+        written = original_flush()
+        if written:
+            commits[0] += 1
+        return written
+
+    store.flush = counting_flush
+    store.start()
+    value = {'url': 'https://image.tmdb.org/t/p/w500/abcdefghijklmnop.jpg', 'timestamp': time.time()}
+    put_latencies = []
+    started = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        store.put(f'movie_{i}', value, ttl=86400)
+        put_latencies.append(time.perf_counter() - t)
+    put_total = time.perf_counter() - started
+    store.flush()
+
+    get_latencies = []
+    for key in random.sample(range(n), min(n, 10000)):
+        t = time.perf_counter()
+        store.get(f'movie_{key}')
+        get_latencies.append(time.perf_counter() - t)
+
+    print(f"PersistentKVStore：写入 {n} 条耗时 {put_total:.2f} 秒，SQLite 提交 {commits[0]} 次")
+    print(f"  put  p50 {percentile(put_latencies, 50) * 1e6:.1f} µs  p99 {percentile(put_latencies, 99) * 1e6:.1f} µs")
+    print(f"  get  p50 {percentile(get_latencies, 50) * 1e6:.1f} µs  p99 {percentile(get_latencies, 99) * 1e6:.1f} µs")
+    size = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir) if name.startswith('bench.db'))
+    print(f"  数据库大小（含 WAL）{size / 1048576:.1f} MB")
+
+
+def bench_json_rewrite(n, workdir):
+    sample = max(1, min(20, n // 100))
+    path = os.path.join(workdir, 'bench.json')
+    data = {f'movie_{i}': {'url': 'https://image.tmdb.org/t/p/w500/abcdefghijklmnop.jpg', 'timestamp': time.time()} for i in range(n - sample)}
+    started = time.perf_counter()
+    for i in range(sample):
+        data[f'new_{i}'] = {'url': '', 'timestamp': time.time()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    per_write = (time.perf_counter() - started) / sample
+    print(f"整体重写 JSON（{n} 条规模）：每次写入 {per_write * 1000:.1f} ms，估算写入 {n} 条需 {per_write * n:.0f} 秒")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_kvstore(count, tmp)
+        bench_json_rewrite(count, tmp)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+剧集季规格查询基准测试：在本地启动一个模拟 Emby 的 HTTP 服务（每个请求附加固定延迟），
+分别统计 1、10、50 季剧集下 get_series_season_media_info（一次递归查询）与旧版逐季查询
+（列出季 → 每季取一集 → 再查询该集媒体源）的请求次数和耗时。
+
+用法：python bench/season_specs_bench.py [每个请求的模拟延迟毫秒] [每季集数]
+"""
+import os
+import sys
+import io
+import json
+import time
+import threading
+import contextlib
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+
+MEDIA_SOURCES = [{'MediaStreams': [
+    {'Type': 'Video', 'Codec': 'hevc', 'Width': 3840, 'Height': 2160, 'BitRate': 25000000, 'VideoRange': 'HDR'},
+    {'Type': 'Audio', 'Codec': 'eac3', 'Language': 'eng', 'Channels': 6},
+    {'Type': 'Subtitle', 'Codec': 'subrip', 'Language': 'chi'},
+]}]
+
+
+class FakeEmby:
+    """按剧集 ID 生成季和分集数据，记录收到的请求次数。"""
+
+    def __init__(self, delay, episodes_per_season):
+        self.delay = delay
+        self.episodes_per_season = episodes_per_season
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def seasons(self, series_id):
+        count = int(series_id.split('-')[1])
+        return [{'Id': f'{series_id}-s{n}', 'Type': 'Season', 'IndexNumber': n} for n in range(1, count + 1)]
+
+    def episodes(self, season_id, with_sources):
+        season_num = int(season_id.rsplit('-s', 1)[1])
+        items = []
+        for n in range(1, self.episodes_per_season + 1):
+            item = {'Id': f'{season_id}-e{n}', 'Type': 'Episode', 'ParentIndexNumber': season_num, 'IndexNumber': n}
+            if with_sources:
+                item['MediaSources'] = MEDIA_SOURCES
+            items.append(item)
+        return items
+
+    def handle(self, path, query):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.delay)
+        parts = path.strip('/').split('/')
+        with_sources = 'MediaSources' in query.get('Fields', [''])[0]
+        if len(parts) == 4:
+            item_id = parts[3]
+            episode = item_id.rsplit('-e', 1)[1]
+            return {'Id': item_id, 'Type': 'Episode', 'IndexNumber': int(episode), 'MediaSources': MEDIA_SOURCES if with_sources else []}
+        parent_id = query['ParentId'][0]
+        item_type = query.get('IncludeItemTypes', [''])[0]
+        if item_type == 'Season':
+            items = self.seasons(parent_id)
+        elif '-s' in parent_id:
+            items = self.episodes(parent_id, with_sources)
+        else:
+            items = [e for s in self.seasons(parent_id) for e in self.episodes(s['Id'], with_sources)]
+        if 'Limit' in query:
+            items = items[:int(query['Limit'][0])]
+        return {'Items': items, 'TotalRecordCount': len(items)}
+
+
+def make_handler(emby):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            body = json.dumps(emby.handle(parsed.path, parse_qs(parsed.query))).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def legacy_season_media_info(series_id):
+    """旧版实现：列出季，每季取一集，再单独查询该集的媒体源（共 2N+1 次请求）。"""
+    request_user_id = app.EMBY_USER_ID
+    items_url = f"{app.EMBY_SERVER_URL}/Users/{request_user_id}/Items"
+    seasons_response = app.make_request_with_retry('GET', items_url, params={'api_key': app.EMBY_API_KEY, 'ParentId': series_id, 'IncludeItemTypes': 'Season'}, timeout=10)
+    season_info_lines = []
+    for season in sorted(seasons_response.json().get('Items', []), key=lambda s: s.get('IndexNumber', 0)):
+        season_num, season_id = season.get('IndexNumber'), season.get('Id')
+        episodes_params = {'api_key': app.EMBY_API_KEY, 'ParentId': season_id, 'IncludeItemTypes': 'Episode', 'Limit': 1, 'Fields': 'Id'}
+        episodes_response = app.make_request_with_retry('GET', items_url, params=episodes_params, timeout=10)
+        season_line = f"S{season_num:02d}：\n    规格未知"
+        if episodes_response and episodes_response.json().get('Items'):
+            stream_details = app.get_media_stream_details(episodes_response.json()['Items'][0].get('Id'), request_user_id, fresh=True)
+            if stream_details:
+                parts = app.format_stream_details_message(stream_details, is_season_info=True, prefix='series')
+                season_line = f"S{season_num:02d}：\n" + "\n".join(app.escape_markdown(part) for part in parts)
+        season_info_lines.append(season_line)
+    return season_info_lines
+
+
+def measure(emby, func, series_id):
+    emby.requests = 0
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lines = func(series_id)
+    return emby.requests, time.perf_counter() - started, lines
+
+
+def main():
+    delay_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    episodes_per_season = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    emby = FakeEmby(delay_ms / 1000, episodes_per_season)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(emby))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.EMBY_SERVER_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    app.EMBY_API_KEY = 'bench'
+    app.EMBY_USER_ID = 'bench-user'
+
+    print(f"模拟 Emby：每个请求延迟 {delay_ms:.0f} ms，每季 {episodes_per_season} 集")
+    for seasons in (1, 10, 50):
+        series_id = f'series-{seasons}'
+        batched_requests, batched_time, batched_lines = measure(emby, app.get_series_season_media_info, series_id)
+        legacy_requests, legacy_time, legacy_lines = measure(emby, legacy_season_media_info, series_id)
+        same = '一致' if batched_lines == legacy_lines else '不一致'
+        print(f"{seasons:>2} 季：递归查询 {batched_requests} 次请求 {batched_time * 1000:.0f} ms；"
+              f"逐季查询 {legacy_requests} 次请求 {legacy_time * 1000:.0f} ms；输出{same}")
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Emby Webhook 应答延迟基准测试：并发发送 N 个 library.new/playback 事件，统计从发出请求到收到 202 的 p50/p99 延迟。
+分别测试 PooledHTTPServer（线程池 + 持久化队列）与单线程 HTTPServer，事件写入临时目录中的 WebhookJournal，
+后台线程模拟事件处理线程持续取出并确认事件。
+
+用法：python bench/webhook_ack_bench.py [请求数] [并发数]
+"""
+import os
+import sys
+import io
+import json
+import time
+import tempfile
+import threading
+import contextlib
+from http.server import HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import app
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def drain(journal, stop):
+    while not stop.is_set():
+        entry_id, _ = journal.get()
+        journal.ack(entry_id)
+
+
+def run(server, total, concurrency):
+    port = server.server_address[1]
+    url = f"http://127.0.0.1:{port}/"
+    event = {'Event': 'playback.start', 'Item': {'Id': '1', 'Type': 'Movie', 'Name': 'Bench'}, 'User': {'Name': 'bench'}}
+    body = json.dumps(event)
+    local = threading.local()
+
+    def post(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = session.post(url, data=body, headers={'Content-Type': 'application/json'}).status_code
+        except requests.RequestException:
+            status = None
+            local.session = None
+        return time.perf_counter() - started, status
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(post, range(total)))
+        wall = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+    latencies = [elapsed for elapsed, status in results if status == 202]
+    failed = sum(1 for _, status in results if status is None)
+    return latencies, failed, wall
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    with tempfile.TemporaryDirectory() as tmp:
+        app.WEBHOOK_JOURNAL = app.WebhookJournal(tmp)
+        app.WEBHOOK_JOURNAL.load()
+        stop = threading.Event()
+        threading.Thread(target=drain, args=(app.WEBHOOK_JOURNAL, stop), daemon=True).start()
+        servers = [
+            ('PooledHTTPServer', lambda: app.PooledHTTPServer(('127.0.0.1', 0), app.QuietWebhookHandler, max_workers=app.WEBHOOK_MAX_WORKERS, max_pending=app.WEBHOOK_MAX_PENDING)),
+            ('HTTPServer（单线程）', lambda: HTTPServer(('127.0.0.1', 0), app.QuietWebhookHandler)),
+        ]
+        for label, factory in servers:
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, failed, wall = run(factory(), total, concurrency)
+            if not latencies:
+                print(f"{label}：全部 {total} 个请求失败")
+                continue
+            print(f"{label}：{total} 个请求，并发 {concurrency}，成功 {len(latencies)}，连接失败 {failed}，耗时 {wall:.2f} 秒（{total / wall:.0f} 请求/秒）")
+            print(f"  应答延迟 p50 {percentile(latencies, 50) * 1000:.1f} ms  p99 {percentile(latencies, 99) * 1000:.1f} ms  最大 {max(latencies) * 1000:.1f} ms")
+        stop.set()
+
+
+if __name__ == '__main__':
+    main()